@@ -1,49 +1,128 @@
 import logging
-import machine
-import utime
-from m5stack import lcd
+import echonet
+import transport
+from metrics import Metrics
+try:
+    import ujson as json
+except ImportError:
+    import json
+try:
+    import utime
+    gmtime = utime.localtime  # MicroPython の RTC は UTC
+except ImportError:
+    import time as utime
+    gmtime = utime.gmtime
+try:
+    import uselect as select
+except ImportError:
+    try:
+        import select
+    except ImportError:
+        select = None
+from ticks import ticks_ms, ticks_add, ticks_diff, sleep_ms
+
+
+# 非同期モードでのみ使うので、使う時に読み込む
+asyncio = None
+
+
+def load_asyncio():
+    global asyncio
+    if asyncio is None:
+        try:
+            import uasyncio as asyncio
+        except ImportError:
+            import asyncio
+    return asyncio
+
+
+# 受信データの走査（bytes/bytearray をそのまま扱い、文字列を作らない）
+
+
+def startswith(data, prefix, n):
+    """
+    data[:n] が prefix で始まるか
+    """
+    if n < len(prefix):
+        return False
+    i = 0
+    while i < len(prefix):
+        if data[i] != prefix[i]:
+            return False
+        i += 1
+    return True
+
 
-# global variables
+def field(data, index, n):
+    """
+    空白区切りの index 番目（0始まり）の項目の開始位置（なければ -1）
+    """
+    i = 0
+    while index:
+        while i < n and data[i] != 0x20:
+            i += 1
+        if i >= n:
+            return -1
+        i += 1
+        index -= 1
+    return i
 
-logger = None
 
 # decoretor
 
 
+# ログの引数（decode/strip など）はそのレベルが有効な時だけ評価する
+
+
 def iofunc(func):
     def wrapper(obj, *args):
-        if (args):
-            logger.debug('> %s', args[0].strip())
+        debug = obj.logger.isEnabledFor(logging.DEBUG)
+        if args and debug:
+            obj.logger.debug('> %s', args[0].strip())
         response = func(obj, *args)
-        if (response):
-            logger.debug('< %s', response.decode().strip())
-        utime.sleep(0.5)
+        if response and debug:
+            obj.logger.debug('< %s', response.decode().strip())
+        obj.pause()
         return response
 
     return wrapper
 
 
 def skfunc(func):
+    name = func.__name__
+
     def wrapper(obj, *args, **kwds):
-        logger.debug('%s', func.__name__)
-        utime.sleep(0.5)
-        response = func(obj, *args, **kwds)
+        if obj.logger.isEnabledFor(logging.DEBUG):
+            obj.logger.debug('%s', name)
+        obj.pause()
+        start = ticks_ms()
+        try:
+            response = func(obj, *args, **kwds)
+        finally:
+            # コマンド毎の所要時間（タイムアウトを含む）
+            obj.metrics.since('command', name, start)
         if response:
-            logger.info('%s: Succeed', func.__name__)
+            if obj.logger.isEnabledFor(logging.INFO):
+                obj.logger.info('%s: Succeed', name)
         else:
-            logger.error('%s: Failed', func.__name__)
-        utime.sleep(0.5)
+            obj.logger.error('%s: Failed', name)
+        obj.pause()
         return response
 
     return wrapper
 
 
 def propfunc(func):
+    name = func.__name__
+
     def wrapper(obj, *args, **kwds):
-        logger.info('%s: %s', func.__name__, args)
+        info = obj.logger.isEnabledFor(logging.INFO)
+        if info:
+            obj.logger.info('%s: %s', name, args)
         response = func(obj, *args, **kwds)
-        logger.info('%s: %s', func.__name__, response)
-        utime.sleep(0.5)
+        if info:
+            obj.logger.info('%s: %s', name, response)
+        obj.pause()
         return response
 
     return wrapper
@@ -66,9 +145,11 @@ def days_of_year(y, m, d):
     return sum(t[:m - 1]) + d
 
 
-def localtime():
+def localtime(t=None):
     offset = 9 * 3600  # JST
-    return utime.localtime(utime.mktime(utime.localtime()) + offset)
+    if t is None:
+        t = utime.time()
+    return gmtime(int(t) + offset)
 
 
 def strftime(tm, *, fmt='{:04d}-{:02d}-{:02d} {:02d}:{:02d}:{:02d}'):
@@ -96,7 +177,86 @@ def last_colect_day(collect_mday):
     return strftime((year, month, collect_mday, 0, 0, 0))
 
 
+class ResponseTimeout(Exception):
+    """
+    応答待ちのタイムアウト（UARTの受信なし、ERXUDPの未着）
+    """
+
+
+# 障害の分類
+FAILURE_TIMEOUT = 'timeout'  # 応答のタイムアウト（1回）
+FAILURE_SILENCE = 'silence'  # ERXUDPが長時間届かない
+FAILURE_SESSION = 'session'  # PANAセッションの期限切れ・切断(EVENT 26-29)
+FAILURE_JOIN = 'join'  # 接続の失敗(EVENT 24)
+FAILURE_ERROR = 'error'  # その他（不可応答など）
+
+# 復旧の手順（安い順）
+RECOVERY_STEPS = ('retry', 'rejoin', 'll64', 'rescan')
+(RETRY, REJOIN, LL64, RESCAN) = range(4)
+
+# 障害の分類毎の最初の手順
+RECOVERY_START = {
+    FAILURE_TIMEOUT: RETRY,
+    FAILURE_ERROR: RETRY,
+    FAILURE_SILENCE: REJOIN,
+    FAILURE_SESSION: REJOIN,
+    FAILURE_JOIN: LL64,
+}
+
+
+class Transaction:
+    """
+    ECHONET Lite要求1件（TID単位）の応答待ち
+    """
+    def __init__(self, owner, tid, callback=None, *, kind='get', epcs=()):
+        self.owner = owner
+        self.tid = tid
+        self.callback = callback
+        # 計測用: 要求の種類('get'/'set')、EPC、送信時刻(ticks_ms)
+        self.kind = kind
+        self.epcs = epcs
+        self.sent = ticks_ms()
+        self.value = None
+        self.error = None
+        self.finished = False
+
+    def done(self):
+        return self.finished
+
+    def complete(self, value, error=None):
+        self.value = value
+        self.error = error
+        self.finished = True
+        if self.callback:
+            self.callback(self)
+
+    def result(self, timeout=None):
+        """
+        応答の取得（未着であれば受信するまで待つ）
+        """
+        if not self.finished:
+            self.owner.wait_for_data(self, timeout)
+        if self.error:
+            raise self.error
+        return self.value
+
+
 class BP35A1:
+    # コマンド送信後、次のコマンドまでに必要な間隔（ミリ秒、ファストモード時）
+    COMMAND_GAP = {'SKRESET': 500}
+    # 固定ウェイト（秒、ファストモード以外でコマンドの送信・1行の受信毎）
+    PAUSE = 0.5
+    # 応答待ちの時間（秒）: モジュール内で完結するコマンド、PING
+    COMMAND_TIMEOUT = 5
+    PING_TIMEOUT = 10
+    # 受信バッファの大きさ（E2/E4を一括で受信できる長さ）
+    LINE_SIZE = 1024
+    # この時間（秒）ERXUDPが届かなければ、タイムアウトを無通信(silence)とみなす
+    SILENCE_TIMEOUT = 120
+    # スキャンするチャンネル(33ch-60ch、マスクの0ビット目が33ch)と時間の上限
+    SCAN_CHANNELS = range(0x21, 0x3D)
+    MAX_SCAN_DURATION = 10
+
     def __init__(self,
                  id,
                  password,
@@ -104,13 +264,47 @@ class BP35A1:
                  collect_date,
                  *,
                  progress_func=None,
-                 logger_name=__name__):
-        global logger
-        logger = logging.getLogger(logger_name)
+                 logger_name=__name__,
+                 uart=None,
+                 fast=False,
+                 min_interval=0,
+                 session_file=None,
+                 clock=None):
+        self.logger = logging.getLogger(logger_name)
+        self.metrics = Metrics()
         self.progress = progress_func if progress_func else lambda _: None
 
-        self.uart = machine.UART(1, tx=0, rx=36)
-        self.uart.init(115200, bits=8, parity=None, stop=1, timeout=2000)
+        # 通信路（省略時は MicroPython の UART1）
+        if uart is None:
+            uart = transport.MicroPythonUART(1)
+        self.uart = uart
+        self.poller = None
+
+        # 受信バッファと解析結果（受信毎に再利用する）
+        self.line = bytearray(self.LINE_SIZE)
+        self.frame = echonet.Frame()
+        self.uart_readline_into = getattr(uart, 'readline_into', None)
+
+        # ファストモード: 固定ウェイトを省略し、応答の受信で完了とする
+        self.fast = fast
+        self.min_interval = min_interval
+        self.last_command = None
+
+        # 計測値の日時に使う時刻（UTC の秒、省略時は RTC の utime.time）
+        self.clock = clock if clock else utime.time
+
+        # 応答待ちのトランザクション(TID -> Transaction)
+        self.tid = 0
+        self.pending = {}
+
+        # 受信したプロパティ値(EPC -> (受信時刻, 値))と通知(INF)の購読者
+        self.cache = {}
+        self.subscribers = {}
+        # キャッシュを使用するEPCと有効期間（秒）
+        # 定時積算電力量(EA/EB)は、現在の30分コマの値であれば有効
+        self.max_age = {}
+        # 前回検針日 0:00 の積算電力量（((検針日, 取得した日付), kWh)）
+        self.baseline = None
 
         self.id = id
         self.password = password
@@ -122,45 +316,209 @@ class BP35A1:
         self.mac_addr = None
         self.lqi = None
 
+        # スキャンの手がかり（前回の (チャンネル, MACアドレス)）、
+        # チャンネル毎にメーターが見つかった回数、前回のスキャンの結果と時間
+        self.scan_hint = None
+        self.scan_history = {}
+        self.last_scan = None
+
         self.ipv6_addr = None
         self.power_coefficient = None
         self.power_unit = None
 
         self.timeout = 60
 
+        # スキャン・接続結果と係数を保存するファイル（高速な再接続用）
+        self.session_file = session_file
+
+        # 非同期モード(asyncio)のストリームとドライバの排他
+        self.reader = None
+        self.lock = None
+
+        # 障害からの復旧の状態
+        # last_rx: 最後にERXUDPを受信した時刻(ticks_ms)
+        # session_lost: PANAセッションの期限切れ・切断を受信した
+        # session_event: session_lost の原因のイベント番号（例: 0x34）
+        # failed_at: 最初の障害の時刻(ticks_ms、障害中でなければ None)
+        # recovery_step: 次の障害で試す復旧の手順
+        self.last_rx = ticks_ms()
+        self.session_lost = False
+        self.session_event = None
+        self.failed_at = None
+        self.recovery_step = RETRY
+
+    # セッション情報の保存項目
+    SESSION_KEYS = ('channel', 'pan_id', 'mac_addr', 'lqi', 'ipv6_addr',
+                    'power_coefficient', 'power_unit')
+
+    def load_session(self):
+        """
+        保存したセッション情報の読み込み
+        """
+        if not self.session_file:
+            return False
+        try:
+            with open(self.session_file) as f:
+                session = json.load(f)
+            self.scan_history = session.get('scan_history',
+                                            self.scan_history)
+            if not all(session.get(key) for key in self.SESSION_KEYS):
+                return False
+        except (OSError, ValueError) as e:
+            self.logger.debug('load_session: %s', e)
+            return False
+        for key in self.SESSION_KEYS:
+            setattr(self, key, session[key])
+        self.logger.info('load_session: %s', session)
+        return True
+
+    def save_session(self):
+        """
+        セッション情報の保存
+        """
+        if not self.session_file:
+            return
+        try:
+            session = {key: getattr(self, key) for key in self.SESSION_KEYS}
+            session['scan_history'] = self.scan_history
+            with open(self.session_file, 'w') as f:
+                json.dump(session, f)
+        except OSError as e:
+            self.logger.error('save_session: %s', e)
+
+    def clear_session(self):
+        """
+        セッション情報の破棄（スキャンからやり直す）
+        """
+        self.reset_scan()
+        self.ipv6_addr = self.power_coefficient = self.power_unit = None
+
     def flash(self):
-        utime.sleep(0.5)
+        self.pause()
         while self.uart.any():
             _ = self.uart.read()
         self.uart.write('\r\n')
-        utime.sleep(0.5)
+        self.pause()
+
+    def pause(self):
+        """
+        固定ウェイト（ファストモードでは省略）
+        """
+        if not self.fast:
+            utime.sleep(self.PAUSE)
+
+    def command_interval(self, cmd):
+        """
+        コマンド間隔の確保（ファストモード時）
+        """
+        if self.fast and self.last_command:
+            (last, sent) = self.last_command
+            gap = max(self.min_interval, self.COMMAND_GAP.get(last, 0))
+            wait = gap - ticks_diff(ticks_ms(), sent)
+            if wait > 0:
+                sleep_ms(wait)
+        self.last_command = (cmd.split(' ')[0], ticks_ms())
 
     def need_scan(self):
         return not (self.channel and self.pan_id and self.mac_addr
                     and self.lqi)
 
     def reset_scan(self):
+        # 次のスキャンでは前回のチャンネルとメーターを優先する
+        if self.channel and self.mac_addr:
+            self.scan_hint = (self.channel, self.mac_addr)
         self.channel = self.pan_id = self.mac_addr = self.lqi = None
 
-    @iofunc
-    def readln(self):
-        s = utime.time()
-        while utime.time() - s < self.timeout:
-            if self.uart.any():
-                return self.uart.readline()
-        raise Exception('BP35A1.readln() timeout.')
+    def deadline(self, timeout=None):
+        """
+        timeout秒後の時刻(ticks_ms)（省略時は self.timeout）
+        """
+        timeout = self.timeout if timeout is None else timeout
+        return ticks_add(ticks_ms(), int(timeout * 1000))
+
+    def wait_readable(self, timeout):
+        """
+        受信を待つ（timeout: ミリ秒）
+
+        通信路が wait() を持てばそれを、持たなければ poll で待ち、
+        どちらも使えない場合だけ 1ms 毎に確認する。
+        """
+        wait = getattr(self.uart, 'wait', None)
+        if wait:
+            wait(timeout)
+            return
+        if self.poller is None:
+            try:
+                self.poller = select.poll()
+                self.poller.register(getattr(self.uart, 'raw', self.uart),
+                                     select.POLLIN)
+            except Exception:
+                self.poller = False
+        if self.poller:
+            self.poller.poll(timeout)
+        else:
+            sleep_ms(min(timeout, 1))
+
+    def wait_line(self, deadline):
+        """
+        deadline(ticks_ms)まで受信を待つ（受信したら True）
+        """
+        while not self.uart.any():
+            remaining = ticks_diff(deadline, ticks_ms())
+            if remaining <= 0:
+                return False
+            self.wait_readable(remaining)
+        return True
+
+    def readln(self, timeout=None, *, deadline=None):
+        """
+        1行受信（timeout: 秒、deadline: ticks_ms、省略時は self.timeout）
+        """
+        if deadline is None:
+            deadline = self.deadline(timeout)
+        if not self.wait_line(deadline):
+            self.metrics.count('timeout')
+            raise ResponseTimeout('BP35A1.readln() timeout.')
+        ln = self.uart.readline()
+        self.metrics.count('bytes_in', len(ln) if ln else 0)
+        if self.logger.isEnabledFor(logging.DEBUG):
+            self.logger.debug('< %s', ln.decode().strip())
+        self.pause()
+        return ln
+
+    def readline_into(self):
+        """
+        1行を受信バッファ(self.line)に読み込む（バイト数、行がなければ 0）
+        """
+        if self.uart_readline_into:
+            n = self.uart_readline_into(self.line)
+        else:
+            ln = self.uart.readline()
+            n = len(ln) if ln else 0
+            self.line[:n] = ln
+        if not n:
+            # 行の途中まで受信済み
+            self.wait_readable(1)
+            return 0
+        self.metrics.count('bytes_in', n)
+        if self.logger.isEnabledFor(logging.DEBUG):
+            self.logger.debug('< %s', bytes(self.line[:n]).decode().strip())
+        return n
 
     @iofunc
     def write(self, data):
+        self.metrics.count('bytes_out', len(data))
         self.uart.write(data)
 
     @iofunc
     def writeln(self, data):
+        self.command_interval(data)
+        self.metrics.count('bytes_out', len(data) + 2)
         self.uart.write(data + '\r\n')
 
     def exec_command(self, cmd, arg=''):
         self.writeln(cmd + arg)
-        return self.wait_for_ok()
+        return self.wait_for_ok(self.COMMAND_TIMEOUT)
 
     @skfunc
     def skInit(self):
@@ -194,37 +552,103 @@ class BP35A1:
 
     @skfunc
     def skScan(self, duration=6):
-        while duration <= 10:
-            self.reset_scan()
-            self.writeln('SKSCAN 2 FFFFFFFF ' + str(duration))
-            while True:
-                ln = self.readln()
-                if ln.startswith('EVENT 22'):
+        """
+        スマートメーターのスキャン（アクティブスキャン）
+
+        前回のチャンネルと見つかったことのあるチャンネル（回数の多い順）を
+        1つずつ、時間を延ばしながら先にスキャンし、目的のメーター（前回と
+        同じMACアドレス、初回は最初に見つかったメーター）のEPANDESCを受信
+        したら終了する。残りのチャンネルはその後にまとめて（チャンネル
+        マスクで1回のSKSCANで）スキャンする。目的のメーターがなければ、
+        見つかった中でLQIの最も高いメーターを使う。
+        """
+        self.reset_scan()
+        (hint, target) = self.scan_hint if self.scan_hint else (None, None)
+        history = self.scan_history
+        preferred = sorted(history, key=lambda ch: -history[ch])
+        if hint:
+            preferred = [hint] + [ch for ch in preferred if ch != hint]
+        preferred = [int(ch, 16) for ch in preferred]
+        others = [ch for ch in self.SCAN_CHANNELS if ch not in preferred]
+        durations = range(duration, self.MAX_SCAN_DURATION + 1)
+
+        start = ticks_ms()
+        found = []
+        (scans, desc, d) = (0, None, duration)
+
+        # 前回・見つかったことのあるチャンネル
+        for d in durations:
+            for ch in preferred:
+                scans += 1
+                desc = self.scan_channels([ch], d, target, found)
+                if desc:
                     break
+            if desc:
+                break
+
+        # 残りのチャンネル（コマンドと固定ウェイトを減らすため一括で）
+        if not desc and others:
+            for d in durations:
+                scans += 1
+                desc = self.scan_channels(others, d, target, found)
+                if not desc and found:
+                    desc = max(found, key=lambda desc: int(desc[3], 16))
+                if desc:
+                    break
+                self.metrics.count('retry')
+
+        elapsed = ticks_diff(ticks_ms(), start)
+        self.last_scan = {
+            'channel': desc[0] if desc else None,
+            'duration': d,
+            'scans': scans,
+            'elapsed': elapsed
+        }
+        self.metrics.observe('session', 'scan', elapsed)
+        self.metrics.count('scan_channels', scans)
+        if not desc:
+            return False
+        (self.channel, self.pan_id, self.mac_addr, self.lqi) = desc
+        history[self.channel] = history.get(self.channel, 0) + 1
+        return True
 
-                if ':' in ln:
-                    key, val = ln.decode().strip().split(':')[:2]
-                    if key == 'Channel':
-                        self.channel = val
-                    elif key == 'Pan ID':
-                        self.pan_id = val
-                    elif key == 'Addr':
-                        self.mac_addr = val
-                    elif key == 'LQI':
-                        self.lqi = val
-
-            if self.channel and self.pan_id and self.mac_addr and self.lqi:
-                return True
-
-            duration = duration + 1
+    def scan_channels(self, channels, duration, target, found):
+        """
+        チャンネル（channels、1回のSKSCAN）のスキャン
 
-        return False
+        見つかったメーター (チャンネル, PAN ID, MACアドレス, LQI) を found に
+        追加し、目的のメーター（target が None ならどれでも）であれば返す。
+        """
+        mask = 0
+        for channel in channels:
+            mask |= 1 << (channel - 0x21)
+        self.writeln('SKSCAN 2 {:08X} {}'.format(mask, duration))
+        deadline = self.deadline()
+        (desc, match) = ({}, None)
+        while True:
+            ln = self.readln(deadline=deadline)
+            if ln.startswith(b'EVENT 22'):
+                break
+            if ln.startswith(b'EPANDESC'):
+                desc = {}
+            elif b':' in ln:
+                key, val = ln.decode().strip().split(':')[:2]
+                desc[key] = val
+                if key == 'LQI' and all(
+                        k in desc for k in ('Channel', 'Pan ID', 'Addr')):
+                    result = (desc['Channel'], desc['Pan ID'], desc['Addr'],
+                              val)
+                    found.append(result)
+                    if match is None and target in (None, result[2]):
+                        match = result
+        return match
 
     @skfunc
     def skLL64(self):
         self.writeln('SKLL64 ' + self.mac_addr)
+        deadline = self.deadline(self.COMMAND_TIMEOUT)
         while True:
-            ln = self.readln()
+            ln = self.readln(deadline=deadline)
             val = ln.decode().strip()
             if val:
                 self.ipv6_addr = val
@@ -233,8 +657,9 @@ class BP35A1:
     @skfunc
     def skPing(self):
         self.writeln('SKPING ' + self.ipv6_addr)
+        deadline = self.deadline(self.PING_TIMEOUT)
         while True:
-            ln = self.readln()
+            ln = self.readln(deadline=deadline)
             val = ln.decode().strip()
             if val.startswith('EPONG'):
                 return True
@@ -242,53 +667,106 @@ class BP35A1:
     @skfunc
     def skJoin(self):
         self.writeln('SKJOIN ' + self.ipv6_addr)
+        deadline = self.deadline()
         while True:
-            ln = self.readln()
-            if ln.startswith('EVENT 24'):
+            ln = self.readln(deadline=deadline)
+            if ln.startswith(b'EVENT 24'):
                 return False
-            elif ln.startswith('EVENT 25'):
+            elif ln.startswith(b'EVENT 25'):
                 return True
 
     @skfunc
     def skSendTo(self, data):
+        self.command_interval('SKSENDTO')
         self.write('SKSENDTO 1 {0} 0E1A 1 {1:04X} '.format(
             self.ipv6_addr, len(data)))
         self.write(data)
         return True
 
-    @propfunc
     def read_propaty(self, epc):
         """
         プロパティ値読み出し
         """
-        self.skSendTo((
-            b'\x10\x81'  # EHD
-            b'\x00\x01'  # TID
-            b'\x05\xFF\x01'  # SEOJ
-            b'\x02\x88\x01'  # DEOJ 低圧スマート電力量メータークラス
-            b'\x62'  # ESV プロパティ値読み出し(62)
-            b'\x01'  # OPC 1個
-        ) + bytes([int(epc, 16)]) + (
-            b'\x00'  # PDC Read
-        ))
-        return self.wait_for_data()
+        return self.read_properties([epc])[0]
+
+    @propfunc
+    def read_properties(self, epcs):
+        """
+        複数プロパティ値の一括読み出し
+
+        Parameters
+        ----------
+        epcs : list of str
+            読み出すプロパティ(EPC)のリスト（例: ['E7', 'E8', 'EA']）
+
+        Returns
+        -------
+        values: tuple
+            EPCの順に並べたプロパティ値
+        """
+        properties = self.get_properties(epcs).result()
+        for epc in epcs:
+            if epc not in properties:
+                raise Exception(
+                    'BP35A1.read_properties() {} not found.'.format(epc))
+        return tuple(properties[epc] for epc in epcs)
 
     @propfunc
     def write_property(self, epc, value):
         """
         プロパティ値書き込み
         """
-        self.skSendTo((
-            b'\x10\x81'  # EHD
-            b'\x00\x01'  # TID
-            b'\x05\xFF\x01'  # SEOJ
-            b'\x02\x88\x01'  # DEOJ 低圧スマート電力量メータークラス
-            b'\x61'  # ESV プロパティ値書き込み(61)
-            b'\x01'  # OPC 1個
-        ) + bytes([int(epc, 16)]) + (
-            b'\x01'  # PDC Write
-        ) + bytes([value]))
-        return self.wait_for_data()
+        return self.set_property(epc, value).result()[epc]
+
+    def get_properties(self, epcs, callback=None):
+        """
+        プロパティ値読み出し要求の送信（応答を待たない）
+
+        Parameters
+        ----------
+        epcs : list of str
+            読み出すプロパティ(EPC)のリスト
+        callback : function
+            応答受信時に呼び出す関数（引数は Transaction）
+
+        Returns
+        -------
+        transaction: Transaction
+            応答待ちのトランザクション
+        """
+        tid = self.next_tid()
+        return self.send_frame(tid,
+                               echonet.get_frame(tid, epcs),
+                               callback,
+                               kind='get',
+                               epcs=epcs)
+
+    def set_property(self, epc, value, callback=None):
+        """
+        プロパティ値書き込み要求の送信（応答を待たない）
+        """
+        tid = self.next_tid()
+        return self.send_frame(tid,
+                               echonet.set_frame(tid, epc, value),
+                               callback,
+                               kind='set',
+                               epcs=(epc, ))
+
+    def next_tid(self):
+        """
+        トランザクションID(TID)の払い出し
+        """
+        self.tid = self.tid % 0xFFFF + 1
+        return self.tid
+
+    def send_frame(self, tid, frame, callback=None, **kwds):
+        """
+        ECHONET Liteフレームの送信とトランザクションの登録
+        """
+        transaction = Transaction(self, tid, callback, **kwds)
+        self.pending[tid] = transaction
+        self.skSendTo(frame)
+        return transaction
 
     def open(self):
         """
@@ -297,6 +775,7 @@ class BP35A1:
         # バッファをクリア
         self.progress(0)
         self.flash()
+        start = ticks_ms()
 
         # BP53A1の初期化
         self.progress(10)
@@ -308,7 +787,27 @@ class BP35A1:
         if not (self.skSetPasswd() and self.skSetID()):
             return False
 
+        # 保存したセッション情報で直接接続
+        if self.load_session():
+            try:
+                self.progress(60)
+                if self.skSetChannel() and self.skSetPanID():
+                    self.progress(70)
+                    if self.skJoin():
+                        self.progress(100)
+                        self.metrics.since('session', 'resume', start)
+                        return (self.channel, self.pan_id, self.mac_addr,
+                                self.lqi)
+            except Exception as e:
+                self.logger.error(e)
+            # スキャンからやり直す
+            self.clear_session()
+
+        retry = False
         while True:
+            if retry:
+                self.metrics.count('retry')
+            retry = True
             try:
                 # スマートメーターのスキャン
                 self.progress(40)
@@ -341,17 +840,127 @@ class BP35A1:
                 self.progress(90)
                 self.power_unit = self.read_propaty('E1')
 
+                # セッション情報の保存
+                self.save_session()
+
                 self.progress(100)
+                self.metrics.since('session', 'open', start)
                 return (self.channel, self.pan_id, self.mac_addr, self.lqi)
 
             except Exception as e:
-                logger.error(e)
+                self.logger.error(e)
+
+    # 障害からの復旧
+    #
+    # 障害を分類し、安い手順から順に試す: 再試行(何もしない) -> 再接続
+    # (SKJOIN) -> IPv6アドレスの再取得(SKLL64) -> 再スキャン。失敗が続けば
+    # 次の障害では1段上の手順から始め、応答を受信したら最初に戻る。
+
+    def classify(self, e=None):
+        """
+        障害の分類（FAILURE_*）
+        """
+        if self.session_lost:
+            if self.session_event == 0x34:
+                return FAILURE_JOIN
+            return FAILURE_SESSION
+        if isinstance(e, ResponseTimeout):
+            if ticks_diff(ticks_ms(),
+                          self.last_rx) > self.SILENCE_TIMEOUT * 1000:
+                return FAILURE_SILENCE
+            return FAILURE_TIMEOUT
+        return FAILURE_ERROR
+
+    def recover(self, e=None):
+        """
+        障害からの復旧
+
+        Parameters
+        ----------
+        e : Exception
+            発生した障害（分類に使う）
+
+        Returns
+        -------
+        recovered: bool
+            復旧した（再試行してよい）か。False の場合は再スキャンまで
+            失敗しており、呼び出し側で再起動などを行う
+        """
+        failure = self.classify(e)
+        self.metrics.count('failure.' + failure)
+        if self.failed_at is None:
+            self.failed_at = ticks_ms()
+
+        # 応答待ちのトランザクションは破棄（再接続後の応答は届かない）
+        self.pending.clear()
+
+        step = max(RECOVERY_START[failure], self.recovery_step)
+        while step <= RESCAN:
+            name = RECOVERY_STEPS[step]
+            self.logger.info('recover: %s (%s)', name, failure)
+            self.metrics.count('recovery.' + name)
+            start = ticks_ms()
+            try:
+                ok = self.recovery_action(step)
+            except Exception as ex:
+                self.logger.error('recover: %s', ex)
+                ok = False
+            self.metrics.since('session', name, start)
+            if ok:
+                # 次も失敗すれば1段上の手順から
+                self.recovery_step = min(step + 1, RESCAN)
+                return True
+            step += 1
+
+        self.metrics.count('recovery.failed')
+        self.recovery_step = RESCAN
+        return False
+
+    def recovery_action(self, step):
+        """
+        復旧の手順の実行（成功すれば True）
+        """
+        if step == RETRY:
+            return True
+        if step == REJOIN:
+            return self.rejoin()
+        if step == LL64:
+            return self.skLL64() and self.rejoin()
+        # 再スキャン（係数・単位は同じメーターなので保持する）
+        self.reset_scan()
+        if not (self.skScan() and self.skLL64()):
+            return False
+        if self.rejoin():
+            self.save_session()
+            return True
+        return False
+
+    def rejoin(self):
+        """
+        PANAセッションの再接続
+        """
+        self.poll()
+        if not (self.skSetChannel() and self.skSetPanID() and self.skJoin()):
+            return False
+        self.session_lost = False
+        return True
+
+    def recovered(self):
+        """
+        復旧の完了（障害から最初の応答を受信するまでの時間を記録）
+        """
+        self.metrics.since('session', 'recovery', self.failed_at)
+        self.failed_at = None
+        self.recovery_step = RETRY
+        if self.logger.isEnabledFor(logging.INFO):
+            self.logger.info('recovered')
 
     def total_power(self):
         """
-        積算電力量計測値(EA)の取得
+        積算電力量計測値(EA)の取得（有効なキャッシュ・通知があればそれを返す）
         """
-        return self.read_propaty('EA')
+        self.poll()
+        return self.cached('EA') or self.read_propaty('EA')
 
     def instantaneous_power(self):
         """
@@ -365,118 +974,423 @@ class BP35A1:
         """
         return self.read_propaty('E8')
 
-    def monthly_power(self):
+    def instantaneous_values(self):
         """
-        前回検針日を起点とした積算電力量計測値履歴１(E2)の取得
+        瞬時電流計測値(E8)と瞬時電力計測値(E7)の一括取得
         """
-        # 積算履歴収集日１(E5)の設定
-        self.write_property('E5', days_after_collect(self.collect_date))
+        ((_, amperage),
+         (created, power)) = self.read_properties(['E8', 'E7'])
+        return created, amperage, power
 
-        # 積算電力量計測値履歴１(E2)の取得
-        (days, collected_power) = self.read_propaty('E2')
+    def baseline_key(self):
+        """
+        検針日の積算電力量の有効範囲（検針日と今日の日付）
+        """
+        return (self.collect_date, localtime()[:3])
+
+    def collected_power(self):
+        """
+        前回検針日 0:00 の積算電力量（日付が変わるか検針日が変わるまで保持）
+        """
+        key = self.baseline_key()
+        if self.baseline and self.baseline[0] == key:
+            return self.baseline[1]
 
-        # 瞬時電力計測値(E7)の取得
-        (created, power) = self.read_propaty('EA')
+        # 積算履歴収集日１(E5)を設定し、積算電力量計測値履歴１(E2)を取得
+        # E2の先頭コマが前回検針日 0:00 の積算電力量
+        self.write_property('E5', days_after_collect(self.collect_date))
+        (days, history) = self.read_propaty('E2')
+        if history[0] is None:
+            raise Exception('BP35A1.collected_power() no data')
+        self.baseline = (key, history[0])
+        return history[0]
+
+    def monthly_power(self):
+        """
+        前回検針日を起点とした電力量の取得
+        （検針日の積算電力量はキャッシュし、通常は積算電力量(EA)の取得のみ）
+        """
+        collected_power = self.collected_power()
+        (created, power) = self.total_power()
 
         # 前回検針日と積算電力量計測値(EA)との差分
         return (last_colect_day(self.collect_date), power - collected_power)
 
+    def history(self, days=1, *, start=0, epcs=('E2', )):
+        """
+        積算電力量計測値履歴１(E2/E4)の取得（30分毎、1日48コマ）
+
+        Parameters
+        ----------
+        days : int
+            取得する日数
+        start : int
+            取得を開始する日（0:当日、1:前日、...、99まで）
+        epcs : tuple of str
+            取得する履歴（'E2':正方向、'E4':逆方向）
+
+        Yields
+        ------
+        (datetime, value, ...): tuple
+            コマの日時と、epcsの順に並べた積算電力量(kWh)
+            （古い順、未計測のコマは返さない）
+        """
+        midnight = utime.mktime(localtime()[:3] + (0, 0, 0, 0, 0, -1))
+        for day in range(min(start + days, 100) - 1, start - 1, -1):
+            # 積算履歴収集日１(E5)の設定
+            self.write_property('E5', day)
+
+            histories = [
+                values
+                for (_, values) in self.read_properties(list(epcs))
+            ]
+            for slot in range(48):
+                values = tuple(history[slot] for history in histories)
+                if None in values:
+                    continue
+                tm = utime.localtime(midnight - day * 86400 + slot * 1800)
+                yield (strftime(tm), ) + values
+
     def close(self):
         """
         スマートメーターとの接奥解除
         """
         self.skTerm()
 
-    def wait_for_ok(self):
+    def wait_for_ok(self, timeout=None):
+        deadline = self.deadline(timeout)
         while True:
-            ln = self.readln()
-            if ln.startswith('OK'):
+            ln = self.readln(deadline=deadline)
+            if ln.startswith(b'OK'):
                 return True
-            elif ln.startswith('FAIL'):
+            elif ln.startswith(b'FAIL'):
+                self.metrics.count('fail')
                 return False
 
-    def wait_for_data(self):
+    def timestamp(self):
+        """
+        計測値に付与する日時
+        """
+        return strftime(localtime(self.clock()))
+
+    def wait_for_data(self, transaction, timeout=None):
+        """
+        トランザクションの応答待ち（他のトランザクションの応答も振り分ける）
+        """
+        deadline = self.deadline(timeout)
+        while not transaction.done():
+            if not self.wait_line(deadline):
+                self.pending.pop(transaction.tid, None)
+                self.metrics.count('timeout')
+                raise ResponseTimeout('BP35A1.wait_for_data() timeout.')
+            n = self.readline_into()
+            if n:
+                self.dispatch(self.line, n)
+                if self.session_lost:
+                    # セッションが切れたので応答は届かない
+                    self.pending.pop(transaction.tid, None)
+                    raise Exception('BP35A1.wait_for_data() session lost.')
+        return transaction.value
+
+    def poll(self):
+        """
+        受信済みの行を振り分ける（応答待ちのトランザクション、通知）
+        """
+        while self.uart.any():
+            n = self.readline_into()
+            if not n:
+                break
+            self.dispatch(self.line, n)
+        return len(self.pending)
+
+    def subscribe(self, epc, callback):
+        """
+        プロパティ値通知(INF)の購読
+
+        Parameters
+        ----------
+        epc : str
+            通知を受け取るプロパティ（例: 'EA'）
+        callback : function
+            通知を受信した時に呼び出す関数（引数は EPC とプロパティ値）
+        """
+        self.subscribers.setdefault(epc, []).append(callback)
+
+    def unsubscribe(self, epc, callback):
+        if callback in self.subscribers.get(epc, []):
+            self.subscribers[epc].remove(callback)
+
+    def cached(self, epc, max_age=None):
+        """
+        キャッシュしたプロパティ値（有効期間を過ぎていればNone）
+        """
+        if epc not in self.cache:
+            return None
+        (received, value) = self.cache[epc]
+        if max_age is None and epc in ('EA', 'EB'):
+            return value if value[0] == self.current_slot() else None
+        max_age = self.max_age.get(epc, 0) if max_age is None else max_age
+        if ticks_diff(ticks_ms(), received) > max_age * 1000:
+            return None
+        return value
+
+    def current_slot(self):
+        """
+        現在の30分コマの開始日時（定時積算電力量の計測日時と同じ形式）
+        """
+        tm = localtime(self.clock())
+        return strftime(tm[:4] + (tm[4] // 30 * 30, 0))
+
+    def update_cache(self, values):
+        now = ticks_ms()
+        for (epc, value) in values.items():
+            self.cache[epc] = (now, value)
+
+    def dispatch(self, ln, n=None):
+        """
+        ERXUDPをTIDで応答待ちのトランザクションへ振り分ける
+        （プロパティ値通知は購読者へ配信する）
+
+        ln は受信した行（bytes、または受信バッファと長さ n）。
+        応答待ちのトランザクションが見つかるまで、ヒープを使わずに解析する。
+        """
+        n = len(ln) if n is None else n
+        if not startswith(ln, b'ERXUDP', n):
+            if startswith(ln, b'EVENT 2', n):
+                self.event(ln, n)
+            return
+
+        # 9番目の項目がデータ（行末の改行を除く）
+        start = field(ln, 8, n)
+        if start < 0:
+            return
+        while n > start and ln[n - 1] <= 0x20:
+            n -= 1
+
+        frame = self.frame
+        if not frame.parse(ln, start, n):
+            return
+        self.metrics.count('frames')
+        self.last_rx = ticks_ms()
+
+        # 低圧スマート電力量メータ(028801)
+        if frame.seoj != echonet.METER:
+            return
+
+        # プロパティ値通知(INF)、応答要の通知(INFC)
+        esv = frame.esv
+        if esv == echonet.INF or esv == echonet.INFC:
+            self.metrics.count('notifications')
+            self.notify(frame)
+            return
+
+        # 応答待ちでないTID（タイムアウト後の応答など）は破棄
+        transaction = self.pending.pop(frame.tid, None)
+        if transaction is None:
+            self.metrics.count('unknown_tid')
+            if self.logger.isEnabledFor(logging.DEBUG):
+                self.logger.debug('dispatch: unknown TID %04X', frame.tid)
+            return
+
+        # EPC毎の応答時間（要求の送信から）
+        metrics = self.metrics
+        for epc in transaction.epcs:
+            metrics.since(transaction.kind, epc, transaction.sent)
+
+        # 不可応答(SNA)
+        if esv in echonet.SNA:
+            metrics.count('sna')
+            transaction.complete(
+                None,
+                Exception('BP35A1.dispatch() ESV {:02X} (TID {:04X})'.format(
+                    esv, frame.tid)))
+            return
+
+        values = echonet.decode(frame, self)
+        self.update_cache(values)
+        if self.failed_at is not None:
+            self.recovered()
+        transaction.complete(values)
+
+    def event(self, ln, n):
+        """
+        PANAセッションのイベント（EVENT 24-29）の処理
+        """
+        code = ln[7]
+        if code == 0x35:
+            # EVENT 25: 接続（再認証）完了
+            self.session_lost = False
+        elif code in (0x34, 0x36, 0x37, 0x38, 0x39):
+            # EVENT 24: 接続失敗、26: 切断要求、27/28: 切断、29: 期限切れ
+            self.session_lost = True
+            self.session_event = code
+            self.metrics.count('event_2' + chr(code))
+            if self.logger.isEnabledFor(logging.INFO):
+                self.logger.info('event: %s', bytes(ln[:n]).decode().strip())
+
+    def notify(self, frame):
+        """
+        プロパティ値通知の処理（キャッシュの更新と購読者への配信）
+        """
+        try:
+            values = echonet.decode(frame, self)
+        except Exception as e:
+            # 係数・単位の取得前(open中)の通知など
+            self.logger.debug('notify: %s', e)
+            return
+        if self.logger.isEnabledFor(logging.INFO):
+            self.logger.info('notify: %s', values)
+        self.update_cache(values)
+
+        # 応答要の通知には通知応答(7A)を返す
+        if frame.esv == echonet.INFC:
+            self.skSendTo(
+                echonet.infc_res_frame(frame.tid, frame.epc_names()))
+
+        for (epc, value) in values.items():
+            for callback in self.subscribers.get(epc, []):
+                try:
+                    callback(epc, value)
+                except Exception as e:
+                    self.logger.error('notify: %s', e)
+
+    # 非同期モード(asyncio)
+    #
+    # スキャン・接続(open)は同期で行い、接続後の計測を非同期で行う。
+    # 固定ウェイトがイベントループを止めないよう、ファストモードで使用する。
+
+    def exclusive(self):
+        """
+        ドライバの排他ロック（async with bp35a1.exclusive(): ...）
+        """
+        if self.lock is None:
+            self.lock = load_asyncio().Lock()
+        return self.lock
+
+    async def areadln(self, timeout=None):
+        """
+        1行受信（非同期）
+        """
+        timeout = self.timeout if timeout is None else timeout
+        load_asyncio()
+        if self.reader is None and hasattr(asyncio, 'sleep_ms'):
+            # uasyncio: UARTをストリームとして待つ
+            self.reader = asyncio.StreamReader(
+                getattr(self.uart, 'raw', self.uart))
+        try:
+            if self.uart.any():
+                # 通信路のバッファに受信済みの分
+                ln = self.uart.readline()
+            elif self.reader:
+                ln = await asyncio.wait_for(self.reader.readline(), timeout)
+            else:
+                ln = await asyncio.wait_for(self.apoll_readline(), timeout)
+        except asyncio.TimeoutError:
+            self.metrics.count('timeout')
+            raise ResponseTimeout('BP35A1.areadln() timeout.')
+        self.metrics.count('bytes_in', len(ln) if ln else 0)
+        if self.logger.isEnabledFor(logging.DEBUG):
+            self.logger.debug('< %s', ln.decode().strip())
+        return ln
+
+    async def apoll_readline(self):
+        """
+        1行受信（ストリームに対応しないUART用）
+        """
+        while not self.uart.any():
+            await asyncio.sleep(0.01)
+        return self.uart.readline()
+
+    async def await_transaction(self, transaction, timeout=None):
+        """
+        トランザクションの応答待ち（非同期）
+        """
+        timeout = self.timeout if timeout is None else timeout
         start = utime.time()
-        while utime.time() - start < self.timeout:
-            ln = self.readln()
-            if not ln.startswith('ERXUDP'):
-                continue
-
-            values = ln.decode().strip().split(' ')
-            if not len(values) == 9:
-                continue
-
-            data = values[8]
-            seoj = data[8:8 + 6]
-            esv = data[20:20 + 2]
-            epc = data[24:24 + 2]
-
-            # 低圧スマート電力量メータ(028801)
-            if seoj != '028801':
-                continue
-
-            # 積算電力量係数
-            if esv == '72' and epc == 'D3':
-                power_coefficient = int(data[-8:], 16)
-                return power_coefficient
-
-            # 積算電力量単位
-            if esv == '72' and epc == 'E1':
-                power_unit = {
-                    '00': 1.0,
-                    '01': 0.1,
-                    '02': 0.01,
-                    '03': 0.001,
-                    '04': 0.0001,
-                    '0A': 10.0,
-                    '0B': 100.0,
-                    '0C': 1000.0,
-                    '0D': 10000.0,
-                }[data[-2:]]
-                return power_unit
-
-            # 積算電力量計測値履歴１
-            if esv == '72' and epc == 'E2':
-                days = int(data[30:30 + 2], 16)
-                power = int(data[32:32 + 8],
-                            16) * self.power_coefficient * self.power_unit
-                return days, power
-
-            # 積算履歴収集日１
-            if esv == '71' and epc == 'E5':
-                result = int(data[-2:], 16)
-                return result
-
-            # 瞬時電力値
-            if esv == '72' and epc == 'E7':
-                power = int(data[-8:], 16)
-                return strftime(localtime()), power
-
-            # 瞬時電流計測値
-            if esv == '72' and epc == 'E8':
-                r = int(data[-8:-8 + 4], 16)
-                if r == 0x7ffe:
-                    r = 0
-                t = int(data[-4:], 16)
-                if t == 0x7ffe:
-                    t = 0
-                return strftime(localtime()), (r + t) / 10.0
-
-            # 定時積算電力量
-            if esv == '72' and epc == 'EA':
-                (year, month, mday, hour, minute,
-                 second) = (int(data[-22:-22 + 4],
-                                16), int(data[-18:-18 + 2],
-                                         16), int(data[-16:-16 + 2], 16),
-                            int(data[-14:-14 + 2],
-                                16), int(data[-12:-12 + 2],
-                                         16), int(data[-10:-10 + 2], 16))
-                created = strftime((year, month, mday, hour, minute, second))
-                power = int(data[-8:],
-                            16) * self.power_coefficient * self.power_unit
-                return created, power
-
-        raise Exception('BP35A1.wait_for_data() timeout.')
+        try:
+            while not transaction.done():
+                remain = timeout - (utime.time() - start)
+                if remain <= 0:
+                    self.metrics.count('timeout')
+                    raise ResponseTimeout('BP35A1.await_transaction() timeout.')
+                self.dispatch(await self.areadln(remain))
+        except Exception:
+            self.pending.pop(transaction.tid, None)
+            raise
+        return transaction.result()
+
+    async def aread_properties(self, epcs):
+        """
+        複数プロパティ値の一括読み出し（非同期）
+        """
+        async with self.exclusive():
+            properties = await self.await_transaction(
+                self.get_properties(epcs))
+        for epc in epcs:
+            if epc not in properties:
+                raise Exception(
+                    'BP35A1.aread_properties() {} not found.'.format(epc))
+        return tuple(properties[epc] for epc in epcs)
+
+    async def awrite_property(self, epc, value):
+        """
+        プロパティ値書き込み（非同期）
+        """
+        async with self.exclusive():
+            properties = await self.await_transaction(
+                self.set_property(epc, value))
+        return properties[epc]
+
+    async def ainstantaneous_values(self):
+        """
+        瞬時電流計測値(E8)と瞬時電力計測値(E7)の一括取得（非同期）
+        """
+        ((_, amperage),
+         (created, power)) = await self.aread_properties(['E8', 'E7'])
+        return created, amperage, power
+
+    async def amonthly_power(self):
+        """
+        前回検針日を起点とした電力量の取得（非同期）
+        """
+        key = self.baseline_key()
+        if not (self.baseline and self.baseline[0] == key):
+            await self.awrite_property('E5',
+                                       days_after_collect(self.collect_date))
+            ((days, history), ) = await self.aread_properties(['E2'])
+            if history[0] is None:
+                raise Exception('BP35A1.amonthly_power() no data')
+            self.baseline = (key, history[0])
+
+        # 受信済みの通知の処理（他のタスクの応答を横取りしないよう排他する）
+        async with self.exclusive():
+            self.poll()
+            total = self.cached('EA')
+        if not total:
+            (total, ) = await self.aread_properties(['EA'])
+        return (last_colect_day(self.collect_date),
+                total[1] - self.baseline[1])
+
+    async def arecover(self, e=None):
+        """
+        障害からの復旧（非同期モード、ドライバを排他して同期で行う）
+        """
+        async with self.exclusive():
+            return self.recover(e)
+
+    async def askPing(self, timeout=10):
+        """
+        スマートメーターへのPING（非同期）
+        """
+        async with self.exclusive():
+            self.writeln('SKPING ' + self.ipv6_addr)
+            start = utime.time()
+            while utime.time() - start < timeout:
+                ln = await self.areadln(timeout)
+                if ln.startswith(b'EPONG'):
+                    return True
+                self.dispatch(ln)
+        return False
 
     def close(self):
         self.skTerm()
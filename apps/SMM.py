@@ -2,11 +2,19 @@ from m5stack import *
 import logging
 import machine
 import ujson
-import utime
 import ntptime
 import wifiCfg
 import charge
+try:
+    import uasyncio as asyncio
+except ImportError:
+    import asyncio
 from BP35A1 import BP35A1
+from store import Store
+from uploader import Uploader
+from scheduler import Scheduler
+from server import Readings, Server
+from display import Display
 
 # Global variables
 level = logging.DEBUG  # Log level
@@ -15,8 +23,28 @@ config = {}  # Configuration
 orient = lcd.LANDSCAPE_FLIP  # Display orientation
 logger = None  # Logger object
 logger_name = 'SMM'  # Logger name
-ambient_client = None  # Ambient instance
-max_retries = 30  # Maximum number of times to retry
+uploader = None  # Ambient uploader
+store = None  # Store instance
+max_retries = 3  # Maximum number of consecutive failed recoveries
+retries = 0  # Number of consecutive failed recoveries
+scheduler = None  # Scheduler instance
+screen = None  # Display (retained model of the LCD)
+state = {
+    'amperage': 0,
+    'power_kw': 0,
+    'power_kwh': 0,
+    'amount': 0,
+    'update': 'YYYY-MM-DD hh:mm:ss',
+    'collect': 'YYYY-MM-DD hh:mm:ss'
+}  # Latest values
+updated = None  # Display update event (async mode)
+metrics_file = '/flash/SmartMeter.metrics.json'  # Metrics dump file
+errors = 0  # Total number of errors
+measured = False  # Instantaneous values have been read
+collected = False  # Monthly energy has been read
+readings = None  # Latest readings for the HTTP server
+server = None  # HTTP server
+clock = None  # Time service (NTP)
 
 # Colormap (tab10)
 colormap = (
@@ -48,7 +76,43 @@ def buttonA():
         orient = lcd.LANDSCAPE
     logger.info('Set screen orient: %s', orient)
     lcd.orient(orient)
-    lcd.clear()
+    if screen:
+        screen.clear()
+    else:
+        lcd.clear()
+
+
+def buttonB():
+    """
+    Bボタン：計測値(metrics)の書き出し
+    """
+    dump_metrics()
+
+
+def dump_metrics():
+    """
+    ドライバ・スケジューラ・アップローダの計測値を JSON で書き出す
+    """
+    if not bp35a1:
+        return
+    metrics = bp35a1.metrics.dump()
+    metrics['errors'] = errors
+    if scheduler:
+        metrics['scheduler'] = scheduler.stats()
+    if server:
+        metrics['server'] = server.stats()
+    if screen:
+        metrics['display'] = screen.stats()
+    if uploader:
+        metrics['uploader'] = uploader.stats()
+    if clock:
+        metrics['clock'] = clock.stats()
+    try:
+        with open(metrics_file, 'w') as f:
+            ujson.dump(metrics, f)
+        logger.info('Metrics: %s', metrics_file)
+    except OSError as e:
+        logger.error('dump_metrics: %s', e)
 
 
 def checkWiFi():
@@ -85,78 +149,264 @@ def progress(percent):
     lcd.text(lcd.CENTER, h - 10, '{}%'.format(percent), uncolor)
 
 
-def instantaneous_amperage(amperage):
+def create_display():
     """
-    瞬時電流計測値の表示
+    計測値の表示の定義（固定の文字列と値の領域）
+
+    固定の文字列はフォント毎に並べておく（描画時のフォントの切り替えが減る）
     """
-    (x, y, w, h) = (3, 3, 70, 25)
-    lcd.rect(x, y, w, h, bgcolor, bgcolor)
+    screen = Display(lcd, bgcolor)
+    small = lcd.FONT_DefaultSmall
+
+    # 瞬時電流(3, 3)、瞬時電力(73, 3): 値は右揃え、単位は値の右
+    screen.widget('amperage', 3 + 34, 3, lcd.FONT_DejaVu24, color1, 25)
+    screen.widget('power_kw', 73 + 84 - 15, 3, lcd.FONT_DejaVu24, color1, 25)
+    screen.label('A', 3 + 34, 3 + (25 - 10), small, uncolor)
+    screen.label('kW', 73 + 84 - 15, 3 + (25 - 10), small, uncolor)
+
+    # 今月（検針日を起点）の日付範囲(3, 33)
+    screen.widget('collect', 3, 33, small, color2, 12, align='center',
+                  width=177)
+
+    # 今月の電力量(3, 45)、電気料金(73, 45): 値は右揃え、単位は値の下
+    screen.widget('power_kwh', 3 + 70, 45, lcd.FONT_DejaVu24, color2, 25)
+    screen.widget('amount', 73 + 84, 45, lcd.FONT_DejaVu24, colormap[1], 25)
+    screen.label('kWh', 3 + 70, 45 + 25, small, uncolor, align='right')
+    screen.label('Yen', 73 + 84, 45 + 25, small, uncolor, align='right')
+
+    # 契約アンペア数
+    contract_amperage = str(int(config['contract_amperage']))
+    screen.label(contract_amperage, 3 + 44, 3 + (25 - 16), lcd.FONT_Ubuntu,
+                 uncolor)
+    screen.label('A', lcd.LASTX, 3 + (25 - 16) + (16 - 10), small, uncolor)
+    return screen
 
-    amperage = str(int(amperage))
-    lcd.font(lcd.FONT_DejaVu24)
-    lcd.print(amperage, x + 34 - lcd.textWidth(amperage), y, color1)
-    lcd.font(lcd.FONT_DefaultSmall)
-    lcd.print('A', lcd.LASTX, y + (25 - 10), uncolor)
 
-    contract_amperage = str(int(config['contract_amperage']))
-    lcd.font(lcd.FONT_Ubuntu)
-    lcd.print(contract_amperage, x + 44, y + (25 - 16), uncolor)
-    lcd.font(lcd.FONT_DefaultSmall)
-    lcd.print('A', lcd.LASTX, y + (25 - 16) + (16 - 10), uncolor)
+def show():
+    """
+    計測値の表示（表示が変わる値だけ描き直す）
+    """
+    screen.set('amperage', str(int(state['amperage'])))
+    screen.set('power_kw', str(int(state['power_kw'])))
+    screen.set('collect', '{}~{}'.format(state['collect'][5:10],
+                                         state['update'][5:10]))
+    screen.set('power_kwh', str(int(state['power_kwh'])))
+    screen.set('amount', str(int(state['amount'])))
+    screen.render()
 
 
-def instantaneous_power(power_kw):
+def succeeded(ok, e=None, recovered=True):
     """
-    瞬時電力計測値の表示
+    エラー回数の更新（recovered: BP35A1.recover() の結果）
+
+    障害は BP35A1 がセッションを張り直して復旧し、再スキャンまで失敗した
+    回数が max_retries に達した時だけ再起動する。
     """
-    (x, y, w, h) = (73, 3, 84, 25)
-    lcd.rect(x, y, w, h, bgcolor, bgcolor)
+    global retries, errors
+    if ok:
+        retries = 0
+    else:
+        logger.error(e)
+        errors += 1
+        if not recovered:
+            retries += 1
 
-    power_kw = str(int(power_kw))
-    lcd.font(lcd.FONT_DejaVu24)
-    lcd.print(power_kw, x + w - 15 - lcd.textWidth(power_kw), y, color1)
-    lcd.font(lcd.FONT_DefaultSmall)
-    lcd.print('kW', lcd.LASTX, y + (25 - 10), uncolor)
 
+def publish(kind):
+    """
+    HTTP サーバへの計測値の公開（'instantaneous' または 'monthly'）
+    """
+    if not readings:
+        return
+    if kind == 'instantaneous':
+        readings.update('instantaneous_amperage', state['amperage'],
+                        state['update'])
+        readings.update('instantaneous_power', state['power_kw'],
+                        state['update'])
+    else:
+        readings.update('monthly_energy', state['power_kwh'],
+                        state['collect'])
+        readings.update('monthly_fee', state['amount'], state['collect'])
+        total = bp35a1.cached('EA')
+        if total:
+            readings.update('total_energy', total[1], total[0])
 
-def collect_range(collect, update):
+
+def record():
     """
-    今月（検針日を起点）の日付範囲を表示
+    計測値の保存（今月の電力量を取得するまでは保存しない）
     """
-    (x, y, w, h) = (3, 33, 177, 12)
-    lcd.rect(x, y, w, h, bgcolor, bgcolor)
+    if collected:
+        store.append(clock.now(), state['amperage'], state['power_kw'],
+                     state['power_kwh'])
 
-    s = '{}~{}'.format(collect[5:10], update[5:10])
-    lcd.font(lcd.FONT_DefaultSmall)
-    lcd.print(s, int(x + (w - lcd.textWidth(s)) / 2), y, color2)
 
+def update_instantaneous():
+    """
+    瞬時電流・瞬時電力の取得と表示（10秒毎）
+    """
+    global measured
+    try:
+        (state['update'], state['amperage'],
+         state['power_kw']) = bp35a1.instantaneous_values()
+        measured = True
+        show()
+        record()
+        publish('instantaneous')
+        succeeded(True)
+    except Exception as e:
+        succeeded(False, e, bp35a1.recover(e))
+
+
+def update_monthly():
+    """
+    今月の電力量・電気料金の取得と表示（60秒毎）
+    """
+    global collected
+    try:
+        (state['collect'], state['power_kwh']) = bp35a1.monthly_power()
+        collected = True
+        state['amount'] = charge(config['contract_amperage'],
+                                 state['power_kwh'])
+        show()
+        publish('monthly')
+        succeeded(True)
+    except Exception as e:
+        succeeded(False, e, bp35a1.recover(e))
+
+
+def queue_upload():
+    """
+    Ambient 送信キューへの追加（30秒毎、送信はバックグラウンド）
+
+    瞬時値を取得するまでは追加せず、今月の電力量・電気料金は取得してから
+    送る（初期値の日時や 0 を送らない）。
+    """
+    if not measured:
+        return
+    sample = {
+        'created': state['update'],
+        'd1': state['amperage'],
+        'd2': state['power_kw'],
+    }
+    if collected:
+        sample['d3'] = state['power_kwh']
+        sample['d4'] = state['amount']
+    uploader.put(sample)
+
+
+def ping_meter():
+    """
+    スマートメーターへのPINGと統計の出力（1時間毎）
+    """
+    try:
+        bp35a1.skPing()
+    except Exception as e:
+        logger.error(e)
+    if uploader:
+        logger.info('Uploader: %s', uploader.stats())
+    if scheduler:
+        logger.info('Scheduler: %s', scheduler.stats())
+    dump_metrics()
 
-def monthly_power(power_kwh):
+
+async def poll_instantaneous(interval=10):
     """
-    今月（検針日を起点）の電力量の表示
+    瞬時電流・瞬時電力の取得（10秒毎）
     """
-    (x, y, w, h) = (3, 45, 70, 35)
-    lcd.rect(x, y, w, h, bgcolor, bgcolor)
+    global measured
+    while True:
+        try:
+            (state['update'], state['amperage'],
+             state['power_kw']) = await bp35a1.ainstantaneous_values()
+            measured = True
+            record()
+            publish('instantaneous')
+            updated.set()
+            succeeded(True)
+        except Exception as e:
+            succeeded(False, e, await bp35a1.arecover(e))
+        await asyncio.sleep(interval)
+
+
+async def poll_monthly(interval=60):
+    """
+    今月の電力量・電気料金の取得（60秒毎）
+    """
+    global collected
+    while True:
+        try:
+            (state['collect'],
+             state['power_kwh']) = await bp35a1.amonthly_power()
+            collected = True
+            state['amount'] = charge(config['contract_amperage'],
+                                     state['power_kwh'])
+            publish('monthly')
+            updated.set()
+            succeeded(True)
+        except Exception as e:
+            succeeded(False, e, await bp35a1.arecover(e))
+        await asyncio.sleep(interval)
+
+
+async def display():
+    """
+    計測値の表示（更新があった時）
+    """
+    while True:
+        await updated.wait()
+        updated.clear()
+        show()
 
-    power_kwh = str(int(power_kwh))
-    lcd.font(lcd.FONT_DejaVu24)
-    lcd.print(power_kwh, x + w - lcd.textWidth(power_kwh), y, color2)
-    lcd.font(lcd.FONT_DefaultSmall)
-    lcd.print('kWh', x + w - lcd.textWidth('kWh'), y + 25, uncolor)
 
+async def upload(interval=30):
+    """
+    Ambient 送信キューへの追加（30秒毎）
+    """
+    while True:
+        queue_upload()
+        await asyncio.sleep(interval)
 
-def monthly_fee(fee):
+
+async def ping(interval=3600):
     """
-    今月（検針日を起点）の電気料金の表示
+    スマートメーターへのPING（1時間毎）
     """
-    (x, y, w, h) = (73, 45, 84, 35)
-    lcd.rect(x, y, w, h, bgcolor, bgcolor)
+    while True:
+        try:
+            await bp35a1.askPing()
+        except Exception as e:
+            logger.error(e)
+        if uploader:
+            logger.info('Uploader: %s', uploader.stats())
+        dump_metrics()
+        await asyncio.sleep(interval)
+
+
+async def wifi(interval=60):
+    """
+    WiFi接続チェック（60秒毎）
+    """
+    while True:
+        await asyncio.sleep(interval)
+        checkWiFi()
 
-    fee = str(int(fee))
-    lcd.font(lcd.FONT_DejaVu24)
-    lcd.print(fee, x + w - lcd.textWidth(fee), y, colormap[1])
-    lcd.font(lcd.FONT_DefaultSmall)
-    lcd.print('Yen', x + w - lcd.textWidth('Yen'), y + 25, uncolor)
+
+async def monitor():
+    """
+    非同期モードでのモニタリング
+    """
+    global updated
+    updated = asyncio.Event()
+
+    tasks = [poll_instantaneous(), poll_monthly(), display(), ping(), wifi()]
+    if uploader:
+        tasks.append(upload())
+    for task in tasks:
+        asyncio.create_task(task)
+
+    while retries < max_retries:
+        await asyncio.sleep(1)
 
 
 if __name__ == '__main__':
@@ -171,6 +421,7 @@ if __name__ == '__main__':
 
         # Start button thread
         btnA.wasPressed(buttonA)
+        btnB.wasPressed(buttonB)
 
         # Connecting Wi-Fi
         status('Connecting Wi-Fi')
@@ -178,15 +429,6 @@ if __name__ == '__main__':
         if not wifiCfg.isconnected():
             raise Exception('Can not connect to WiFi.')
 
-        # Start checking the WiFi connection
-        machine.Timer(0).init(period=60 * 1000,
-                              mode=machine.Timer.PERIODIC,
-                              callback=checkWiFi)
-
-        # Set Time
-        status('Set Time')
-        ntptime.settime()
-
         # Load configuration
         status('Load configuration')
         config_file = '/flash/SmartMeter.json'
@@ -203,6 +445,23 @@ if __name__ == '__main__':
                 if key not in config['ambient']:
                     raise Exception(
                         '{} is not defined in config.json'.format(key))
+        async_mode = config.get('async_mode', False)
+
+        # Set Time (resync in the background)
+        status('Set Time')
+        clock = ntptime.TimeService(
+            config.get('ntp_servers', ntptime.TimeService.HOSTS),
+            interval=config.get('ntp_interval', 3600),
+            logger_name=logger_name)
+        clock.start()
+        if not clock.wait(10):
+            logger.warn('Time is not synchronized yet')
+
+        # Start checking the WiFi connection
+        if not async_mode:
+            machine.Timer(0).init(period=60 * 1000,
+                                  mode=machine.Timer.PERIODIC,
+                                  callback=checkWiFi)
 
         # Create objects
         status('Create objects')
@@ -211,19 +470,33 @@ if __name__ == '__main__':
                         config['contract_amperage'],
                         config['collect_date'],
                         progress_func=progress,
-                        logger_name=logger_name)
-        logger.info('BP35A1 config: (%s, %s, %s, %s)', config['id'],
+                        logger_name=logger_name,
+                        fast=config.get('fast_mode', False) or async_mode,
+                        session_file='/flash/BP35A1.session.json',
+                        clock=clock.now)
+        logger.info('BP35A1 config: (%s, %s, %s, %s, %s)', config['id'],
                     config['password'], config['contract_amperage'],
-                    config['collect_date'])
-        charge = eval('charge.{}'.format(config['charge_func']))
-        logger.info('charge function: %s', charge.__name__)
+                    config['collect_date'], config.get('fast_mode', False))
+        store = Store('/flash/SmartMeter.dat',
+                      collect_date=config['collect_date'])
+        logger.info('Store: %s records', store.count)
+        charge = charge.plan(config['charge_func'], config.get('charge_file'))
+        logger.info('charge plan: %s (%s)', charge.name, charge.title)
         if 'ambient' in config:
             import ambient
             ambient_client = ambient.Ambient(config['ambient']['channel_id'],
                                              config['ambient']['write_key'])
+            uploader = Uploader(ambient_client, logger_name=logger_name)
+            uploader.start()
             logger.info('Ambient config: (%s, %s)',
                         config['ambient']['channel_id'],
                         config['ambient']['write_key'])
+        if config.get('http_port'):
+            readings = Readings(max_age=config.get('http_max_age', 60))
+            server = Server([readings],
+                            port=config['http_port'],
+                            logger_name=logger_name)
+            server.start()
 
         # Connecting to Smart Meter
         status('Connecting SmartMeter')
@@ -233,61 +506,22 @@ if __name__ == '__main__':
 
         # Start monitoring
         status('Start monitoring')
-        amperage = power_kw = power_kwh = amount = 0
-        update = collect = 'YYYY-MM-DD hh:mm:ss'
-        retries = 0
-        t = 0
-        while retries < max_retries:
-            # Updated every 10 seconds
-            if t % 10 == 0:
-                try:
-                    (_, amperage) = bp35a1.instantaneous_amperage()
-                    (update, power_kw) = bp35a1.instantaneous_power()
-                    instantaneous_amperage(amperage)
-                    instantaneous_power(power_kw)
-                    retries = 0
-                except Exception as e:
-                    logger.error(e)
-                    retries += 1
-
-            # Updated every 60 seconds
-            if t % 60 == 0:
-                try:
-                    (collect, power_kwh) = bp35a1.monthly_power()
-                    amount = charge(config['contract_amperage'], power_kwh)
-                    collect_range(collect, update)
-                    monthly_power(power_kwh)
-                    monthly_fee(amount)
-                    retries = 0
-                except Exception as e:
-                    logger.error(e)
-                    retries += 1
-
-            # Send every 30 seconds
-            if t % 30 == 0:
-                try:
-                    if ambient_client:
-                        result = ambient_client.send({
-                            'd1': amperage,
-                            'd2': power_kw,
-                            'd3': power_kwh,
-                            'd4': amount
-                        })
-                        if result.status_code != 200:
-                            raise Exception(
-                                'ambient.send() failed. status: %s',
-                                result.status_code)
-                        retries = 0
-                except Exception as e:
-                    logger.error(e)
-                    retries += 1
-
-            # Ping every 1 hour
-            if t % 3600 == 0:
-                bp35a1.skPing()
-
-            utime.sleep(1)
-            t = utime.time()
+        screen = create_display()
+        screen.clear()
+        if async_mode:
+            asyncio.run(monitor())
+        else:
+            scheduler = Scheduler()
+            scheduler.every(10, update_instantaneous, priority=3)
+            scheduler.every(60, update_monthly, priority=2)
+            if uploader:
+                scheduler.every(30, queue_upload, priority=1)
+            scheduler.every(3600, ping_meter, priority=0)
+            scheduler.run(lambda: retries < max_retries)
 
     finally:
+        # 復旧できなかった場合の最後の手段
+        if store:
+            store.flush()
+        dump_metrics()
         machine.reset()
@@ -0,0 +1,129 @@
+"""
+ERXUDP 受信処理のヒープ使用量（1フレームあたり）
+
+受信した行の振り分け(BP35A1.dispatch)で使うヒープを、従来の文字列処理
+(decode/strip/split/スライス/int(..., 16))と比較します。
+
+- MicroPython: gc を止めて gc.mem_alloc() の増分（確保したバイト数）
+- CPython: tracemalloc で1フレームの処理中に増えたメモリの最大値
+  （CPython では 256 を超える整数もヒープに作られるため 0 にはならない）
+
+parse は応答待ちでない TID（破棄されるフレーム）で解析と TID の照合まで、
+decode はさらにプロパティ値の作成（結果の dict など）を含みます。
+
+    python3 benchmarks/bench_alloc.py [--count N]
+    micropython benchmarks/bench_alloc.py
+"""
+import gc
+import sys
+
+sys.path.insert(0, __file__.rsplit('/', 2)[0] if '/' in __file__ else '.')
+
+import echonet  # noqa: E402
+from BP35A1 import BP35A1  # noqa: E402
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+HEADER = ('ERXUDP FE80:0000:0000:0000:021D:1290:1234:5678 '
+          'FE80:0000:0000:0000:0000:0000:0000:0001 0E1A 0E1A '
+          '001D129012345678 1 {:04X} ')
+FRAMES = {
+    'E7': '1081{:04X}02880105FF017201E704000003E8',
+    'E8+E7': '1081{:04X}02880105FF017202E80400140032E704000003E8',
+    'EA': '1081{:04X}02880105FF017201EA0B07E4061D0C1E00000003E8',
+}
+
+
+class Uart:
+    def any(self):
+        return 0
+
+
+def line(frame, tid):
+    data = frame.format(tid)
+    return (HEADER.format(len(data) // 2) + data + '\r\n').encode()
+
+
+def legacy_dispatch(ln):
+    # 従来の受信処理（文字列に変換して分割・スライス）
+    if not ln.startswith(b'ERXUDP'):
+        return None
+    values = ln.decode().strip().split(' ')
+    if not len(values) == 9:
+        return None
+    data = values[8]
+    tid = int(data[4:4 + 4], 16)
+    seoj = data[8:8 + 6]
+    esv = data[20:20 + 2]
+    opc = int(data[22:22 + 2], 16)
+    properties = []
+    i = 24
+    for _ in range(opc):
+        pdc = int(data[i + 2:i + 2 + 2], 16)
+        properties.append((data[i:i + 2], pdc, data[i + 4:i + 4 + pdc * 2]))
+        i += 4 + pdc * 2
+    return tid, seoj, esv, properties
+
+
+def measure(func, count):
+    if hasattr(gc, 'mem_alloc'):
+        # MicroPython: gc を止めている間は確保したバイト数だけ増える
+        gc.collect()
+        gc.disable()
+        before = gc.mem_alloc()
+        for _ in range(count):
+            func()
+        allocated = gc.mem_alloc() - before
+        gc.enable()
+        return allocated / count
+    if tracemalloc:
+        func()
+        tracemalloc.start()
+        total = 0
+        for _ in range(count):
+            tracemalloc.reset_peak()
+            before = tracemalloc.get_traced_memory()[0]
+            func()
+            total += tracemalloc.get_traced_memory()[1] - before
+        tracemalloc.stop()
+        return total / count
+    return float('nan')
+
+
+def main():
+    count = 1000
+    if '--count' in sys.argv:
+        count = int(sys.argv[sys.argv.index('--count') + 1])
+
+    bp35a1 = BP35A1('id', 'password', '50', '22', uart=Uart(), fast=True)
+    bp35a1.power_coefficient = 1
+    bp35a1.power_unit = 0.1
+    bp35a1.timestamp = lambda: '2020-01-01 00:00:00'
+
+    print('{:<8} {:>10} {:>10} {:>10}'.format('frame', 'legacy', 'parse',
+                                              'decode'))
+    for (name, frame) in FRAMES.items():
+        ln = line(frame, 0x1234)
+        buf = bytearray(BP35A1.LINE_SIZE)
+        buf[:len(ln)] = ln
+        n = len(ln)
+
+        def parse_only():
+            bp35a1.dispatch(buf, n)
+
+        def with_decode():
+            bp35a1.dispatch(buf, n)
+            echonet.decode(bp35a1.frame, bp35a1)
+
+        legacy = measure(lambda: legacy_dispatch(ln), count)
+        parse = measure(parse_only, count)
+        decode = measure(with_decode, count)
+        print('{:<8} {:>9.0f}B {:>9.0f}B {:>9.0f}B'.format(
+            name, legacy, parse, decode))
+
+
+if __name__ == '__main__':
+    main()
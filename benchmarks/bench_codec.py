@@ -0,0 +1,57 @@
+"""
+ECHONET Lite フレームのデコード性能（frames/s）
+
+echonet.Frame.parse() と echonet.decode() で、代表的な応答フレームを
+1秒あたり何フレームデコードできるかを計測します。
+
+    python3 benchmarks/bench_codec.py [--count N]
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import echonet  # noqa: E402
+
+FRAMES = {
+    'E7': '1081000102880105FF017201E704000003E8',
+    'E8+E7': '1081000102880105FF017202E80400140032E704000003E8',
+    'EA': '1081000102880105FF017201EA0B07E4061D0C1E00000003E8',
+    'E2': '1081000102880105FF017201E2C20001' + '00000064' * 48,
+    'D3+E1+E7+E8+EA': ('1081000102880105FF017205D30400000001E10101'
+                       'E704000003E8E80400140032'
+                       'EA0B07E4061D0C1E00000003E8'),
+}
+
+
+class Meter:
+    power_coefficient = 1
+    power_unit = 0.1
+
+    def timestamp(self):
+        return '2020-01-01 00:00:00'
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--count', type=int, default=100000)
+    args = parser.parse_args()
+
+    meter = Meter()
+    frame = echonet.Frame()
+    print('{:<16} {:>14}'.format('frame', 'frames/s'))
+    for (name, data) in FRAMES.items():
+        data = data.encode()
+        start = time.perf_counter()
+        for _ in range(args.count):
+            frame.parse(data, 0, len(data))
+            echonet.decode(frame, meter)
+        elapsed = time.perf_counter() - start
+        print('{:<16} {:>14,.0f}'.format(name, args.count / elapsed))
+
+
+if __name__ == '__main__':
+    main()
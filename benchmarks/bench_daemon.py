@@ -0,0 +1,86 @@
+"""
+複数メーター同時計測(daemon.py)のスケーラビリティ（エミュレータ使用）
+
+メーター数を変えて、瞬時値(E8/E7)を連続して取得した時の全体の
+スループットを計測します。ポート毎のスレッドは応答待ちの間 CPU を
+譲るので、スループットはメーター数にほぼ比例します。
+
+    python3 benchmarks/bench_daemon.py [--meters 1,2,4,8,16] [--rtt MS]
+"""
+import argparse
+import logging
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from daemon import Daemon, Sink  # noqa: E402
+from emulator import BP35A1Emulator  # noqa: E402
+
+
+def measure(count, args):
+    def uart_factory(config):
+        index = config['index']
+        return BP35A1Emulator(latency=args.latency / 1000,
+                              rtt=args.rtt / 1000,
+                              time_scale=args.time_scale,
+                              mac_addr='001D1290{:08X}'.format(index),
+                              seed=index)
+
+    meters = [{
+        'name': 'meter{}'.format(i),
+        'index': i,
+        'id': 'id',
+        'password': 'password',
+        'contract_amperage': '50',
+        'collect_date': '22'
+    } for i in range(count)]
+    sink = Sink()
+    daemon = Daemon(meters,
+                    sink,
+                    uart_factory=uart_factory,
+                    interval=0,
+                    monthly_interval=None)
+    daemon.start()
+
+    # 全メーターの接続を待ってから計測
+    while not all(meter.cycles for meter in daemon.meters):
+        time.sleep(0.01)
+    before = sink.total()
+    start = time.monotonic()
+    time.sleep(args.seconds)
+    samples = sink.total() - before
+    elapsed = time.monotonic() - start
+    daemon.stop(5)
+    errors = sum(meter.errors for meter in daemon.meters)
+    return samples / elapsed, errors
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--meters', default='1,2,4,8,16')
+    parser.add_argument('--seconds', type=float, default=5.0)
+    parser.add_argument('--latency', type=float, default=5.0,
+                        help='module response latency (ms)')
+    parser.add_argument('--rtt', type=float, default=100.0,
+                        help='radio round trip time (ms)')
+    parser.add_argument('--time-scale', type=float, default=0.01,
+                        help='scan/join time scale')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.CRITICAL)
+
+    print('{:>6} {:>12} {:>12} {:>10} {:>8}'.format('meters', 'samples/s',
+                                                   'per meter', 'scaling',
+                                                   'errors'))
+    base = None
+    for count in [int(n) for n in args.meters.split(',')]:
+        (rate, errors) = measure(count, args)
+        base = base if base else rate / count
+        print('{:>6} {:>12.2f} {:>12.2f} {:>9.2f}x {:>8}'.format(
+            count, rate, rate / count, rate / base, errors))
+
+
+if __name__ == '__main__':
+    main()
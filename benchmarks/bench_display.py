@@ -0,0 +1,202 @@
+"""
+LCD の描画量（SMM の表示、LCD のスタブで計測）
+
+1日分の計測（瞬時値 10 秒毎、今月の電力量 60 秒毎）を表示した時の
+LCD への描画（呼び出し回数、書き込むピクセル数、フォントの切り替え回数）を、
+従来の「領域を消してから全て描く」表示と差分描画(display.Display)で
+比べます。ピクセル数は SPI の転送量（16bit/ピクセル）の目安です。
+
+    python3 benchmarks/bench_display.py [--hours 24]
+"""
+import argparse
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import charge  # noqa: E402
+from display import Display  # noqa: E402
+from emulator import EPOCH, SmartMeter  # noqa: E402
+
+bgcolor = 0x000000
+uncolor = 0xa9a9a9
+color1 = 0x1f77b4
+color2 = 0xff7f0e
+
+
+class StubLCD:
+    """
+    m5stack.lcd のスタブ（固定幅フォントとして描画量を数える）
+    """
+    FONT_DefaultSmall = 0
+    FONT_Ubuntu = 1
+    FONT_DejaVu24 = 2
+    SIZES = {0: (6, 10), 1: (9, 16), 2: (14, 24)}
+    CENTER = -9003
+    LASTX = 7000
+
+    def __init__(self):
+        self.current = (6, 10)
+        self.lastx = 0
+        self.calls = 0
+        self.pixels = 0
+        self.fonts = 0
+
+    def font(self, font, transparent=False):
+        self.calls += 1
+        self.fonts += 1
+        self.current = self.SIZES[font]
+
+    def textWidth(self, text):
+        return len(text) * self.current[0]
+
+    def print(self, text, x, y, color):
+        self.calls += 1
+        if x == self.LASTX:
+            x = self.lastx
+        w = self.textWidth(text)
+        self.pixels += w * self.current[1]
+        self.lastx = x + w
+
+    def rect(self, x, y, w, h, color, fillcolor=None):
+        self.calls += 1
+        self.pixels += w * h
+
+    def clear(self):
+        self.calls += 1
+        self.pixels += 160 * 80
+
+
+class LegacyScreen:
+    """
+    従来の表示（値毎に領域を消し、フォントを切り替えて単位まで描き直す）
+    """
+    def __init__(self, lcd, contract_amperage):
+        self.lcd = lcd
+        self.contract_amperage = contract_amperage
+
+    def show(self, state):
+        lcd = self.lcd
+        (x, y, w, h) = (3, 3, 70, 25)
+        lcd.rect(x, y, w, h, bgcolor, bgcolor)
+        amperage = str(int(state['amperage']))
+        lcd.font(lcd.FONT_DejaVu24)
+        lcd.print(amperage, x + 34 - lcd.textWidth(amperage), y, color1)
+        lcd.font(lcd.FONT_DefaultSmall)
+        lcd.print('A', lcd.LASTX, y + (25 - 10), uncolor)
+        lcd.font(lcd.FONT_Ubuntu)
+        lcd.print(self.contract_amperage, x + 44, y + (25 - 16), uncolor)
+        lcd.font(lcd.FONT_DefaultSmall)
+        lcd.print('A', lcd.LASTX, y + (25 - 16) + (16 - 10), uncolor)
+
+        (x, y, w, h) = (73, 3, 84, 25)
+        lcd.rect(x, y, w, h, bgcolor, bgcolor)
+        power_kw = str(int(state['power_kw']))
+        lcd.font(lcd.FONT_DejaVu24)
+        lcd.print(power_kw, x + w - 15 - lcd.textWidth(power_kw), y, color1)
+        lcd.font(lcd.FONT_DefaultSmall)
+        lcd.print('kW', lcd.LASTX, y + (25 - 10), uncolor)
+
+        (x, y, w, h) = (3, 33, 177, 12)
+        lcd.rect(x, y, w, h, bgcolor, bgcolor)
+        s = '{}~{}'.format(state['collect'][5:10], state['update'][5:10])
+        lcd.font(lcd.FONT_DefaultSmall)
+        lcd.print(s, int(x + (w - lcd.textWidth(s)) / 2), y, color2)
+
+        for (x, value, unit, color) in ((3, state['power_kwh'], 'kWh',
+                                         color2), (73, state['amount'],
+                                                   'Yen', color2)):
+            (y, w, h) = (45, 70 if unit == 'kWh' else 84, 35)
+            lcd.rect(x, y, w, h, bgcolor, bgcolor)
+            value = str(int(value))
+            lcd.font(lcd.FONT_DejaVu24)
+            lcd.print(value, x + w - lcd.textWidth(value), y, color)
+            lcd.font(lcd.FONT_DefaultSmall)
+            lcd.print(unit, x + w - lcd.textWidth(unit), y + 25, uncolor)
+
+
+class RetainedScreen:
+    """
+    差分描画の表示（apps/SMM.py の create_display() と同じ配置）
+    """
+    def __init__(self, lcd, contract_amperage):
+        screen = Display(lcd, bgcolor)
+        small = lcd.FONT_DefaultSmall
+        screen.widget('amperage', 3 + 34, 3, lcd.FONT_DejaVu24, color1, 25)
+        screen.widget('power_kw', 73 + 84 - 15, 3, lcd.FONT_DejaVu24, color1,
+                      25)
+        screen.label('A', 3 + 34, 3 + (25 - 10), small, uncolor)
+        screen.label('kW', 73 + 84 - 15, 3 + (25 - 10), small, uncolor)
+        screen.widget('collect', 3, 33, small, color2, 12, align='center',
+                      width=177)
+        screen.widget('power_kwh', 3 + 70, 45, lcd.FONT_DejaVu24, color2, 25)
+        screen.widget('amount', 73 + 84, 45, lcd.FONT_DejaVu24, color2, 25)
+        screen.label('kWh', 3 + 70, 45 + 25, small, uncolor, align='right')
+        screen.label('Yen', 73 + 84, 45 + 25, small, uncolor, align='right')
+        screen.label(contract_amperage, 3 + 44, 3 + (25 - 16),
+                     lcd.FONT_Ubuntu, uncolor)
+        screen.label('A', lcd.LASTX, 3 + (25 - 16) + (16 - 10), small,
+                     uncolor)
+        self.screen = screen
+
+    def show(self, state):
+        screen = self.screen
+        screen.set('amperage', str(int(state['amperage'])))
+        screen.set('power_kw', str(int(state['power_kw'])))
+        screen.set('collect', '{}~{}'.format(state['collect'][5:10],
+                                             state['update'][5:10]))
+        screen.set('power_kwh', str(int(state['power_kwh'])))
+        screen.set('amount', str(int(state['amount'])))
+        screen.render()
+
+
+def samples(hours):
+    """
+    表示する計測値（10秒毎、今月の電力量は60秒毎に更新）
+    """
+    meter = SmartMeter(seed=1)
+    tariff = charge.plan('tokyo_gas_1')
+    start = EPOCH + 9 * 86400
+    collect = meter.energy(EPOCH)
+    state = {'collect': '2020-01-01 00:00:00', 'power_kwh': 0, 'amount': 0}
+    for i in range(int(hours * 360)):
+        t = start + i * 10
+        power = meter.power(t)
+        state['power_kw'] = power
+        state['amperage'] = power / 100
+        state['update'] = '2020-01-{:02d} 00:00:00'.format(
+            10 + (t - start) // 86400)
+        if i % 6 == 0:
+            state['power_kwh'] = meter.energy(t) - collect
+            state['amount'] = tariff('40', state['power_kwh'])
+        yield state
+
+
+def bench(cls, hours):
+    lcd = StubLCD()
+    screen = cls(lcd, '40')
+    n = 0
+    for state in samples(hours):
+        screen.show(state)
+        n += 1
+    return n, lcd
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--hours', type=float, default=24)
+    args = parser.parse_args()
+
+    print('{:<9} {:>8} {:>10} {:>14} {:>10}'.format('display', 'updates',
+                                                    'calls', 'kbytes(SPI)',
+                                                    'fonts'))
+    for (name, cls) in (('legacy', LegacyScreen), ('retained',
+                                                    RetainedScreen)):
+        (n, lcd) = bench(cls, args.hours)
+        print('{:<9} {:>8} {:>10} {:>14,.0f} {:>10}'.format(
+            name, n, lcd.calls, lcd.pixels * 2 / 1024, lcd.fonts))
+
+
+if __name__ == '__main__':
+    main()
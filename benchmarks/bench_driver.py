@@ -0,0 +1,119 @@
+"""
+BP35A1 ドライバのベンチマーク（エミュレータ使用）
+
+- open() の所要時間（リセットから係数・単位の取得まで）
+- プロパティ毎の読み出しレイテンシ
+- 瞬時値(E8/E7)ポーリングの持続スループット
+
+    python3 benchmarks/bench_driver.py [--normal] [--rtt MS] [--loss P]
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from BP35A1 import BP35A1  # noqa: E402
+from emulator import BP35A1Emulator  # noqa: E402
+
+EPCS = ('D3', 'E1', 'E7', 'E8', 'EA', 'E2')
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+def create(args, fast):
+    uart = BP35A1Emulator(latency=args.latency / 1000,
+                          jitter=args.jitter / 1000,
+                          loss=args.loss,
+                          rtt=args.rtt / 1000,
+                          time_scale=args.time_scale,
+                          seed=1)
+    bp35a1 = BP35A1('id', 'password', '50', '22', uart=uart, fast=fast)
+    bp35a1.timeout = args.timeout
+    return bp35a1
+
+
+def bench_open(args, fast):
+    bp35a1 = create(args, fast)
+    start = time.monotonic()
+    bp35a1.open()
+    return bp35a1, time.monotonic() - start
+
+
+def bench_properties(bp35a1, count):
+    result = {}
+    for epc in EPCS:
+        samples = []
+        for _ in range(count):
+            start = time.monotonic()
+            try:
+                bp35a1.read_propaty(epc)
+            except Exception:
+                continue
+            samples.append(time.monotonic() - start)
+        result[epc] = samples
+    return result
+
+
+def bench_polling(bp35a1, seconds):
+    (cycles, errors) = (0, 0)
+    start = time.monotonic()
+    while time.monotonic() - start < seconds:
+        try:
+            bp35a1.instantaneous_values()
+            cycles += 1
+        except Exception:
+            errors += 1
+    return cycles, errors, time.monotonic() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--normal', action='store_true',
+                        help='also measure normal (non-fast) mode')
+    parser.add_argument('--count', type=int, default=20)
+    parser.add_argument('--seconds', type=float, default=5.0)
+    parser.add_argument('--latency', type=float, default=5.0,
+                        help='module response latency (ms)')
+    parser.add_argument('--jitter', type=float, default=0.0, help='ms')
+    parser.add_argument('--rtt', type=float, default=100.0,
+                        help='radio round trip time (ms)')
+    parser.add_argument('--loss', type=float, default=0.0)
+    parser.add_argument('--time-scale', type=float, default=1.0,
+                        help='scan/join time scale')
+    parser.add_argument('--timeout', type=int, default=2,
+                        help='response timeout (s)')
+    args = parser.parse_args()
+
+    modes = [('fast', True)] + ([('normal', False)] if args.normal else [])
+    for (name, fast) in modes:
+        print('[{}]'.format(name))
+        (bp35a1, elapsed) = bench_open(args, fast)
+        print('open(): {:.2f}s'.format(elapsed))
+
+        result = bench_properties(bp35a1,
+                                  args.count if fast else min(args.count, 3))
+        print('{:<6} {:>6} {:>10} {:>10}'.format('EPC', 'ok', 'p50(ms)',
+                                                'p95(ms)'))
+        for (epc, samples) in result.items():
+            if samples:
+                print('{:<6} {:>6} {:>10.1f} {:>10.1f}'.format(
+                    epc, len(samples),
+                    percentile(samples, 0.5) * 1000,
+                    percentile(samples, 0.95) * 1000))
+            else:
+                print('{:<6} {:>6} {:>10} {:>10}'.format(epc, 0, '-', '-'))
+
+        (cycles, errors, elapsed) = bench_polling(bp35a1, args.seconds)
+        print('polling: {} cycles, {} errors, {:.2f} cycles/s, '
+              '{:.2f} properties/s'.format(cycles, errors, cycles / elapsed,
+                                           cycles * 2 / elapsed))
+
+
+if __name__ == '__main__':
+    main()
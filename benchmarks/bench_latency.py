@@ -0,0 +1,56 @@
+"""
+BP35A1 コマンド1回あたりのレイテンシ計測（通常モード / ファストモード）
+
+エミュレータ(emulator.py)に対して、SKVER と read_propaty('E7') の1回あたりの
+所要時間を計測します。
+
+    python3 benchmarks/bench_latency.py [--count N] [--latency MS]
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from BP35A1 import BP35A1  # noqa: E402
+from emulator import BP35A1Emulator  # noqa: E402
+
+
+def measure(fast, count, latency):
+    uart = BP35A1Emulator(latency=latency, rtt=latency)
+    bp35a1 = BP35A1('id', 'password', '50', '22', uart=uart, fast=fast)
+    bp35a1.ipv6_addr = uart.establish()
+
+    result = {}
+    for (name, func) in (('SKVER', bp35a1.skVer),
+                         ('read_propaty(E7)',
+                          lambda: bp35a1.read_propaty('E7'))):
+        start = time.monotonic()
+        for _ in range(count):
+            func()
+        result[name] = (time.monotonic() - start) / count
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--count', type=int, default=3)
+    parser.add_argument('--latency', type=float, default=20.0,
+                        help='module response latency (ms)')
+    args = parser.parse_args()
+
+    before = measure(False, args.count, args.latency / 1000)
+    after = measure(True, args.count, args.latency / 1000)
+
+    print('{:<20} {:>12} {:>12} {:>8}'.format('command', 'normal(ms)',
+                                             'fast(ms)', 'speedup'))
+    for name in before:
+        print('{:<20} {:>12.1f} {:>12.1f} {:>7.1f}x'.format(
+            name, before[name] * 1000, after[name] * 1000,
+            before[name] / after[name]))
+
+
+if __name__ == '__main__':
+    main()
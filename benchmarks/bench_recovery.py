@@ -0,0 +1,106 @@
+"""
+障害からの復旧時間（エミュレータ使用）
+
+エミュレータで障害を起こし、BP35A1.recover() で計測を再開できるまでの
+時間を、再起動後と同じスキャンからの接続(open)の時間と比べます。
+（実機の再起動では、さらに WiFi の接続と時刻合わせの時間がかかります）
+
+- expire : PANAセッションの期限切れ(EVENT 29)
+- outage : 無線の途絶（--outage 秒）
+- mac    : メーターの交換（MACアドレスの変更）
+- moved  : チャンネル・PAN IDの変更
+
+    python3 benchmarks/bench_recovery.py [--rtt MS] [--timeout S]
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from BP35A1 import BP35A1  # noqa: E402
+from emulator import BP35A1Emulator  # noqa: E402
+
+FAULTS = (
+    ('expire', lambda uart, args: uart.expire_session()),
+    ('outage', lambda uart, args: uart.outage(args.outage)),
+    ('mac', lambda uart, args: uart.move(mac_addr='001D129012345679')),
+    ('moved', lambda uart, args: uart.move(channel='2A', pan_id='9999')),
+)
+
+
+def create(args):
+    uart = BP35A1Emulator(rtt=args.rtt / 1000,
+                          time_scale=args.time_scale,
+                          notify_interval=None,
+                          seed=1)
+    bp35a1 = BP35A1('id', 'password', '50', '22', uart=uart, fast=True)
+    bp35a1.timeout = args.timeout
+    bp35a1.SILENCE_TIMEOUT = args.timeout
+    return uart, bp35a1
+
+
+def bench_fault(args, fault):
+    """
+    障害から計測を再開するまでの時間（秒）、そのうちの復旧の時間（秒）、
+    実行した復旧の手順
+    """
+    (uart, bp35a1) = create(args)
+    bp35a1.open()
+    bp35a1.instantaneous_values()
+    fault(uart, args)
+    start = time.monotonic()
+    for _ in range(10):
+        try:
+            bp35a1.instantaneous_values()
+            break
+        except Exception as e:
+            if not bp35a1.recover(e):
+                return None, None, 'failed'
+    elapsed = time.monotonic() - start
+    steps = [
+        '{}:{}'.format(name.split('.')[1], n)
+        for (name, n) in bp35a1.metrics.counters.items()
+        if name.startswith('recovery.')
+    ]
+    recovery = bp35a1.metrics.histogram('session', 'recovery').sum / 1000
+    return elapsed, recovery, ' '.join(steps)
+
+
+def bench_open(args):
+    (uart, bp35a1) = create(args)
+    start = time.monotonic()
+    bp35a1.open()
+    bp35a1.instantaneous_values()
+    return time.monotonic() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--rtt', type=float, default=100.0,
+                        help='radio round trip time (ms)')
+    parser.add_argument('--time-scale', type=float, default=1.0,
+                        help='scan/join time scale')
+    parser.add_argument('--timeout', type=float, default=5.0,
+                        help='response timeout (s)')
+    parser.add_argument('--outage', type=float, default=8.0,
+                        help='outage duration (s)')
+    args = parser.parse_args()
+
+    print('{:<8} {:>10} {:>12}  {}'.format('fault', 'resume(s)',
+                                           'recovery(s)', 'steps'))
+    for (name, fault) in FAULTS:
+        (elapsed, recovery, steps) = bench_fault(args, fault)
+        if elapsed is None:
+            print('{:<8} {:>10} {:>12}  {}'.format(name, '-', '-', steps))
+        else:
+            print('{:<8} {:>10.2f} {:>12.2f}  {}'.format(
+                name, elapsed, recovery, steps))
+    print('{:<8} {:>10.2f} {:>12}  (scan and join after reboot)'.format(
+        'open', bench_open(args), ''))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,118 @@
+"""
+スキャン(skScan)の所要時間（エミュレータ使用）
+
+従来の全チャンネル一括スキャン（SKSCAN 2 FFFFFFFF、見つかるまで時間を
+延ばす）と、前回のチャンネル、見つかった回数の多いチャンネルから順に
+1つずつスキャンし（目的のメーターが見つかったら終了）、残りをまとめて
+スキャンする方法を比べます。ファストモードと、コマンドの送信・1行の
+受信毎に固定ウェイト（--pause 秒、実機では 0.5 秒）が入る通常モードで
+計測します。
+
+- cold    : 手がかりなし
+- history : 前回のチャンネルが見つかった回数に記録されている
+- warm    : 前回のチャンネルとMACアドレスが分かっている（再スキャン）
+- moved   : 前回と違うチャンネルにメーターが移った
+
+    python3 benchmarks/bench_scan.py [--channel 3A] [--scan-duration 8]
+                                     [--pause 0.05]
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from BP35A1 import BP35A1, skfunc  # noqa: E402
+from emulator import BP35A1Emulator  # noqa: E402
+
+
+class LegacyScanBP35A1(BP35A1):
+    """
+    従来のスキャン（全チャンネルを一括でスキャンし、時間を 6 から 10 まで延ばす）
+    """
+    @skfunc
+    def skScan(self, duration=6):
+        while duration <= 10:
+            self.reset_scan()
+            self.writeln('SKSCAN 2 FFFFFFFF ' + str(duration))
+            deadline = self.deadline()
+            while True:
+                ln = self.readln(deadline=deadline)
+                if ln.startswith(b'EVENT 22'):
+                    break
+                if b':' in ln:
+                    key, val = ln.decode().strip().split(':')[:2]
+                    if key == 'Channel':
+                        self.channel = val
+                    elif key == 'Pan ID':
+                        self.pan_id = val
+                    elif key == 'Addr':
+                        self.mac_addr = val
+                    elif key == 'LQI':
+                        self.lqi = val
+            if self.channel and self.pan_id and self.mac_addr and self.lqi:
+                return True
+            duration = duration + 1
+        return False
+
+
+def prepare(bp35a1, uart, case):
+    if case == 'history':
+        bp35a1.scan_history = {uart.channel: 3}
+    elif case == 'warm':
+        bp35a1.scan_hint = (uart.channel, uart.mac_addr)
+        bp35a1.scan_history = {uart.channel: 3}
+    elif case == 'moved':
+        bp35a1.scan_hint = ('21', uart.mac_addr)
+        bp35a1.scan_history = {'21': 3}
+
+
+def bench(cls, args, case, fast):
+    uart = BP35A1Emulator(channel=args.channel,
+                          scan_duration=args.scan_duration,
+                          time_scale=args.time_scale,
+                          notify_interval=None,
+                          seed=1)
+    bp35a1 = cls('id', 'password', '50', '22', uart=uart, fast=fast)
+    bp35a1.PAUSE = args.pause
+    prepare(bp35a1, uart, case)
+    start = time.monotonic()
+    ok = bp35a1.skScan()
+    elapsed = time.monotonic() - start
+    if not ok or bp35a1.channel != args.channel:
+        return None, bp35a1
+    return elapsed, bp35a1
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--channel', default='3A',
+                        help='meter channel (21-3C)')
+    parser.add_argument('--scan-duration', type=int, default=8,
+                        help='minimum duration to find the meter (6-10)')
+    parser.add_argument('--time-scale', type=float, default=1.0,
+                        help='scan time scale')
+    parser.add_argument('--pause', type=float, default=0.05,
+                        help='fixed wait in normal mode (s, 0.5 on device)')
+    args = parser.parse_args()
+
+    print('channel {}, found at duration {}'.format(args.channel,
+                                                    args.scan_duration))
+    print('{:<6} {:<8} {:>10} {:>10} {:>7}'.format('mode', 'case',
+                                                   'legacy(s)', 'adaptive(s)',
+                                                   'scans'))
+    for (mode, fast) in (('fast', True), ('normal', False)):
+        for case in ('cold', 'history', 'warm', 'moved'):
+            (legacy, _) = bench(LegacyScanBP35A1, args, case, fast)
+            (adaptive, bp35a1) = bench(BP35A1, args, case, fast)
+            print('{:<6} {:<8} {:>10} {:>10} {:>7}'.format(
+                mode, case,
+                '-' if legacy is None else '{:.2f}'.format(legacy),
+                '-' if adaptive is None else '{:.2f}'.format(adaptive),
+                bp35a1.last_scan['scans']))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,92 @@
+"""
+受信待ちの CPU 使用率とタイムアウトの精度（エミュレータ使用）
+
+- 応答待ちの間の CPU 使用率（プロセスの CPU 時間 / 経過時間）
+- readln(timeout) のタイムアウトの遅れ（エミュレータ、pty、メモリ）
+
+比較として、従来の any() の空回り（utime.time() で1秒単位の判定）も
+計測します。
+
+    python3 benchmarks/bench_wait.py [--rtt MS] [--count N]
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import transport  # noqa: E402
+from BP35A1 import BP35A1  # noqa: E402
+from emulator import BP35A1Emulator  # noqa: E402
+
+
+class SpinBP35A1(BP35A1):
+    """
+    従来の受信待ち（any() の空回り、utime.time() で判定）
+    """
+    def wait_line(self, deadline):
+        s = time.time()
+        while time.time() - s < self.timeout:
+            if self.uart.any():
+                return True
+        return False
+
+
+def bench_cpu(args, spin):
+    uart = BP35A1Emulator(rtt=args.rtt / 1000, notify_interval=None, seed=1)
+    bp35a1 = (SpinBP35A1 if spin else BP35A1)('id',
+                                               'password',
+                                               '50',
+                                               '22',
+                                               uart=uart,
+                                               fast=True)
+    bp35a1.ipv6_addr = uart.establish()
+
+    (wall, cpu) = (time.monotonic(), time.process_time())
+    for _ in range(args.count):
+        bp35a1.read_propaty('E7')
+    (wall, cpu) = (time.monotonic() - wall, time.process_time() - cpu)
+    return cpu / wall
+
+
+def bench_timeout(bp35a1, timeout, count):
+    late = []
+    for _ in range(count):
+        start = time.monotonic()
+        try:
+            bp35a1.readln(timeout)
+        except Exception:
+            pass
+        late.append((time.monotonic() - start - timeout) * 1000)
+    return sum(late) / len(late), max(late)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--rtt', type=float, default=200.0,
+                        help='radio round trip time (ms)')
+    parser.add_argument('--count', type=int, default=10)
+    parser.add_argument('--timeout', type=float, default=50.0,
+                        help='readln timeout (ms)')
+    args = parser.parse_args()
+
+    print('CPU while waiting for E7 (rtt {:.0f}ms):'.format(args.rtt))
+    print('  spin : {:6.1f}%'.format(bench_cpu(args, True) * 100))
+    print('  wait : {:6.1f}%'.format(bench_cpu(args, False) * 100))
+
+    print('readln({:.0f}ms) timeout, late avg/max (ms):'.format(args.timeout))
+    (master, name) = transport.PtyTransport.pair()
+    slave = transport.PtyTransport(name)
+    for (label, uart) in (('emulator', BP35A1Emulator(notify_interval=None)),
+                          ('pty', master), ('memory',
+                                            transport.MemoryTransport())):
+        bp35a1 = BP35A1('id', 'password', '50', '22', uart=uart, fast=True)
+        (avg, worst) = bench_timeout(bp35a1, args.timeout / 1000, args.count)
+        print('  {:<9}: {:6.2f} / {:6.2f}'.format(label, avg, worst))
+    slave.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -1,98 +1,290 @@
-# TOKYO GASの料金計算
+# 電気料金計算
+#
+# 料金プランはデータ（基本料金、段階料金、時間帯別料金）で定義し、
+# 読み込み時に累積の段階料金表へ変換しておきます。料金の計算は段階の
+# 二分探索と1回の積和だけで、プランは JSON から読み込むこともできます。
+#
+# TOKYO GASの料金
 # https://home.tokyo-gas.co.jp/power/ryokin/tanka/index.html
+try:
+    import ujson as json
+except ImportError:
+    import json
 
+# 料金プラン
+#
+# basic : 契約アンペア毎の基本料金（契約によらない場合は数値）
+# tiers : [上限(kWh), 単価(円/kWh)] の並び（最後の段階の上限は null）
+# bands : 時間帯別料金 {名前: {'hours': [開始, 終了], 'rate': 単価}}
+PLANS = {
+    'tokyo_gas_1s': {
+        'title': 'ずっとも電気1S',
+        'basic': {
+            '10': 286.00,
+            '15': 429.00,
+            '20': 572.00,
+            '40': 1144.00,
+            '50': 1430.00,
+            '60': 1716.00
+        },
+        'tiers': [[120, 19.85], [300, 25.35], [None, 27.48]],
+    },
+    'tokyo_gas_1': {
+        'title': 'ずっとも電気1',
+        'basic': {
+            '30': 858.00,
+            '40': 1144.00,
+            '50': 1430.00,
+            '60': 1716.00
+        },
+        'tiers': [[140, 23.67], [350, 23.88], [None, 26.41]],
+    },
+    'tokyo_gas_2': {
+        'title': 'ずっとも電気2',
+        'basic': 286.00,
+        'tiers': [[360, 19.85], [None, 26.47]],
+    },
+}
 
-def tokyo_gas_1s(contract, power):
+
+class Tariff:
     """
-    TOKYO GAS「ずっとも電気1S」での電気料金計算
+    料金プラン（累積の段階料金表にコンパイル済み）
 
     Parameters
     ----------
-    contract : str
-        契約アンペア数
-    power : float
-        前回検針後の使用電力量（kWh）
-    
-    Returns
-    -------
-    fee: int
+    name : str
+        プラン名
+    plan : dict
+        プランの定義（PLANS の要素と同じ形式）
+    """
+    def __init__(self, name, plan):
+        self.name = name
+        self.title = plan.get('title', name)
+        basic = plan['basic']
+        self.basic = basic if isinstance(basic, dict) else None
+        self.flat = 0.0 if self.basic is not None else float(basic)
+
+        # 段階の下限、下限までの累積料金、単価
+        self.bounds = []
+        self.base = []
+        self.rates = []
+        (lower, total) = (0.0, 0.0)
+        for (upper, rate) in plan['tiers']:
+            self.bounds.append(lower)
+            self.base.append(total)
+            self.rates.append(float(rate))
+            if upper is None:
+                break
+            if upper <= lower:
+                raise ValueError('Tariff: tiers must be increasing')
+            total += rate * (upper - lower)
+            lower = float(upper)
+        else:
+            raise ValueError('Tariff: last tier must have no upper limit')
+
+        # 時間帯別料金（時 → 時間帯名の表）
+        self.bands = {}
+        self.hours = [None] * 24
+        for (band, value) in plan.get('bands', {}).items():
+            self.bands[band] = float(value['rate'])
+            (start, end) = value['hours']
+            hour = start
+            while hour != end:
+                self.hours[hour] = band
+                hour = (hour + 1) % 24
+
+    def basic_charge(self, contract):
+        if self.basic is None:
+            return self.flat
+        return self.basic[contract]
+
+    def energy_charge(self, power):
+        """
+        段階料金による電力量料金
+        """
+        bounds = self.bounds
+        (lo, hi) = (0, len(bounds))
+        while hi - lo > 1:
+            mid = (lo + hi) // 2
+            if power < bounds[mid]:
+                hi = mid
+            else:
+                lo = mid
+        return self.base[lo] + self.rates[lo] * (power - bounds[lo])
+
+    def band(self, hour):
+        """
+        時刻(時)が属する時間帯（時間帯別料金がなければ None）
+        """
+        return self.hours[hour]
+
+    def fee(self, contract, power, usage=None):
+        """
         電気料金
+
+        Parameters
+        ----------
+        contract : str
+            契約アンペア数
+        power : float
+            前回検針後の使用電力量（kWh）
+        usage : dict
+            時間帯別の使用電力量 {時間帯名: kWh}（power の内数。
+            時間帯の分は時間帯の単価、残りは段階料金で計算）
+
+        Returns
+        -------
+        fee: int
+            電気料金
+        """
+        fee = self.basic_charge(contract)
+        if usage:
+            for (band, kwh) in usage.items():
+                fee += self.bands[band] * kwh
+                power -= kwh
+        return int(fee + self.energy_charge(power))
+
+    def __call__(self, contract, power, usage=None):
+        return self.fee(contract, power, usage)
+
+
+def load(path):
     """
-    fee = {
-        '10': 286.00,
-        '15': 429.00,
-        '20': 572.00,
-        '40': 1144.00,
-        '50': 1430.00,
-        '60': 1716.0
-    }[contract]
-
-    if power <= 120:
-        fee += 19.85 * power
-    elif power <= 300:
-        fee += 19.85 * 120
-        fee += 25.35 * (power - 120)
-    else:
-        fee += 19.85 * 120
-        fee += 25.35 * 300
-        fee += 27.48 * (power - 120 - 300)
-    return int(fee)
-
-
-def tokyo_gas_1(contract, power):
+    JSON ファイルから料金プランを読み込む（{プラン名: プラン} の形式）
     """
-    TOKYO GAS「ずっとも電気1」での電気料金計算
+    with open(path) as f:
+        return compile_plans(json.load(f))
 
-    Parameters
-    ----------
-    contract : str
-        契約アンペア数
-    power : float
-        前回検針後の使用電力量（kWh）
-    
-    Returns
-    -------
-    fee: int
-        電気料金
+
+def compile_plans(plans):
+    """
+    料金プランの定義をコンパイル（{プラン名: Tariff}）
     """
-    fee = {'30': 858.00, '40': 1144.00, '50': 1430.00, '60': 1716.00}[contract]
+    return {name: Tariff(name, plan) for (name, plan) in plans.items()}
+
 
-    if power <= 140:
-        fee += 23.67 * power
-    elif power <= 350:
-        fee += 23.67 * 140
-        fee += 23.88 * (power - 140)
-    else:
-        fee += 23.67 * 140
-        fee += 23.88 * 350
-        fee += 26.41 * (power - 140 - 350)
-    return int(fee)
+TARIFFS = compile_plans(PLANS)
 
 
-def tokyo_gas_2(contract, power):
+def plan(name, path=None):
     """
-    TOKYO GAS「ずっとも電気2」での電気料金計算
+    料金プランの取得
 
     Parameters
     ----------
-    contract : str
-        契約アンペア数
-    power : float
-        前回検針後の使用電力量（kWh）
-    
+    name : str
+        プラン名（例: 'tokyo_gas_1'）
+    path : str
+        追加の料金プランを定義した JSON ファイル
+
     Returns
     -------
-    fee: int
-        電気料金
+    tariff: Tariff
+        料金プラン（tariff(contract, power) で料金を計算）
     """
-    fee = 286.00
-    if power <= 360:
-        fee += 19.85 * power
-    else:
-        fee += 23.63 * 360
-        fee += 26.47 * (power - 360)
-    return int(fee)
+    tariffs = TARIFFS
+    if path:
+        tariffs = dict(TARIFFS)
+        tariffs.update(load(path))
+    if name not in tariffs:
+        raise ValueError('Unknown charge plan: {}'.format(name))
+    return tariffs[name]
+
+
+# 従来の料金計算関数（charge_func で指定）
+tokyo_gas_1s = TARIFFS['tokyo_gas_1s']
+tokyo_gas_1 = TARIFFS['tokyo_gas_1']
+tokyo_gas_2 = TARIFFS['tokyo_gas_2']
+
+
+# 料金表が従来の計算式と異なる範囲（この使用電力量(kWh)を超える範囲、理由）
+# 従来の計算式は上限を超えると下の段階を積み上げ直すため、上限の前後で
+# 料金が不連続になっていた。料金表では各段階の幅で積み上げる
+DIFFERENCES = {
+    'tokyo_gas_1s': (300, '3段階目が 120kWh 分多く 25.35円で積み上がる'),
+    'tokyo_gas_1': (350, '3段階目が 140kWh 分多く 23.88円で積み上がる'),
+    'tokyo_gas_2': (360, '2段階目で 1段階目の単価が 23.63円になる'),
+}
+
+# DIFFERENCES の範囲の料金（手計算、各段階の幅で積み上げた値）
+EXPECTED = {
+    # 1144 + 19.85 * 120 + 25.35 * 180 + 27.48 * (power - 300)
+    ('tokyo_gas_1s', '40', 301): 8116,
+    ('tokyo_gas_1s', '40', 500): 13585,
+    # 1144 + 23.67 * 140 + 23.88 * 210 + 26.41 * (power - 350)
+    ('tokyo_gas_1', '40', 351): 9499,
+    ('tokyo_gas_1', '40', 500): 13434,
+    # 286 + 19.85 * 360 + 26.47 * (power - 360)
+    ('tokyo_gas_2', '', 361): 7458,
+    ('tokyo_gas_2', '', 500): 11137,
+}
+
+
+def check():
+    """
+    料金表の検査（失敗すると AssertionError）
+
+    DIFFERENCES の上限までは従来の計算式と一致し、上限を超える範囲は
+    手計算の料金(EXPECTED)と一致すること。
+    """
+    # 従来の計算式（変更前の charge.py のまま）
+    def tokyo_gas_1s_legacy(contract, power):
+        fee = PLANS['tokyo_gas_1s']['basic'][contract]
+        if power <= 120:
+            fee += 19.85 * power
+        elif power <= 300:
+            fee += 19.85 * 120
+            fee += 25.35 * (power - 120)
+        else:
+            fee += 19.85 * 120
+            fee += 25.35 * 300
+            fee += 27.48 * (power - 120 - 300)
+        return int(fee)
+
+    def tokyo_gas_1_legacy(contract, power):
+        fee = PLANS['tokyo_gas_1']['basic'][contract]
+        if power <= 140:
+            fee += 23.67 * power
+        elif power <= 350:
+            fee += 23.67 * 140
+            fee += 23.88 * (power - 140)
+        else:
+            fee += 23.67 * 140
+            fee += 23.88 * 350
+            fee += 26.41 * (power - 140 - 350)
+        return int(fee)
+
+    def tokyo_gas_2_legacy(contract, power):
+        fee = 286.00
+        if power <= 360:
+            fee += 19.85 * power
+        else:
+            fee += 23.63 * 360
+            fee += 26.47 * (power - 360)
+        return int(fee)
+
+    for (name, legacy) in (('tokyo_gas_1s', tokyo_gas_1s_legacy),
+                           ('tokyo_gas_1', tokyo_gas_1_legacy),
+                           ('tokyo_gas_2', tokyo_gas_2_legacy)):
+        tariff = TARIFFS[name]
+        limit = DIFFERENCES[name][0]
+        for contract in tariff.basic if tariff.basic else ('',):
+            for power in range(0, limit * 2 + 1):
+                p = power / 2
+                assert tariff(contract, p) == legacy(contract, p), (
+                    '{} {} {}kWh: {} != {} (legacy)'.format(
+                        name, contract, p, tariff(contract, p),
+                        legacy(contract, p)))
+
+    for ((name, contract, power), fee) in EXPECTED.items():
+        assert TARIFFS[name](contract, power) == fee, (
+            '{} {} {}kWh: {} != {}'.format(name, contract, power,
+                                           TARIFFS[name](contract, power),
+                                           fee))
 
 
 if __name__ == '__main__':
     print(tokyo_gas_1('50', 339))
+    check()
+    print('check: ok')
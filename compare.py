@@ -0,0 +1,258 @@
+"""
+電気料金プランの比較（PC 上の Python + NumPy で実行）
+
+30 分毎（または検針期間毎）の使用電力量から、charge.py の全料金プランの
+電気料金を検針期間毎に計算し、合計の安い順に並べます。段階料金は
+累積の段階料金表(charge.Tariff)を searchsorted で引くので、全期間・全プランを
+まとめて配列演算で計算できます。
+
+    python3 compare.py usage.csv --contract 50 --collect-date 22
+    python3 compare.py --synthetic 3 --contract 40 --collect-date 1
+
+usage.csv は1行に「時刻,使用電力量(kWh)」で、時刻は UNIX 時刻か
+'YYYY-MM-DD HH:MM:SS'（日本時間、30 分の区切りの開始時刻）です。
+--cumulative を指定すると積算電力量（BP35A1.history() の出力など）として
+差分を取ります。
+"""
+import argparse
+import csv
+import sys
+import time
+
+import numpy as np
+
+import charge
+
+JST = 9 * 3600
+SLOT = 30 * 60
+
+
+def billing_periods(times, collect_date, offset=JST):
+    """
+    時刻毎の検針期間
+
+    Parameters
+    ----------
+    times : numpy.ndarray
+        時刻（UNIX 時刻）
+    collect_date : int
+        検針日
+
+    Returns
+    -------
+    (labels, index): tuple
+        検針期間（開始日の 'YYYY-MM-DD'）の配列と、時刻毎の検針期間の番号
+    """
+    local = np.asarray(times, dtype=np.int64) + offset
+    local = local.astype('datetime64[s]')
+    months = local.astype('datetime64[M]')
+    days = (local.astype('datetime64[D]') - months).astype(np.int64) + 1
+    months = months - (days < collect_date).astype(np.int64)
+    (starts, index) = np.unique(months, return_inverse=True)
+    labels = np.array([
+        '{}-{:02d}'.format(month, collect_date)
+        for month in starts.astype(str)
+    ])
+    return labels, index.ravel()
+
+
+class VectorTariff:
+    """
+    料金プランの配列版
+
+    Parameters
+    ----------
+    tariff : charge.Tariff
+        料金プラン
+    """
+    def __init__(self, tariff):
+        self.tariff = tariff
+        self.name = tariff.name
+        self.bounds = np.array(tariff.bounds)
+        self.base = np.array(tariff.base)
+        self.rates = np.array(tariff.rates)
+        self.band_names = sorted(tariff.bands)
+        self.band_rates = np.array([tariff.bands[b] for b in self.band_names])
+        # 時 → 時間帯の番号（-1 は段階料金）
+        self.hours = np.array([
+            self.band_names.index(band) if band is not None else -1
+            for band in tariff.hours
+        ])
+
+    def available(self, contract):
+        return self.tariff.basic is None or contract in self.tariff.basic
+
+    def energy_charge(self, kwh):
+        """
+        段階料金による電力量料金（検針期間毎）
+        """
+        i = np.searchsorted(self.bounds, kwh, side='right') - 1
+        return self.base[i] + self.rates[i] * (kwh - self.bounds[i])
+
+    def fees(self, contract, kwh, index, hours, periods):
+        """
+        検針期間毎の電気料金
+
+        Parameters
+        ----------
+        contract : str
+            契約アンペア数
+        kwh : numpy.ndarray
+            区切り毎の使用電力量
+        index : numpy.ndarray
+            区切り毎の検針期間の番号
+        hours : numpy.ndarray
+            区切り毎の時(0-23)
+        periods : int
+            検針期間の数
+        """
+        fee = np.full(periods, self.tariff.basic_charge(contract))
+        tiered = kwh
+        if len(self.band_names):
+            bands = self.hours[hours]
+            for (i, rate) in enumerate(self.band_rates):
+                mask = bands == i
+                fee += rate * np.bincount(
+                    index[mask], weights=kwh[mask], minlength=periods)
+            tiered = np.where(bands < 0, kwh, 0.0)
+        total = np.bincount(index, weights=tiered, minlength=periods)
+        return np.floor(fee + self.energy_charge(total)).astype(np.int64)
+
+
+def compare(times, kwh, contract, collect_date, tariffs=None):
+    """
+    全料金プランの検針期間毎の電気料金
+
+    Parameters
+    ----------
+    times : numpy.ndarray
+        区切りの開始時刻（UNIX 時刻）
+    kwh : numpy.ndarray
+        区切り毎の使用電力量(kWh)
+    contract : str
+        契約アンペア数
+    collect_date : int
+        検針日
+    tariffs : dict
+        料金プラン（省略時は charge.TARIFFS）
+
+    Returns
+    -------
+    (labels, usage, result): tuple
+        検針期間、検針期間毎の使用電力量、合計の安い順の
+        [(プラン名, 合計, 検針期間毎の料金)]
+    """
+    times = np.asarray(times, dtype=np.int64)
+    kwh = np.asarray(kwh, dtype=np.float64)
+    (labels, index) = billing_periods(times, collect_date)
+    hours = (times + JST) // 3600 % 24
+    usage = np.bincount(index, weights=kwh, minlength=len(labels))
+
+    result = []
+    for tariff in (tariffs if tariffs else charge.TARIFFS).values():
+        vector = VectorTariff(tariff)
+        if not vector.available(contract):
+            continue
+        fees = vector.fees(contract, kwh, index, hours, len(labels))
+        result.append((tariff.name, int(fees.sum()), fees))
+    result.sort(key=lambda r: r[1])
+    return labels, usage, result
+
+
+def read_csv(path, cumulative=False):
+    """
+    「時刻,使用電力量」の CSV の読み込み
+
+    行は時刻順に並べ替える。cumulative なら積算値の差を使用電力量とし、
+    負の差（メーターの交換・桁あふれなど）は 0 とする。
+    """
+    (times, values) = ([], [])
+    with (open(path) if path != '-' else sys.stdin) as f:
+        for row in csv.reader(f):
+            if len(row) < 2 or not row[1].strip():
+                continue
+            try:
+                t = int(float(row[0]))
+            except ValueError:
+                t = int(np.datetime64(row[0].strip().replace(' ', 'T'), 's')
+                        .astype(np.int64)) - JST
+            times.append(t)
+            values.append(float(row[1]))
+    times = np.array(times, dtype=np.int64)
+    values = np.array(values)
+    order = np.argsort(times, kind='stable')
+    (times, values) = (times[order], values[order])
+    if cumulative:
+        deltas = np.diff(values)
+        negative = int(np.count_nonzero(deltas < 0))
+        if negative:
+            print('{}: {} negative deltas clipped to 0'.format(path, negative),
+                  file=sys.stderr)
+        (times, values) = (times[:-1], np.clip(deltas, 0, None))
+    return times, values
+
+
+def synthetic(years, seed=1):
+    """
+    計測用の 30 分毎の使用電力量（平均 0.5kW、日内変動あり）
+    """
+    rng = np.random.default_rng(seed)
+    start = 1577804400  # 2020-01-01 00:00 JST
+    times = start + np.arange(int(years * 365 * 48), dtype=np.int64) * SLOT
+    phase = (times + JST) % 86400 / 86400 * 2 * np.pi
+    kw = 0.5 + 0.4 * np.sin(phase - np.pi / 2) + rng.exponential(0.1,
+                                                                 len(times))
+    return times, kw * SLOT / 3600
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__.strip().split('\n')[0])
+    parser.add_argument('csv', nargs='?', help="'-' for stdin")
+    parser.add_argument('--contract', default='40', help='contract amperage')
+    parser.add_argument('--collect-date', type=int, default=1)
+    parser.add_argument('--plans', help='additional plans (JSON)')
+    parser.add_argument('--cumulative', action='store_true',
+                        help='values are cumulative energy')
+    parser.add_argument('--synthetic', type=float, metavar='YEARS',
+                        help='use synthetic 30-minute data')
+    parser.add_argument('--periods', action='store_true',
+                        help='show fees for each billing period')
+    args = parser.parse_args()
+
+    if args.synthetic:
+        (times, kwh) = synthetic(args.synthetic)
+    elif args.csv:
+        (times, kwh) = read_csv(args.csv, args.cumulative)
+    else:
+        parser.error('csv or --synthetic is required')
+
+    tariffs = dict(charge.TARIFFS)
+    if args.plans:
+        tariffs.update(charge.load(args.plans))
+
+    start = time.perf_counter()
+    (labels, usage, result) = compare(times, kwh, args.contract,
+                                      args.collect_date, tariffs)
+    elapsed = time.perf_counter() - start
+
+    print('{} slots, {} periods, {:.1f} kWh, {} plans: {:.1f} ms'.format(
+        len(kwh), len(labels), usage.sum(), len(result), elapsed * 1000))
+    print('{:<4} {:<20} {:>12} {:>10} {:>10}'.format('rank', 'plan', 'total',
+                                                     'monthly', 'diff'))
+    for (rank, (name, total, fees)) in enumerate(result, 1):
+        print('{:<4} {:<20} {:>12,} {:>10,.0f} {:>+10,}'.format(
+            rank, name, total, total / len(labels), total - result[0][1]))
+
+    if args.periods:
+        print()
+        print('{:<12} {:>8}'.format('period', 'kWh') +
+              ''.join(' {:>14}'.format(name) for (name, _, _) in result))
+        for (i, label) in enumerate(labels):
+            print('{:<12} {:>8.1f}'.format(label, usage[i]) +
+                  ''.join(' {:>14,}'.format(fees[i])
+                          for (_, _, fees) in result))
+
+
+if __name__ == '__main__':
+    main()
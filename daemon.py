@@ -0,0 +1,275 @@
+"""
+複数のスマートメーターを同時に計測するホスト用デーモン（CPython）
+
+ポート毎に BP35A1（互換ドングル）を1つずつ割り当て、ポート毎の
+スレッドで接続・計測します。セッション情報やロガーはメーター毎に持ち、
+計測値は共有のシンク(Sink)へ書き出します。
+
+    python3 daemon.py meters.json
+
+meters.json の例:
+
+    {
+      "interval": 10,
+      "monthly_interval": 60,
+      "output": "samples.jsonl",
+      "session_dir": "sessions",
+      "fast_mode": true,
+      "http_port": 8080,
+      "meters": [
+        {"name": "house", "port": "/dev/ttyUSB0", "id": "...",
+         "password": "...", "contract_amperage": "50", "collect_date": "22"}
+      ]
+    }
+"""
+import json
+import logging
+import os
+import sys
+import threading
+import time
+
+import transport
+from BP35A1 import BP35A1
+from server import Readings, Server
+
+
+class Sink:
+    """
+    計測値の共有シンク（全メーターのスレッドから書き込む）
+
+    Parameters
+    ----------
+    stream : file
+        JSON Lines の書き出し先（None の場合は件数のみ数える）
+    """
+    def __init__(self, stream=None):
+        self.stream = stream
+        self.lock = threading.Lock()
+        self.counts = {}
+
+    def put(self, meter, kind, values):
+        sample = {'meter': meter, 'kind': kind, 'time': time.time()}
+        sample.update(values)
+        with self.lock:
+            self.counts[meter] = self.counts.get(meter, 0) + 1
+            if self.stream:
+                self.stream.write(json.dumps(sample) + '\n')
+                self.stream.flush()
+
+    def total(self):
+        with self.lock:
+            return sum(self.counts.values())
+
+
+class Meter(threading.Thread):
+    """
+    スマートメーター1台分の計測スレッド
+
+    Parameters
+    ----------
+    config : dict
+        メーターの設定（name, port, id, password, contract_amperage,
+        collect_date）
+    sink : Sink
+        計測値の書き出し先
+    uart_factory : function
+        config から通信路を作成する関数（既定は transport.create(port)）
+    interval : float
+        瞬時値の取得間隔（秒、0で連続）
+    monthly_interval : float
+        今月の電力量の取得間隔（秒、Noneで取得しない）
+    session_dir : str
+        セッション情報を保存するディレクトリ
+    fast : bool
+        ファストモード
+    """
+    def __init__(self,
+                 config,
+                 sink,
+                 *,
+                 uart_factory=None,
+                 interval=10,
+                 monthly_interval=60,
+                 session_dir=None,
+                 fast=True):
+        super().__init__(name=config['name'], daemon=True)
+        self.config = config
+        self.sink = sink
+        self.uart_factory = uart_factory if uart_factory else (
+            lambda config: transport.create(config['port']))
+        self.interval = interval
+        self.monthly_interval = monthly_interval
+        self.session_dir = session_dir
+        self.fast = fast
+        self.logger = logging.getLogger('daemon.' + config['name'])
+        self.running = False
+        self.bp35a1 = None
+
+        # 最新の計測値（HTTP サーバが返す。今月の電力量はこれが古くなったら取得）
+        self.readings = Readings(config['name'],
+                                 max_age=max(interval * 3, 30))
+
+        # 統計
+        self.cycles = 0
+        self.errors = 0
+        self.reconnects = 0
+
+    def connect(self):
+        self.disconnect()
+        config = self.config
+        session_file = os.path.join(
+            self.session_dir, config['name'] +
+            '.session.json') if self.session_dir else None
+        self.bp35a1 = BP35A1(config['id'],
+                             config['password'],
+                             config['contract_amperage'],
+                             config['collect_date'],
+                             logger_name='BP35A1.' + config['name'],
+                             uart=self.uart_factory(config),
+                             fast=self.fast,
+                             session_file=session_file)
+        if not self.bp35a1.open():
+            raise Exception('Can not connect to the smart meter')
+
+    def disconnect(self):
+        """
+        前回の接続の通信路を閉じる（再接続で同じポートを開き直す前に）
+        """
+        if self.bp35a1 is None:
+            return
+        close = getattr(self.bp35a1.uart, 'close', None)
+        self.bp35a1 = None
+        if close:
+            try:
+                close()
+            except Exception as e:
+                self.logger.debug('close: %s', e)
+
+    def poll(self, monthly):
+        (created, amperage, power) = self.bp35a1.instantaneous_values()
+        self.sink.put(self.name, 'instantaneous', {
+            'created': created,
+            'amperage': amperage,
+            'power': power
+        })
+        self.readings.update('instantaneous_amperage', amperage, created)
+        self.readings.update('instantaneous_power', power, created)
+        if monthly:
+            (collected, energy) = self.bp35a1.monthly_power()
+            self.sink.put(self.name, 'monthly', {
+                'collected': collected,
+                'energy': energy
+            })
+            self.readings.update('monthly_energy', energy, collected)
+            total = self.bp35a1.cached('EA')
+            if total:
+                self.readings.update('total_energy', total[1], total[0])
+        self.cycles += 1
+
+    def run(self):
+        self.running = True
+        backoff = 1
+        while self.running:
+            try:
+                self.connect()
+                backoff = 1
+                while self.running:
+                    start = time.monotonic()
+                    monthly = (self.monthly_interval is not None
+                               and self.readings.stale(
+                                   'monthly_energy', self.monthly_interval))
+                    try:
+                        self.poll(monthly)
+                    except Exception as e:
+                        # セッションを張り直して復旧し、再スキャンまで
+                        # 失敗した場合は接続からやり直す
+                        self.errors += 1
+                        self.logger.error('poll: %s', e)
+                        if not self.bp35a1.recover(e):
+                            raise
+                    wait = self.interval - (time.monotonic() - start)
+                    if wait > 0:
+                        time.sleep(wait)
+            except Exception as e:
+                # 再接続（間隔を延ばしながら）
+                self.logger.error('%s (reconnect in %ds)', e, backoff)
+                self.reconnects += 1
+                time.sleep(backoff)
+                backoff = min(backoff * 2, 300)
+        self.disconnect()
+
+    def stop(self):
+        self.running = False
+
+    def stats(self):
+        return {
+            'cycles': self.cycles,
+            'errors': self.errors,
+            'reconnects': self.reconnects
+        }
+
+
+class Daemon:
+    """
+    複数メーターの計測
+
+    Parameters
+    ----------
+    meters : list of dict
+        メーター毎の設定
+    sink : Sink
+        計測値の書き出し先
+    kwds :
+        Meter に渡すパラメータ
+    """
+    def __init__(self, meters, sink, **kwds):
+        self.sink = sink
+        self.meters = [Meter(config, sink, **kwds) for config in meters]
+
+    def start(self):
+        for meter in self.meters:
+            meter.start()
+
+    def stop(self, timeout=None):
+        for meter in self.meters:
+            meter.stop()
+        for meter in self.meters:
+            meter.join(timeout)
+
+    def stats(self):
+        return {meter.name: meter.stats() for meter in self.meters}
+
+
+def main():
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s %(name)s %(levelname)s %(message)s')
+    with open(sys.argv[1]) as f:
+        config = json.load(f)
+    if config.get('session_dir'):
+        os.makedirs(config['session_dir'], exist_ok=True)
+
+    output = config.get('output')
+    stream = open(output, 'a') if output else sys.stdout
+    daemon = Daemon(config['meters'],
+                    Sink(stream),
+                    interval=config.get('interval', 10),
+                    monthly_interval=config.get('monthly_interval', 60),
+                    session_dir=config.get('session_dir'),
+                    fast=config.get('fast_mode', True))
+    daemon.start()
+    if config.get('http_port'):
+        server = Server([meter.readings for meter in daemon.meters],
+                        port=config['http_port'])
+        server.start()
+    try:
+        while True:
+            time.sleep(60)
+            logging.info('stats: %s', daemon.stats())
+    except KeyboardInterrupt:
+        daemon.stop(5)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,178 @@
+"""
+差分描画の LCD 表示（保持型の表示モデル）
+
+画面を固定の文字列(label)と値を表示する領域(widget)で定義し、値は前回
+描画した文字列と同じであれば描き直しません。固定の文字列は最初（と
+画面を消去した後）に1回だけ描きます。描き直す widget はフォント毎に
+まとめて描くので、フォントの切り替えは1回の描画でフォントの種類数まで
+です。
+
+値は背景色付き（非透過）で上書きし、前回の文字列より短くなった部分だけを
+背景色で消すので、領域全体を消してから描く場合のちらつきがありません。
+"""
+
+
+class Widget:
+    """
+    値を表示する領域
+
+    Parameters
+    ----------
+    x, y : int
+        基準の位置（align が 'right' なら右端、'center' なら領域の左端）
+    font : int
+        フォント（lcd.FONT_*）
+    color : int
+        文字色
+    height : int
+        文字の高さ（消去する高さ）
+    align : str
+        'right'（右揃え）または 'center'（幅 width の中央揃え）
+    width : int
+        中央揃えの領域の幅
+    """
+    def __init__(self, x, y, font, color, height, *, align='right', width=0):
+        self.x = x
+        self.y = y
+        self.font = font
+        self.color = color
+        self.height = height
+        self.align = align
+        self.width = width
+
+        self.text = None  # 表示する文字列
+        self.drawn = None  # 描画済みの (文字列, 左端, 幅)
+
+
+class Display:
+    """
+    差分描画の表示
+
+    Parameters
+    ----------
+    lcd : m5stack.lcd
+        描画先
+    bgcolor : int
+        背景色
+    """
+    def __init__(self, lcd, bgcolor=0x000000):
+        self.lcd = lcd
+        self.bgcolor = bgcolor
+        self.widgets = {}
+        self.labels = []
+        self.labels_drawn = False
+
+        # 統計
+        self.renders = 0
+        self.drawn = 0  # 描画した widget の数
+        self.skipped = 0  # 値が変わらず描画しなかった回数
+        self.font_switches = 0
+
+    def widget(self, name, *args, **kwds):
+        """
+        値を表示する領域の追加（引数は Widget と同じ）
+        """
+        self.widgets[name] = Widget(*args, **kwds)
+
+    def label(self, text, x, y, font, color, *, align='left'):
+        """
+        固定の文字列の追加
+
+        x に lcd.LASTX を指定すると前の文字列に続け、align が 'right' なら
+        x を右端とする。
+        """
+        self.labels.append((text, x, y, font, color, align))
+
+    def set(self, name, text):
+        """
+        値の設定（描画は render() で行う）
+        """
+        widget = self.widgets[name]
+        if widget.text == text:
+            self.skipped += 1
+        widget.text = text
+
+    def clear(self):
+        """
+        画面を消去して全体を描き直す
+        """
+        self.lcd.clear()
+        self.invalidate()
+
+    def invalidate(self):
+        """
+        全体の描き直し（画面を消去・回転した後に呼ぶ）
+        """
+        self.labels_drawn = False
+        for widget in self.widgets.values():
+            widget.drawn = None
+
+    def render(self):
+        """
+        変更のあった widget と、未描画の固定の文字列の描画
+
+        Returns
+        -------
+        drawn: int
+            描画した widget の数
+        """
+        lcd = self.lcd
+        self.renders += 1
+        font = None
+        if not self.labels_drawn:
+            for (text, x, y, label_font, color, align) in self.labels:
+                if label_font != font:
+                    font = label_font
+                    lcd.font(font, transparent=True)
+                    self.font_switches += 1
+                if align == 'right':
+                    x -= lcd.textWidth(text)
+                lcd.print(text, x, y, color)
+            self.labels_drawn = True
+
+        # 描き直す widget をフォント毎にまとめる
+        dirty = {}
+        for widget in self.widgets.values():
+            if widget.text is not None and (widget.drawn is None or
+                                            widget.drawn[0] != widget.text):
+                dirty.setdefault(widget.font, []).append(widget)
+
+        drawn = 0
+        for (widget_font, widgets) in dirty.items():
+            lcd.font(widget_font, transparent=False)
+            self.font_switches += 1
+            for widget in widgets:
+                self.draw(widget)
+                drawn += 1
+        self.drawn += drawn
+        return drawn
+
+    def draw(self, widget):
+        lcd = self.lcd
+        text = widget.text
+        w = lcd.textWidth(text)
+        if widget.align == 'center':
+            x = widget.x + (widget.width - w) // 2
+        else:
+            x = widget.x - w
+
+        # 前回の文字列のうち、新しい文字列で上書きされない部分を消す
+        if widget.drawn is not None:
+            (_, old_x, old_w) = widget.drawn
+            if old_x < x:
+                lcd.rect(old_x, widget.y, x - old_x, widget.height,
+                         self.bgcolor, self.bgcolor)
+            if old_x + old_w > x + w:
+                lcd.rect(x + w, widget.y, old_x + old_w - (x + w),
+                         widget.height, self.bgcolor, self.bgcolor)
+
+        lcd.print(text, x, widget.y, widget.color)
+        widget.drawn = (text, x, w)
+
+    def stats(self):
+        return {
+            'renders': self.renders,
+            'drawn': self.drawn,
+            'skipped': self.skipped,
+            'font_switches': self.font_switches,
+        }
@@ -0,0 +1,335 @@
+# ECHONET Lite 低圧スマート電力量メータークラス(0x0288)のフレーム処理
+# ECHONET 規格書 APPENDIX ECHONET 機器オブジェクト詳細規定 3.3.25
+
+try:
+    import ubinascii as binascii
+except ImportError:
+    import binascii
+try:
+    import ustruct as struct
+except ImportError:
+    import struct
+
+# フレームヘッダ
+EHD = b'\x10\x81'
+SEOJ = b'\x05\xFF\x01'  # コントローラ
+DEOJ = b'\x02\x88\x01'  # 低圧スマート電力量メータ
+
+# ESV
+SETC = 0x61  # プロパティ値書き込み要求（応答要）
+GET = 0x62  # プロパティ値読み出し要求
+INFC_RES = 0x7A  # プロパティ値通知応答
+SET_RES = 0x71  # プロパティ値書き込み応答
+GET_RES = 0x72  # プロパティ値読み出し応答
+INF = 0x73  # プロパティ値通知
+INFC = 0x74  # プロパティ値通知（応答要）
+SNA = (0x50, 0x51, 0x52, 0x53)  # 不可応答
+
+# 低圧スマート電力量メータ(028801)
+METER = 0x028801
+
+# 1フレームで扱うプロパティ数の上限
+MAX_PROPERTIES = 16
+
+# 積算電力量単位(E1)
+POWER_UNIT = {
+    0x00: 1.0,
+    0x01: 0.1,
+    0x02: 0.01,
+    0x03: 0.001,
+    0x04: 0.0001,
+    0x0A: 10.0,
+    0x0B: 100.0,
+    0x0C: 1000.0,
+    0x0D: 10000.0,
+}
+
+# 未計測値
+NO_DATA = 0xFFFFFFFE
+
+# 積算電力量計測値履歴１: 収集日(2byte) + 30分毎48コマ(4byte)
+HISTORY_FORMAT = '>H48I'
+
+# 16進文字列(ASCII)の変換
+
+
+def hex_int(data, start, end):
+    """
+    data[start:end] の16進文字を整数に変換（文字列を作らない）
+    """
+    value = 0
+    while start < end:
+        c = data[start]
+        # '0'-'9' は 0x30-0x39、'A'-'F' は 0x41-0x46、'a'-'f' は 0x61-0x66
+        value = (value << 4) | ((c & 0x0F) if c < 0x40 else (c & 0x0F) + 9)
+        start += 1
+    return value
+
+
+# デコーダ
+#
+# デコーダは受信データ(16進文字列の bytes/bytearray)、EDTの開始位置、
+# PDC(バイト数)とメーター(係数・単位・時刻を提供する BP35A1 オブジェクト)を
+# 受け取り、プロパティ値を返す。
+
+
+def uint(data, i, n, meter):
+    return hex_int(data, i, i + n * 2)
+
+
+def sint(bits):
+    sign = 1 << (bits - 1)
+
+    def decode(data, i, n, meter):
+        value = hex_int(data, i, i + n * 2)
+        return value - (sign << 1) if value & sign else value
+
+    return decode
+
+
+sint32 = sint(32)
+
+
+def energy(data, i, n, meter):
+    """
+    積算電力量(kWh)
+    """
+    return (hex_int(data, i, i + n * 2) * meter.power_coefficient *
+            meter.power_unit)
+
+
+def power_unit(data, i, n, meter):
+    return POWER_UNIT[hex_int(data, i, i + 2)]
+
+
+def history(data, i, n, meter):
+    """
+    積算電力量計測値履歴１（収集日と48コマ分の積算電力量、未計測はNone）
+    """
+    values = struct.unpack(HISTORY_FORMAT,
+                           binascii.unhexlify(bytes(data[i:i + n * 2])))
+    factor = meter.power_coefficient * meter.power_unit
+    return values[0], [
+        None if value == NO_DATA else value * factor for value in values[1:]
+    ]
+
+
+def instantaneous_power(data, i, n, meter):
+    return meter.timestamp(), sint32(data, i, n, meter)
+
+
+def instantaneous_amperage(data, i, n, meter):
+    r = hex_int(data, i, i + 4)
+    if r == 0x7ffe:
+        r = 0
+    t = hex_int(data, i + 4, i + 8)
+    if t == 0x7ffe:
+        t = 0
+    return meter.timestamp(), (r + t) / 10.0
+
+
+def fixed_time_energy(data, i, n, meter):
+    """
+    定時積算電力量（計測日時と積算電力量）
+    """
+    created = '{:04d}-{:02d}-{:02d} {:02d}:{:02d}:{:02d}'.format(
+        hex_int(data, i, i + 4), hex_int(data, i + 4, i + 6),
+        hex_int(data, i + 6, i + 8), hex_int(data, i + 8, i + 10),
+        hex_int(data, i + 10, i + 12), hex_int(data, i + 12, i + 14))
+    return created, energy(data, i + 14, 4, meter)
+
+
+def collect_date2(data, i, n, meter):
+    """
+    積算履歴収集日２（年, 月, 日, 時, 分, コマ数）
+    """
+    return (hex_int(data, i, i + 4), hex_int(data, i + 4, i + 6),
+            hex_int(data, i + 6, i + 8), hex_int(data, i + 8, i + 10),
+            hex_int(data, i + 10, i + 12), hex_int(data, i + 12, i + 14))
+
+
+# エンコーダ
+#
+# エンコーダは書き込む値を受け取り、EDT(bytes)を返す。
+
+
+def uint8(value):
+    return bytes([value])
+
+
+def datetime_count(value):
+    (year, month, mday, hour, minute, count) = value
+    return bytes([year >> 8, year & 0xFF, month, mday, hour, minute, count])
+
+
+# プロパティ定義: EPC -> (名称, デコーダ, エンコーダ)
+PROPERTIES = {
+    '80': ('動作状態', uint, None),
+    '88': ('異常発生状態', uint, None),
+    'D3': ('係数', uint, None),
+    'D7': ('積算電力量有効桁数', uint, None),
+    'E0': ('積算電力量計測値(正方向計測値)', energy, None),
+    'E1': ('積算電力量単位(正方向、逆方向計測値)', power_unit, None),
+    'E2': ('積算電力量計測値履歴１(正方向計測値)', history, None),
+    'E3': ('積算電力量計測値(逆方向計測値)', energy, None),
+    'E4': ('積算電力量計測値履歴１(逆方向計測値)', history, None),
+    'E5': ('積算履歴収集日１', uint, uint8),
+    'E7': ('瞬時電力計測値', instantaneous_power, None),
+    'E8': ('瞬時電流計測値', instantaneous_amperage, None),
+    'EA': ('定時積算電力量計測値(正方向計測値)', fixed_time_energy, None),
+    'EB': ('定時積算電力量計測値(逆方向計測値)', fixed_time_energy, None),
+    'ED': ('積算履歴収集日２', collect_date2, datetime_count),
+}
+
+
+def set_result(data, i, n, meter):
+    """
+    書き込み応答（受理されたプロパティのPDCは0）
+    """
+    return 0
+
+
+def compile_decoders(properties):
+    """
+    ESV -> (EPC -> デコーダ) の辞書を作成（EPCは整数）
+    """
+    decoders = {esv: {} for esv in (GET_RES, SET_RES, INF, INFC)}
+    for (epc, (_, decoder, encoder)) in properties.items():
+        for esv in (GET_RES, INF, INFC):
+            decoders[esv][int(epc, 16)] = decoder
+        if encoder:
+            decoders[SET_RES][int(epc, 16)] = set_result
+    return decoders
+
+
+DECODERS = compile_decoders(PROPERTIES)
+# EPC(整数) -> EPC(文字列)
+EPC_NAMES = {int(epc, 16): epc for epc in PROPERTIES}
+ENCODERS = {
+    epc: encoder
+    for (epc, (_, _, encoder)) in PROPERTIES.items() if encoder
+}
+
+
+def frame(tid, esv, properties):
+    """
+    ECHONET Liteフレームの作成
+
+    Parameters
+    ----------
+    tid : int
+        トランザクションID
+    esv : int
+        ESV（GET、SETCなど）
+    properties : list of tuple
+        (EPC, EDT)のリスト。読み出し要求ではEDTを b'' とする
+
+    Returns
+    -------
+    frame: bytes
+        送信するフレーム
+    """
+    data = EHD + bytes([tid >> 8, tid & 0xFF]) + SEOJ + DEOJ + bytes(
+        [esv, len(properties)])
+    for (epc, edt) in properties:
+        data += bytes([int(epc, 16), len(edt)]) + edt
+    return data
+
+
+def get_frame(tid, epcs):
+    return frame(tid, GET, [(epc, b'') for epc in epcs])
+
+
+def set_frame(tid, epc, value):
+    return frame(tid, SETC, [(epc, ENCODERS[epc](value))])
+
+
+def infc_res_frame(tid, epcs):
+    return frame(tid, INFC_RES, [(epc, b'') for epc in epcs])
+
+
+class Frame:
+    """
+    受信フレームの解析結果
+
+    ERXUDPのデータ部分(16進文字列)を指すオフセットで保持し、受信毎に
+    再利用する（解析でヒープを使わない）。
+    """
+    def __init__(self, size=MAX_PROPERTIES):
+        self.data = None
+        self.tid = 0
+        self.seoj = 0
+        self.esv = 0
+        self.opc = 0
+        self.epcs = [0] * size
+        self.pdcs = [0] * size
+        self.offsets = [0] * size
+
+    def parse(self, data, start, end):
+        """
+        data[start:end] の解析（フレームとして正しければ True）
+        """
+        if end - start < 24:
+            return False
+        self.data = data
+        self.tid = hex_int(data, start + 4, start + 8)
+        self.seoj = hex_int(data, start + 8, start + 14)
+        self.esv = hex_int(data, start + 20, start + 22)
+        opc = hex_int(data, start + 22, start + 24)
+        if opc > len(self.epcs):
+            return False
+
+        # OPC個のプロパティ(EPC, PDC, EDT)の位置を順に取り出す
+        i = start + 24
+        for k in range(opc):
+            if i + 4 > end:
+                return False
+            pdc = hex_int(data, i + 2, i + 4)
+            self.epcs[k] = hex_int(data, i, i + 2)
+            self.pdcs[k] = pdc
+            self.offsets[k] = i + 4
+            i += 4 + pdc * 2
+            if i > end:
+                return False
+        self.opc = opc
+        return True
+
+    def epc_names(self):
+        return ['{:02X}'.format(self.epcs[k]) for k in range(self.opc)]
+
+
+def parse(data):
+    """
+    受信フレーム(16進文字列)の解析
+
+    Returns
+    -------
+    frame: Frame
+        解析結果（フレームとして正しくなければ None）
+    """
+    if isinstance(data, str):
+        data = data.encode()
+    frame = Frame()
+    return frame if frame.parse(data, 0, len(data)) else None
+
+
+def decode(frame, meter):
+    """
+    プロパティ値のデコード
+
+    Returns
+    -------
+    values: dict
+        EPC -> プロパティ値（未定義のEPCは含まない）
+    """
+    values = {}
+    decoders = DECODERS.get(frame.esv)
+    if decoders is None:
+        return values
+    for k in range(frame.opc):
+        epc = frame.epcs[k]
+        decoder = decoders.get(epc)
+        if decoder:
+            values[EPC_NAMES[epc]] = decoder(frame.data, frame.offsets[k],
+                                             frame.pdcs[k], meter)
+    return values
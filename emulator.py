@@ -0,0 +1,529 @@
+"""
+BP35A1 と低圧スマート電力量メータ(0x028801)のエミュレータ
+
+BP35A1Emulator は UART と同じインターフェース(any/read/readline/write)を
+持ち、BP35A1(..., uart=BP35A1Emulator()) としてハードウェアなしで
+ドライバを動作させることができます。応答遅延(latency)、ゆらぎ(jitter)、
+ERXUDPの損失率(loss)を設定できます。expire_session()、outage()、move() で
+セッションの期限切れ、無線の途絶、メーターの移動（チャンネル等の変更）を
+起こせます。
+"""
+import bisect
+import math
+import random
+import time
+
+# 低圧スマート電力量メータの積算電力量
+BASE_KWH = 12345.6  # 2020-01-01 00:00 時点の積算電力量
+AVERAGE_KW = 0.5  # 平均消費電力
+DAILY_KW = 0.4  # 日内変動の振幅
+EPOCH = 1577804400  # 2020-01-01 00:00 JST
+JST = 9 * 3600
+
+NO_DATA = 0xFFFFFFFE
+
+
+def localtime(t):
+    """
+    メーターの時計（日本時間）
+    """
+    return time.gmtime(t + JST)
+
+
+def ll64(mac):
+    """
+    MACアドレスからリンクローカルアドレスを作成（SKLL64相当）
+    """
+    mac = '{:02X}'.format(int(mac[0:2], 16) ^ 0x02) + mac[2:]
+    return 'FE80:0000:0000:0000:' + ':'.join(
+        mac[i:i + 4] for i in range(0, 16, 4))
+
+
+class SmartMeter:
+    """
+    低圧スマート電力量メータ(0x028801)のECHONET Liteオブジェクト
+    """
+    def __init__(self, *, coefficient=1, unit='01', seed=None):
+        self.coefficient = coefficient
+        self.unit = unit  # 0.1kWh
+        self.collect_day = 0  # 積算履歴収集日１(E5)
+        self.random = random.Random(seed)
+
+    def energy(self, t):
+        """
+        時刻tまでの積算電力量(kWh)
+        """
+        hours = (t - EPOCH) / 3600
+        return BASE_KWH + AVERAGE_KW * hours + DAILY_KW * 24 / (
+            2 * math.pi) * math.sin(2 * math.pi * hours / 24)
+
+    def counts(self, t):
+        """
+        時刻tまでの積算電力量計測値（係数・単位適用前）
+        """
+        scale = {'00': 1, '01': 10, '02': 100, '03': 1000, '04': 10000}
+        return int(self.energy(t) * scale.get(self.unit, 1) /
+                   self.coefficient)
+
+    def power(self, t):
+        """
+        時刻tの瞬時電力(W)
+        """
+        hours = (t - EPOCH) / 3600
+        kw = AVERAGE_KW + DAILY_KW * math.cos(2 * math.pi * hours / 24)
+        return int(kw * 1000 + self.random.uniform(-50, 50))
+
+    def history(self, day, reverse=False):
+        """
+        積算電力量計測値履歴１(E2/E4)のEDT
+        """
+        now = time.time()
+        midnight = (now + JST) // 86400 * 86400 - JST - day * 86400
+        edt = bytes([day >> 8, day & 0xFF])
+        for slot in range(48):
+            t = midnight + slot * 1800
+            value = NO_DATA if t > now else 0 if reverse else self.counts(t)
+            edt += value.to_bytes(4, 'big')
+        return edt
+
+    def fixed_time(self, reverse=False):
+        """
+        定時積算電力量計測値(EA/EB)のEDT
+        """
+        t = time.time() // 1800 * 1800
+        tm = localtime(t)
+        value = 0 if reverse else self.counts(t)
+        return bytes([tm[0] >> 8, tm[0] & 0xFF, tm[1], tm[2], tm[3], tm[4],
+                      tm[5]]) + value.to_bytes(4, 'big')
+
+    def get(self, epc):
+        """
+        プロパティ値(EDT)の取得（未対応のEPCはNone）
+        """
+        t = time.time()
+        if epc == 0x80:
+            return b'\x30'
+        if epc == 0x88:
+            return b'\x42'
+        if epc == 0xD3:
+            return self.coefficient.to_bytes(4, 'big')
+        if epc == 0xD7:
+            return b'\x06'
+        if epc == 0xE0:
+            return self.counts(t).to_bytes(4, 'big')
+        if epc == 0xE1:
+            return bytes([int(self.unit, 16)])
+        if epc == 0xE2:
+            return self.history(self.collect_day)
+        if epc == 0xE3:
+            return bytes(4)
+        if epc == 0xE4:
+            return self.history(self.collect_day, reverse=True)
+        if epc == 0xE5:
+            return bytes([self.collect_day])
+        if epc == 0xE7:
+            return self.power(t).to_bytes(4, 'big', signed=True)
+        if epc == 0xE8:
+            deciampere = self.power(t) // 20
+            return deciampere.to_bytes(2, 'big') + deciampere.to_bytes(
+                2, 'big')
+        if epc == 0xEA:
+            return self.fixed_time()
+        if epc == 0xEB:
+            return self.fixed_time(reverse=True)
+        return None
+
+    def set(self, epc, edt):
+        """
+        プロパティ値の設定（受理した場合True）
+        """
+        if epc == 0xE5 and len(edt) == 1 and edt[0] <= 99:
+            self.collect_day = edt[0]
+            return True
+        return False
+
+    def request(self, frame):
+        """
+        ECHONET Lite要求フレームを処理し、応答フレームを返す
+        """
+        if frame[0:2] != b'\x10\x81' or frame[7:10] != b'\x02\x88\x01':
+            return None
+        (tid, esv, opc) = (frame[2:4], frame[10], frame[11])
+
+        properties = []
+        failed = False
+        i = 12
+        for _ in range(opc):
+            (epc, pdc) = (frame[i], frame[i + 1])
+            edt = frame[i + 2:i + 2 + pdc]
+            i += 2 + pdc
+            if esv == 0x62:
+                value = self.get(epc)
+                if value is None:
+                    failed = True
+                    value = b''
+                properties.append((epc, value))
+            elif esv in (0x60, 0x61):
+                ok = self.set(epc, edt)
+                failed = failed or not ok
+                properties.append((epc, b'' if ok else edt))
+            else:
+                return None
+
+        if esv == 0x62:
+            res = 0x52 if failed else 0x72
+        elif esv == 0x61:
+            res = 0x51 if failed else 0x71
+        else:
+            return None  # SetI(60)は応答なし
+
+        data = b'\x10\x81' + tid + b'\x02\x88\x01' + frame[4:7] + bytes(
+            [res, len(properties)])
+        for (epc, edt) in properties:
+            data += bytes([epc, len(edt)]) + edt
+        return data
+
+
+class BP35A1Emulator:
+    """
+    BP35A1（SKコマンド）のエミュレータ
+
+    Parameters
+    ----------
+    meter : SmartMeter
+        接続先のスマートメーター
+    latency : float
+        コマンド応答の遅延（秒）
+    jitter : float
+        遅延のゆらぎ（秒、一様分布）
+    loss : float
+        ERXUDP(メーターからの応答)を損失する確率
+    rtt : float
+        無線区間の往復時間（秒）
+    time_scale : float
+        スキャン・接続にかかる時間の倍率（1.0で実機相当）
+    notify_interval : float
+        定時積算電力量(EA)を通知(INF)する間隔（秒、Noneで通知しない）
+    """
+    CHANNELS = range(0x21, 0x3D)  # 33ch - 60ch
+
+    def __init__(self,
+                 meter=None,
+                 *,
+                 latency=0.005,
+                 jitter=0.0,
+                 loss=0.0,
+                 rtt=0.1,
+                 time_scale=1.0,
+                 channel='21',
+                 pan_id='8888',
+                 mac_addr='001D129012345678',
+                 lqi='E1',
+                 scan_duration=6,
+                 notify_interval=1800,
+                 rbid=None,
+                 password=None,
+                 seed=None):
+        self.meter = meter if meter else SmartMeter(seed=seed)
+        self.latency = latency
+        self.jitter = jitter
+        self.loss = loss
+        self.rtt = rtt
+        self.time_scale = time_scale
+        self.channel = channel
+        self.pan_id = pan_id
+        self.mac_addr = mac_addr
+        self.lqi = lqi
+        self.scan_duration = scan_duration
+        self.notify_interval = notify_interval
+        self.rbid = rbid
+        self.password = password
+        self.random = random.Random(seed)
+
+        self.ipv6_addr = ll64(mac_addr)
+        self.rx = []  # (受信可能になる時刻, 連番, 行)
+        self.tx = b''
+        self.sequence = 0
+        self.next_notify = None
+        self.silent_until = 0.0
+        self.reset()
+
+        # 統計
+        self.commands = 0
+        self.frames = 0
+        self.lost = 0
+
+    def reset(self):
+        self.echo = True
+        self.registers = {}
+        self.session = False
+        self.setpwd = self.setrbid = None
+
+    def establish(self):
+        """
+        接続済み(SKJOIN後)の状態にする（スキャン・接続を省略した計測用）
+        """
+        self.echo = False
+        self.registers.update({'S2': self.channel, 'S3': self.pan_id})
+        self.session = True
+        return self.ipv6_addr
+
+    # UART インターフェース
+
+    def init(self, *args, **kwds):
+        pass
+
+    def any(self):
+        self.notify()
+        now = time.monotonic()
+        return sum(len(ln) for (t, _, ln) in self.rx if t <= now)
+
+    def readline(self):
+        self.notify()
+        if self.rx and self.rx[0][0] <= time.monotonic():
+            return self.rx.pop(0)[2]
+        return None
+
+    def readline_into(self, buf):
+        ln = self.readline()
+        if not ln:
+            return 0
+        n = min(len(ln), len(buf))
+        buf[:n] = ln[:n]
+        return n
+
+    def read(self, nbytes=None):
+        self.notify()
+        now = time.monotonic()
+        lines = []
+        while self.rx and self.rx[0][0] <= now:
+            lines.append(self.rx.pop(0)[2])
+        return b''.join(lines) if lines else None
+
+    def wait(self, timeout):
+        """
+        受信を待つ（次の応答の送出時刻か timeout(ミリ秒) まで眠る）
+        """
+        wait = timeout / 1000
+        if self.rx:
+            wait = min(wait, self.rx[0][0] - time.monotonic())
+        if self.session and self.notify_interval and self.next_notify:
+            wait = min(wait, self.next_notify - time.time())
+        if wait > 0:
+            time.sleep(wait)
+
+    def write(self, data):
+        if isinstance(data, str):
+            data = data.encode()
+        self.tx += data
+        while self.process():
+            pass
+        return len(data)
+
+    # コマンド処理
+
+    def respond(self, *lines, after=0.0):
+        """
+        応答行を送出（遅延・ゆらぎを加算し、送出時刻順に並べる）
+        """
+        t = time.monotonic() + self.latency + after
+        if self.jitter:
+            t += self.random.uniform(0, self.jitter)
+        for ln in lines:
+            self.sequence += 1
+            bisect.insort(self.rx, (t, self.sequence, ln.encode() + b'\r\n'))
+
+    def process(self):
+        """
+        送信バッファから1コマンドを取り出して処理
+        """
+        if self.tx.startswith(b'SKSENDTO'):
+            header = self.tx.split(b' ', 6)
+            if len(header) < 7:
+                return False
+            size = int(header[5], 16)
+            start = len(b' '.join(header[:6])) + 1
+            if len(self.tx) < start + size:
+                return False
+            frame = self.tx[start:start + size]
+            self.tx = self.tx[start + size:]
+            self.command(b' '.join(header[:6]).decode(), frame)
+            return True
+
+        if b'\r\n' not in self.tx:
+            return False
+        (line, self.tx) = self.tx.split(b'\r\n', 1)
+        line = line.strip().decode()
+        if line:
+            self.command(line)
+        return True
+
+    def command(self, line, frame=None):
+        self.commands += 1
+        if self.echo:
+            self.respond(line)
+
+        args = line.split(' ')
+        handler = getattr(self, 'cmd_' + args[0], None)
+        if handler is None:
+            self.respond('FAIL ER04')
+            return
+        try:
+            if frame is None:
+                handler(*args[1:])
+            else:
+                handler(*args[1:], frame)
+        except (TypeError, ValueError):
+            self.respond('FAIL ER06')
+
+    def cmd_SKRESET(self):
+        self.reset()
+        self.respond('OK')
+
+    def cmd_SKVER(self):
+        self.respond('EVER 1.2.10', 'OK')
+
+    def cmd_SKSREG(self, reg, value=None):
+        if value is None:
+            self.respond('ESREG ' + self.registers.get(reg, '00'), 'OK')
+            return
+        if reg == 'SFE':
+            self.echo = value != '0'
+        self.registers[reg] = value
+        self.respond('OK')
+
+    def cmd_ROPT(self):
+        self.respond('OK 01')
+
+    def cmd_WOPT(self, mode):
+        self.respond('OK')
+
+    def cmd_SKSETPWD(self, size, password):
+        self.setpwd = password
+        self.respond('OK')
+
+    def cmd_SKSETRBID(self, rbid):
+        self.setrbid = rbid
+        self.respond('OK')
+
+    def cmd_SKSCAN(self, mode, mask, duration):
+        (mask, duration) = (int(mask, 16), int(duration))
+        self.respond('OK')
+
+        # 1chあたり 0.96ms * (2^duration + 1)
+        per_channel = 0.00096 * (2**duration + 1) * self.time_scale
+        channels = [
+            ch for (bit, ch) in enumerate(self.CHANNELS) if mask & (1 << bit)
+        ]
+        channel = int(self.channel, 16)
+        if (channel in channels and duration >= self.scan_duration
+                and time.monotonic() >= self.silent_until):
+            found = channels.index(channel) + 1
+            self.respond('EVENT 20 ' + self.ipv6_addr,
+                         'EPANDESC',
+                         '  Channel:' + self.channel,
+                         '  Channel Page:09',
+                         '  Pan ID:' + self.pan_id,
+                         '  Addr:' + self.mac_addr,
+                         '  LQI:' + self.lqi,
+                         '  PairID:00000000',
+                         after=per_channel * found)
+        self.respond('EVENT 22 ' + self.ipv6_addr,
+                     after=per_channel * len(channels))
+
+    def cmd_SKLL64(self, mac):
+        self.respond(ll64(mac))
+
+    def cmd_SKJOIN(self, ipv6):
+        self.respond('OK')
+        joined = (ipv6 == self.ipv6_addr
+                  and time.monotonic() >= self.silent_until
+                  and self.registers.get('S2') == self.channel
+                  and self.registers.get('S3') == self.pan_id
+                  and self.setrbid == (self.rbid or self.setrbid)
+                  and self.setpwd == (self.password or self.setpwd))
+        self.session = joined
+        # PANA認証のやりとり（4往復相当）
+        self.respond('EVENT 21 {} 00'.format(self.ipv6_addr),
+                     'EVENT 02 {}'.format(self.ipv6_addr),
+                     after=self.rtt * self.time_scale)
+        self.respond('EVENT 25 {}'.format(self.ipv6_addr)
+                     if joined else 'EVENT 24 {}'.format(self.ipv6_addr),
+                     after=self.rtt * 4 * self.time_scale)
+
+    def cmd_SKTERM(self):
+        self.session = False
+        self.respond('OK', 'EVENT 27 ' + self.ipv6_addr)
+
+    def cmd_SKPING(self, ipv6):
+        self.respond('OK')
+        if ipv6 == self.ipv6_addr:
+            self.respond('EPONG ' + ipv6, after=self.rtt)
+
+    # 障害の注入
+
+    def expire_session(self):
+        """
+        PANAセッションの期限切れ（EVENT 29、再認証はしない）
+        """
+        self.session = False
+        self.respond('EVENT 29 ' + self.ipv6_addr)
+
+    def outage(self, seconds):
+        """
+        無線の途絶（seconds秒間、メーターからのERXUDPが届かない）
+        """
+        self.silent_until = time.monotonic() + seconds
+
+    def move(self, *, channel=None, pan_id=None, mac_addr=None):
+        """
+        メーターのチャンネル・PAN ID・MACアドレスの変更（セッションは切れる）
+        """
+        self.session = False
+        if channel:
+            self.channel = channel
+        if pan_id:
+            self.pan_id = pan_id
+        if mac_addr:
+            self.mac_addr = mac_addr
+            self.ipv6_addr = ll64(mac_addr)
+
+    def notify(self):
+        """
+        定時積算電力量(EA)の通知（区切りの時刻を過ぎたら送出）
+        """
+        if not (self.session and self.notify_interval):
+            return
+        now = time.time()
+        if self.next_notify is None:
+            self.next_notify = (now // self.notify_interval +
+                                1) * self.notify_interval
+        if now < self.next_notify:
+            return
+        self.next_notify += self.notify_interval
+        edt = self.meter.fixed_time()
+        data = b'\x10\x81\x00\x00\x02\x88\x01\x05\xFF\x01\x73\x01\xEA' + bytes(
+            [len(edt)]) + edt
+        self.erxudp('FF02:0000:0000:0000:0000:0000:0000:0001', data)
+
+    def erxudp(self, dest, data, after=0.0):
+        self.respond('ERXUDP {} {} 0E1A 0E1A {} 1 {:04X} {}'.format(
+            self.ipv6_addr, dest, self.mac_addr, len(data),
+            data.hex().upper()),
+                     after=after)
+
+    def cmd_SKSENDTO(self, handle, ipv6, port, sec, size, frame):
+        self.respond('EVENT 21 {} 00'.format(ipv6), 'OK')
+        if not (self.session and ipv6 == self.ipv6_addr):
+            return
+        self.frames += 1
+        if (self.loss and self.random.random() < self.loss
+            ) or time.monotonic() < self.silent_until:
+            self.lost += 1
+            return
+        data = self.meter.request(frame)
+        if data is None:
+            return
+        self.erxudp('FE80:0000:0000:0000:0000:0000:0000:0001',
+                    data,
+                    after=self.rtt)
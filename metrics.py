@@ -0,0 +1,109 @@
+"""
+ドライバの計測値（レイテンシのヒストグラムとカウンタ）
+
+ヒストグラムは固定の区切り（ミリ秒）毎の件数を数えるだけなので、
+記録してもヒープを使いません。dump() で JSON にできる dict を返します。
+"""
+from ticks import ticks_ms, ticks_diff
+
+
+# ヒストグラムの区切り（ミリ秒、最後の区切りより大きい値は最後の件数に入る）
+BOUNDS = (5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000, 30000, 60000)
+
+
+class Histogram:
+    """
+    レイテンシのヒストグラム（ミリ秒）
+    """
+    def __init__(self):
+        self.counts = [0] * (len(BOUNDS) + 1)
+        self.count = 0
+        self.sum = 0
+        self.max = 0
+
+    def observe(self, ms):
+        i = 0
+        while i < len(BOUNDS) and ms > BOUNDS[i]:
+            i += 1
+        self.counts[i] += 1
+        self.count += 1
+        self.sum += ms
+        if ms > self.max:
+            self.max = ms
+
+    def quantile(self, q):
+        """
+        q分位点の推定値（その値を含む区切りの上限、最大値を超えない）
+        """
+        if not self.count:
+            return 0
+        rank = q * self.count
+        total = 0
+        for (i, n) in enumerate(self.counts):
+            total += n
+            if total >= rank:
+                return min(BOUNDS[i], self.max) if i < len(BOUNDS) else self.max
+        return self.max
+
+    def dump(self):
+        return {
+            'count': self.count,
+            'mean': self.sum // self.count if self.count else 0,
+            'p50': self.quantile(0.5),
+            'p95': self.quantile(0.95),
+            'max': self.max,
+            'buckets': self.counts,
+        }
+
+
+class Metrics:
+    """
+    ドライバの計測値
+
+    histograms はグループ（'command', 'get', 'set', 'session'）毎の
+    名前 -> Histogram、counters は名前 -> 回数。
+    """
+    GROUPS = ('command', 'get', 'set', 'session')
+
+    def __init__(self):
+        self.started = ticks_ms()
+        self.histograms = {group: {} for group in self.GROUPS}
+        self.counters = {}
+
+    def histogram(self, group, name):
+        histograms = self.histograms[group]
+        histogram = histograms.get(name)
+        if histogram is None:
+            histogram = histograms[name] = Histogram()
+        return histogram
+
+    def observe(self, group, name, ms):
+        self.histogram(group, name).observe(ms)
+
+    def since(self, group, name, start):
+        """
+        start(ticks_ms)からの経過時間を記録
+        """
+        self.histogram(group, name).observe(ticks_diff(ticks_ms(), start))
+
+    def count(self, name, n=1):
+        self.counters[name] = self.counters.get(name, 0) + n
+
+    def reset(self):
+        self.__init__()
+
+    def dump(self):
+        """
+        計測値（JSON にできる dict）
+        """
+        return {
+            'uptime': ticks_diff(ticks_ms(), self.started) // 1000,
+            'counters': dict(self.counters),
+            'histograms': {
+                group: {
+                    name: histogram.dump()
+                    for (name, histogram) in histograms.items()
+                }
+                for (group, histograms) in self.histograms.items()
+            },
+        }
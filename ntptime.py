@@ -6,9 +6,16 @@ try:
     import ustruct as struct
 except:
     import struct
+try:
+    import utime
+except ImportError:
+    import time as utime
+from ticks import ticks_ms, ticks_diff
+
 
 # (date(2000, 1, 1) - date(1900, 1, 1)).days * 24*60*60
-NTP_DELTA = 3155673600
+# (CPython では utime.time() の起点が 1970-01-01)
+NTP_DELTA = 3155673600 if utime.localtime(0)[0] == 2000 else 2208988800
 
 # The NTP host can be configured at runtime by doing: ntptime.host = 'myhost.org'
 host = "pool.ntp.org"
@@ -39,3 +46,269 @@ def settime():
     tm = utime.localtime(t)
     machine.RTC().datetime(
         (tm[0], tm[1], tm[2], tm[6] + 1, tm[3], tm[4], tm[5], 0))
+
+
+def timestamp_ms(msg, i):
+    """
+    NTPタイムスタンプ（msg の i バイト目から）を utime.time() 起点のミリ秒に
+    """
+    (seconds, fraction) = struct.unpack('!II', msg[i:i + 8])
+    return (seconds - NTP_DELTA) * 1000 + (fraction * 1000 >> 32)
+
+
+class TimeService:
+    """
+    バックグラウンドで時刻を合わせる時刻サービス
+
+    複数の NTP サーバに問い合わせ、往復時間(delay)の最も短い応答から
+    時刻のずれ(offset)を求めます。時刻は同期した時の ticks_ms を起点に
+    数え、同期の間の ticks_ms の進み・遅れ(drift)も補正するので、now() は
+    ネットワークを使わずに ticks_ms と整数の演算だけで現在時刻を返します。
+    名前解決の結果はキャッシュし、同期は別スレッドで行います。
+
+    Parameters
+    ----------
+    hosts : tuple
+        NTP サーバ（ホスト名、または (ホスト名, ポート)）
+    interval : int
+        同期の間隔（秒）
+    retry : int
+        同期に失敗した時の再試行の間隔（秒）
+    timeout : float
+        1回の問い合わせのタイムアウト（秒）
+    set_rtc : bool
+        同期した時刻を RTC に設定する（utime.localtime() も合わせる）
+    """
+    # 名前解決の結果を保持する時間（ミリ秒）
+    DNS_TTL = 24 * 3600 * 1000
+    # RTC を設定し直すずれ、ドリフトの推定に使わない大きなずれ（ミリ秒）
+    STEP = 1000
+    # ドリフトの推定に使う同期の間隔の下限（ミリ秒）と上限(ppm)
+    MIN_DRIFT_INTERVAL = 60 * 1000
+    MAX_DRIFT = 500
+    HOSTS = ('ntp.nict.jp', 'pool.ntp.org', 'time.google.com')
+
+    def __init__(self,
+                 hosts=HOSTS,
+                 *,
+                 interval=3600,
+                 retry=60,
+                 timeout=1,
+                 set_rtc=True,
+                 logger_name=__name__):
+        import logging
+        self.hosts = hosts
+        self.interval = interval
+        self.retry = retry
+        self.timeout = timeout
+        self.set_rtc = set_rtc
+        self.logger = logging.getLogger(logger_name)
+        self.running = False
+
+        # 時刻の起点 (ticks_ms, 秒, ミリ秒, ドリフト補正の周期)
+        # 補正の周期は 1ms 進める(負なら遅らせる)経過時間（ミリ秒）
+        self.base = None
+        self.last_sync = None
+        self.drift = 0  # ppm
+        # ホスト -> (アドレス, 名前解決した時刻(ticks_ms))
+        self.addresses = {}
+
+        # 統計
+        self.syncs = 0
+        self.failures = 0
+        self.offset = None  # 最後の同期のずれ（ミリ秒）
+        self.delay = None  # 最後の同期の往復時間（ミリ秒）
+        self.server = None
+
+    def now(self):
+        """
+        現在時刻（utime.time() と同じ起点の秒、同期前は utime.time()）
+        """
+        base = self.base
+        if base is None:
+            return int(utime.time())
+        (ticks, seconds, ms, period) = base
+        elapsed = ticks_diff(ticks_ms(), ticks)
+        if period > 0:
+            elapsed += elapsed // period
+        elif period < 0:
+            elapsed -= elapsed // -period
+        return seconds + (ms + elapsed) // 1000
+
+    def local_ms(self, ticks):
+        """
+        ticks(ticks_ms)の時点の時刻（ミリ秒、同期前は utime.time()）
+        """
+        base = self.base
+        if base is None:
+            return int(utime.time()) * 1000 + ticks_diff(ticks, ticks_ms())
+        (start, seconds, ms, period) = base
+        elapsed = ticks_diff(ticks, start)
+        if period > 0:
+            elapsed += elapsed // period
+        elif period < 0:
+            elapsed -= elapsed // -period
+        return seconds * 1000 + ms + elapsed
+
+    def synced(self):
+        return self.base is not None
+
+    def resolve(self, host):
+        """
+        NTP サーバのアドレス（キャッシュ、解決できなければ None）
+        """
+        cached = self.addresses.get(host)
+        if cached and ticks_diff(ticks_ms(), cached[1]) < self.DNS_TTL:
+            return cached[0]
+        (name, port) = host if isinstance(host, tuple) else (host, 123)
+        try:
+            addr = socket.getaddrinfo(name, port)[0][-1]
+        except Exception as e:
+            self.logger.debug('resolve %s: %s', name, e)
+            return cached[0] if cached else None
+        self.addresses[host] = (addr, ticks_ms())
+        return addr
+
+    def query(self, addr):
+        """
+        NTP サーバへの問い合わせ
+
+        Returns
+        -------
+        (offset, delay, ticks, local): tuple
+            ずれ、往復時間、受信した時の ticks_ms と時刻（ミリ秒）
+        """
+        packet = bytearray(48)
+        packet[0] = 0x23  # LI=0, VN=4, Mode=3(client)
+        s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        try:
+            s.settimeout(self.timeout)
+            t1 = ticks_ms()
+            s.sendto(packet, addr)
+            msg = s.recv(48)
+            t4 = ticks_ms()
+        finally:
+            s.close()
+        if len(msg) < 48 or msg[0] & 0x07 != 4 or msg[1] == 0:
+            raise OSError('invalid NTP response')
+
+        # t2: サーバの受信時刻、t3: サーバの送信時刻
+        t2 = timestamp_ms(msg, 32)
+        t3 = timestamp_ms(msg, 40)
+        l1 = self.local_ms(t1)
+        l4 = l1 + ticks_diff(t4, t1)
+        offset = ((t2 - l1) + (t3 - l4)) // 2
+        delay = (l4 - l1) - (t3 - t2)
+        return offset, delay, t4, l4
+
+    def sync(self):
+        """
+        時刻の同期（全サーバに問い合わせ、往復時間の最も短い応答を使う）
+        """
+        best = None
+        for host in self.hosts:
+            addr = self.resolve(host)
+            if addr is None:
+                continue
+            try:
+                (offset, delay, ticks, local) = self.query(addr)
+            except Exception as e:
+                self.failures += 1
+                self.addresses.pop(host, None)
+                self.logger.debug('sync %s: %s', host, e)
+                continue
+            if best is None or delay < best[1]:
+                best = (offset, delay, ticks, local, host)
+        if best is None:
+            return False
+        (offset, delay, ticks, local, host) = best
+        self.adjust(offset, ticks, local)
+        (self.offset, self.delay, self.server) = (offset, delay, host)
+        self.syncs += 1
+        self.logger.info('sync: offset %dms, delay %dms, drift %dppm (%s)',
+                         offset, delay, self.drift, host)
+        return True
+
+    def adjust(self, offset, ticks, local):
+        """
+        時刻の起点を合わせ、前回の同期からのずれでドリフトを推定する
+        """
+        first = self.base is None
+        if not first and abs(offset) < self.STEP:
+            elapsed = ticks_diff(ticks, self.last_sync)
+            if elapsed >= self.MIN_DRIFT_INTERVAL:
+                drift = self.drift + offset * 1000000 // elapsed // 2
+                self.drift = max(-self.MAX_DRIFT, min(self.MAX_DRIFT, drift))
+        now = local + offset
+        period = 1000000 // self.drift if self.drift else 0
+        self.base = (ticks, now // 1000, now % 1000, period)
+        self.last_sync = ticks
+        if self.set_rtc and (first or abs(offset) >= self.STEP):
+            self.settime()
+
+    def rebase(self):
+        """
+        時刻の起点を現在に移す（ticks_ms の差が一周しないように）
+        """
+        base = self.base
+        if base is None:
+            return
+        ticks = ticks_ms()
+        now = self.local_ms(ticks)
+        self.base = (ticks, now // 1000, now % 1000, base[3])
+
+    def settime(self):
+        """
+        RTC の設定（machine.RTC がある場合）
+        """
+        try:
+            import machine
+        except ImportError:
+            return
+        tm = utime.localtime(self.now())
+        machine.RTC().datetime(
+            (tm[0], tm[1], tm[2], tm[6] + 1, tm[3], tm[4], tm[5], 0))
+
+    def start(self):
+        """
+        同期スレッドの開始
+        """
+        import _thread
+        self.running = True
+        _thread.start_new_thread(self.run, ())
+
+    def stop(self):
+        self.running = False
+
+    def run(self):
+        while self.running:
+            try:
+                ok = self.sync()
+            except Exception as e:
+                self.logger.error('TimeService: %s', e)
+                ok = False
+            if not ok:
+                self.rebase()
+            wait = self.interval if ok else self.retry
+            while self.running and wait > 0:
+                utime.sleep(min(wait, 1))
+                wait -= 1
+
+    def wait(self, timeout):
+        """
+        最初の同期を待つ（timeout 秒まで、同期できたら True）
+        """
+        while not self.synced() and timeout > 0:
+            utime.sleep(0.1)
+            timeout -= 0.1
+        return self.synced()
+
+    def stats(self):
+        return {
+            'syncs': self.syncs,
+            'failures': self.failures,
+            'offset': self.offset,
+            'delay': self.delay,
+            'drift': self.drift,
+            'server': self.server,
+        }
@@ -0,0 +1,122 @@
+"""
+締め切り(deadline)ベースの周期実行
+
+ジョブ毎に次の実行予定時刻を持ち、予定時刻を起点に次の予定を決めるので、
+処理に時間がかかっても周期がずれていきません（ドリフト補正）。1周期以上
+遅れた場合は遅れた回数を missed として数え、次の予定時刻まで読み飛ばします。
+"""
+from ticks import ticks_ms, ticks_add, ticks_diff, sleep_ms
+
+
+class Job:
+    """
+    周期実行するジョブ
+    """
+    def __init__(self, name, period, func, priority, deadline):
+        self.name = name
+        self.period = period  # ミリ秒
+        self.func = func
+        self.priority = priority
+        self.deadline = deadline
+
+        # 統計
+        self.runs = 0
+        self.missed = 0  # 実行できなかった周期の数
+        self.late = 0  # 許容値を超えて遅れて実行した回数
+        self.max_late = 0  # 最大の遅れ（ミリ秒）
+        self.elapsed = 0  # 実行時間の合計（ミリ秒）
+
+    def stats(self):
+        return {
+            'runs': self.runs,
+            'missed': self.missed,
+            'late': self.late,
+            'max_late': self.max_late,
+            'average': self.elapsed // self.runs if self.runs else 0,
+        }
+
+
+class Scheduler:
+    """
+    締め切りベースのスケジューラ
+
+    Parameters
+    ----------
+    tolerance : int
+        遅れとみなさない許容値（ミリ秒）
+    """
+    def __init__(self, *, tolerance=500):
+        self.tolerance = tolerance
+        self.jobs = []
+
+    def every(self, seconds, func, *, name=None, priority=0, delay=0):
+        """
+        ジョブの登録
+
+        Parameters
+        ----------
+        seconds : float
+            実行周期（秒）
+        func : function
+            実行する関数
+        name : str
+            ジョブ名（統計に使用）
+        priority : int
+            優先度（同時に予定時刻を迎えた場合、大きい方から実行）
+        delay : float
+            初回実行までの時間（秒）
+        """
+        job = Job(name if name else func.__name__, int(seconds * 1000), func,
+                  priority, ticks_add(ticks_ms(), int(delay * 1000)))
+        self.jobs.append(job)
+        self.jobs.sort(key=lambda job: -job.priority)
+        return job
+
+    def run_pending(self):
+        """
+        予定時刻を迎えたジョブを優先度順に実行
+        """
+        for job in self.jobs:
+            now = ticks_ms()
+            late = ticks_diff(now, job.deadline)
+            if late < 0:
+                continue
+
+            # 1周期以上遅れた分は読み飛ばす
+            if late >= job.period:
+                skipped = late // job.period
+                job.missed += skipped
+                job.deadline = ticks_add(job.deadline, skipped * job.period)
+                late -= skipped * job.period
+            if late > self.tolerance:
+                job.late += 1
+            job.max_late = max(job.max_late, late)
+
+            # 次の予定時刻は今回の予定時刻から1周期後
+            job.deadline = ticks_add(job.deadline, job.period)
+            job.func()
+            job.runs += 1
+            job.elapsed += ticks_diff(ticks_ms(), now)
+
+    def idle(self):
+        """
+        次の予定時刻までの時間（ミリ秒）
+        """
+        now = ticks_ms()
+        return max(0, min(ticks_diff(job.deadline, now) for job in self.jobs))
+
+    def run(self, condition=lambda: True):
+        """
+        conditionが真の間、ジョブを実行（予定時刻まではスリープ）
+        """
+        while condition():
+            self.run_pending()
+            wait = self.idle()
+            if wait:
+                sleep_ms(wait)
+
+    def stats(self):
+        """
+        ジョブ毎の統計（実行回数、読み飛ばし、遅れ、最大遅れ、平均実行時間）
+        """
+        return {job.name: job.stats() for job in self.jobs}
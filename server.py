@@ -0,0 +1,355 @@
+"""
+最新の計測値を返すローカル HTTP サーバ（読み出し専用のキャッシュ）
+
+計測を行うポーラー（SMM のジョブ、daemon.py のスレッド）が取得した値を
+Readings に書き込み、サーバはそのキャッシュだけを返します。HTTP の要求で
+スマートメーターとの通信が発生することはないので、Bルートのセッションを
+1つのまま、ホームオートメーションなど複数の利用者が値を読めます。
+
+    GET /metrics   Prometheus のテキスト形式
+    GET /          JSON
+
+応答の本文は計測値が更新されるか、値が古く(stale)なるまで使い回すので、
+要求毎の処理は本文を書き出すだけです。ポーラーは Readings.stale() で
+値を更新する必要があるかを判断できます。
+"""
+import logging
+import _thread
+try:
+    import usocket as socket
+except ImportError:
+    import socket
+try:
+    import ujson as json
+except ImportError:
+    import json
+try:
+    import utime
+except ImportError:
+    import time as utime
+from ticks import ticks_ms, ticks_add, ticks_diff
+
+
+# utime.time() の起点と UNIX 時刻の差（MicroPython は 2000-01-01 起点）
+EPOCH_OFFSET = 946684800 if utime.localtime(0)[0] == 2000 else 0
+
+# 計測値の名前、Prometheus のメトリクス名、説明
+READINGS = (
+    ('instantaneous_amperage', 'smartmeter_instantaneous_amperage_amperes',
+     'Instantaneous current (E8)'),
+    ('instantaneous_power', 'smartmeter_instantaneous_power_watts',
+     'Instantaneous power (E7)'),
+    ('total_energy', 'smartmeter_total_energy_kwh',
+     'Cumulative energy (EA)'),
+    ('monthly_energy', 'smartmeter_monthly_energy_kwh',
+     'Energy since the last collection date'),
+    ('monthly_fee', 'smartmeter_monthly_fee_yen',
+     'Electricity fee since the last collection date'),
+)
+
+
+class Readings:
+    """
+    1台のスマートメーターの最新の計測値
+
+    Parameters
+    ----------
+    meter : str
+        メーター名（Prometheus のラベル、JSON のキー）
+    max_age : int
+        有効期間（秒）。これより古い値は stale として返す
+    """
+    def __init__(self, meter='smartmeter', *, max_age=60):
+        self.meter = meter
+        self.max_age = max_age
+        # 名前 -> (受信時刻(ticks_ms), UNIX 時刻, 値, 計測日時)
+        self.values = {}
+        self.lock = _thread.allocate_lock()
+        # 変更の回数（応答の本文を作り直す目安）
+        self.version = 0
+
+    def update(self, name, value, created=None):
+        """
+        計測値の更新
+
+        Parameters
+        ----------
+        name : str
+            計測値の名前（READINGS の名前）
+        value : int or float
+            計測値
+        created : str
+            計測日時（スマートメーターの日時、省略可）
+        """
+        entry = (ticks_ms(), utime.time() + EPOCH_OFFSET, value, created)
+        self.lock.acquire()
+        self.values[name] = entry
+        self.version += 1
+        self.lock.release()
+
+    def get(self, name):
+        """
+        計測値（なければ None）
+        """
+        entry = self.values.get(name)
+        return entry[2] if entry else None
+
+    def age(self, name):
+        """
+        計測値を更新してからの経過時間（ミリ秒、なければ None）
+        """
+        entry = self.values.get(name)
+        return ticks_diff(ticks_ms(), entry[0]) if entry else None
+
+    def stale(self, name, max_age=None):
+        """
+        計測値が有効期間を過ぎているか（なければ True）
+        """
+        age = self.age(name)
+        max_age = self.max_age if max_age is None else max_age
+        return age is None or age >= max_age * 1000
+
+    def snapshot(self):
+        """
+        全計測値のコピーと、次に値が古くなる時刻(ticks_ms、なければ None)
+        """
+        self.lock.acquire()
+        values = dict(self.values)
+        self.lock.release()
+        now = ticks_ms()
+        (result, expires) = ({}, None)
+        for (name, (received, t, value, created)) in values.items():
+            expire = ticks_add(received, self.max_age * 1000)
+            stale = ticks_diff(expire, now) <= 0
+            if not stale and (expires is None
+                              or ticks_diff(expire, expires) < 0):
+                expires = expire
+            result[name] = {
+                'value': value,
+                'time': t,
+                'created': created,
+                'stale': stale
+            }
+        return result, expires
+
+
+def labels(meter, reading=None):
+    if reading is None:
+        return '{{meter="{}"}}'.format(meter)
+    return '{{meter="{}",reading="{}"}}'.format(meter, reading)
+
+
+def prometheus(snapshots):
+    """
+    Prometheus のテキスト形式（snapshots: [(メーター名, 計測値)]）
+    """
+    lines = []
+    for (name, metric, help) in READINGS:
+        lines.append('# HELP {} {}'.format(metric, help))
+        lines.append('# TYPE {} gauge'.format(metric))
+        for (meter, values) in snapshots:
+            if name in values:
+                lines.append('{}{} {}'.format(metric, labels(meter),
+                                              values[name]['value']))
+    for (metric, key, help) in (
+        ('smartmeter_updated_timestamp_seconds', 'time',
+         'Time the reading was updated'),
+        ('smartmeter_stale', 'stale', 'Reading is older than the limit'),
+    ):
+        lines.append('# HELP {} {}'.format(metric, help))
+        lines.append('# TYPE {} gauge'.format(metric))
+        for (meter, values) in snapshots:
+            for (name, value) in values.items():
+                lines.append('{}{} {}'.format(metric, labels(meter, name),
+                                              int(value[key])))
+    return '\n'.join(lines) + '\n'
+
+
+class Server:
+    """
+    計測値の HTTP サーバ（読み出し専用、接続毎のスレッドで応答）
+
+    遅い・無言の接続が他の読み出しを待たせないよう、接続は最大 workers
+    個まで別スレッドで処理します（超えた分は待ち受けスレッドで処理）。
+
+    Parameters
+    ----------
+    readings : list of Readings
+        応答する計測値（メーター毎）
+    host : str
+        待ち受けるアドレス
+    port : int
+        待ち受けるポート
+    timeout : float
+        1接続あたりの受信のタイムアウト（秒）
+    workers : int
+        接続を処理するスレッドの最大数
+    """
+    def __init__(self,
+                 readings,
+                 *,
+                 host='0.0.0.0',
+                 port=8080,
+                 timeout=2,
+                 workers=4,
+                 logger_name=__name__):
+        self.readings = readings
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.workers = workers
+        self.active = 0  # 処理中の接続のスレッド数
+        self.lock = _thread.allocate_lock()
+        self.logger = logging.getLogger(logger_name)
+        self.socket = None
+        self.running = False
+
+        # 応答の本文のキャッシュ（パス -> (更新回数, 有効期限, 本文)）
+        self.bodies = {}
+
+        # 統計
+        self.requests = 0
+        self.rendered = 0
+        self.errors = 0
+        self.peak = 0  # 同時に処理した接続のスレッド数の最大
+
+    def body(self, path):
+        """
+        パスに対する応答（(Content-Type, 本文)、なければ None）
+        """
+        if path == '/metrics':
+            content_type = 'text/plain; version=0.0.4'
+        elif path in ('/', '/readings.json'):
+            content_type = 'application/json'
+        else:
+            return None
+
+        # 計測値が更新されておらず、古くなった値もなければ前回の本文
+        version = sum(r.version for r in self.readings)
+        cached = self.bodies.get(path)
+        if cached and cached[0] == version and (
+                cached[1] is None or ticks_diff(cached[1], ticks_ms()) > 0):
+            return content_type, cached[2]
+
+        (snapshots, expires) = ([], None)
+        for readings in self.readings:
+            (values, expire) = readings.snapshot()
+            snapshots.append((readings.meter, values))
+            if expire is not None and (expires is None
+                                       or ticks_diff(expire, expires) < 0):
+                expires = expire
+        if path == '/metrics':
+            body = prometheus(snapshots)
+        else:
+            body = json.dumps(dict(snapshots))
+        body = body.encode()
+        self.bodies[path] = (version, expires, body)
+        self.rendered += 1
+        return content_type, body
+
+    def respond(self, request):
+        """
+        要求行（例: b'GET /metrics HTTP/1.1'）に対する応答（bytes）
+        """
+        parts = request.split()
+        if len(parts) < 2 or parts[0] not in (b'GET', b'HEAD'):
+            return b'HTTP/1.0 405 Method Not Allowed\r\n\r\n'
+        result = self.body(parts[1].decode().split('?')[0])
+        if result is None:
+            return b'HTTP/1.0 404 Not Found\r\n\r\n'
+        (content_type, body) = result
+        header = 'HTTP/1.0 200 OK\r\nContent-Type: {}\r\n' \
+                 'Content-Length: {}\r\nConnection: close\r\n\r\n'.format(
+                     content_type, len(body)).encode()
+        return header if parts[0] == b'HEAD' else header + body
+
+    def handle(self, conn):
+        conn.settimeout(self.timeout)
+        stream = conn.makefile('rwb', 0)
+        try:
+            request = stream.readline()
+            # ヘッダは読み捨てる
+            while True:
+                ln = stream.readline()
+                if not ln or ln in (b'\r\n', b'\n'):
+                    break
+            self.requests += 1
+            conn.sendall(self.respond(request))
+        finally:
+            if stream is not conn:
+                stream.close()
+            conn.close()
+
+    def bind(self):
+        addr = socket.getaddrinfo(self.host, self.port)[0][-1]
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.socket.bind(addr)
+        self.socket.listen(4)
+        self.logger.info('Server: listening on %s:%d', self.host, self.port)
+
+    def start(self):
+        """
+        待ち受けスレッドの開始
+        """
+        self.bind()
+        self.running = True
+        _thread.start_new_thread(self.run, ())
+
+    def stop(self):
+        self.running = False
+        if self.socket:
+            self.socket.close()
+
+    def run(self):
+        while self.running:
+            try:
+                (conn, _) = self.socket.accept()
+            except OSError:
+                if not self.running:
+                    break
+                self.errors += 1
+                continue
+            self.lock.acquire()
+            spawn = self.active < self.workers
+            if spawn:
+                self.active += 1
+                self.peak = max(self.peak, self.active)
+            self.lock.release()
+            if spawn:
+                try:
+                    _thread.start_new_thread(self.serve, (conn, True))
+                    continue
+                except Exception as e:
+                    self.logger.debug('Server: %s', e)
+                    self.release()
+            self.serve(conn, False)
+
+    def serve(self, conn, worker):
+        """
+        1接続の処理（worker なら処理後にスレッド数を戻す）
+        """
+        try:
+            self.handle(conn)
+        except Exception as e:
+            self.errors += 1
+            self.logger.debug('Server: %s', e)
+        finally:
+            if worker:
+                self.release()
+
+    def release(self):
+        self.lock.acquire()
+        self.active -= 1
+        self.lock.release()
+
+    def stats(self):
+        """
+        応答状況（要求数、本文を作り直した回数、エラー数、同時処理数の最大）
+        """
+        return {
+            'requests': self.requests,
+            'rendered': self.rendered,
+            'errors': self.errors,
+            'peak': self.peak,
+        }
@@ -0,0 +1,300 @@
+"""
+計測値の保存（フラッシュ上の固定長リングバッファ）と集計
+
+1レコードは (時刻, 電流, 電力, 電力量) の4つの int32 で、array('i') として
+保存します。書き込みは batch 件ずつまとめて行い、フラッシュの書き換え回数を
+抑えます。毎時・日毎・検針期間毎の集計(Rollup)は追加時に更新するので、
+「今月の電力量」「今日のピーク電力」は O(1) で参照できます。
+"""
+from array import array
+try:
+    import ujson as json
+except ImportError:
+    import json
+try:
+    import utime
+    gmtime = utime.localtime  # MicroPython の RTC は UTC
+except ImportError:
+    import time as utime
+    gmtime = utime.gmtime
+
+MAGIC = 0x534D4D31  # 'SMM1'
+HEADER = 4  # (MAGIC, capacity, head, count)
+FIELDS = 4  # (time, amperage[0.1A], power[W], energy[Wh])
+UNKNOWN = -1  # 電力量が不明のレコード
+RECORD_SIZE = FIELDS * 4
+
+
+def energy_kwh(wh):
+    return None if wh == UNKNOWN else wh / 1000
+
+
+class Rollup:
+    """
+    集計期間1つ分の集計値
+    """
+    def __init__(self, key=None):
+        self.key = key
+        self.energy = 0.0  # 電力量(kWh)
+        self.peak_power = 0  # 最大電力(W)
+        self.peak_amperage = 0.0  # 最大電流(A)
+        self.power_sum = 0  # 平均電力算出用
+        self.count = 0
+
+    def update(self, amperage, power, energy):
+        self.energy += energy
+        self.peak_power = max(self.peak_power, power)
+        self.peak_amperage = max(self.peak_amperage, amperage)
+        self.power_sum += power
+        self.count += 1
+
+    def mean_power(self):
+        return self.power_sum / self.count if self.count else 0
+
+    def dump(self):
+        return [
+            self.key, self.energy, self.peak_power, self.peak_amperage,
+            self.power_sum, self.count
+        ]
+
+    @classmethod
+    def load(cls, values):
+        rollup = cls()
+        (rollup.key, rollup.energy, rollup.peak_power, rollup.peak_amperage,
+         rollup.power_sum, rollup.count) = values
+        return rollup
+
+
+class Store:
+    """
+    計測値のリングバッファと集計
+
+    Parameters
+    ----------
+    path : str
+        レコードファイルのパス（集計値は path + '.json' に保存）
+    capacity : int
+        保存するレコード数（既定は10秒毎で1日分）
+    batch : int
+        まとめて書き込むレコード数
+    collect_date : int
+        検針日（検針期間毎の集計に使用）
+    offset : int
+        集計の区切りに使うタイムゾーンのオフセット（秒）
+    history : dict
+        集計の種類毎に保持する過去の集計数
+    """
+    def __init__(self,
+                 path,
+                 *,
+                 capacity=8640,
+                 batch=30,
+                 collect_date=1,
+                 offset=9 * 3600,
+                 history=None):
+        self.path = path
+        self.capacity = capacity
+        self.batch = batch
+        self.collect_date = int(collect_date)
+        self.offset = offset
+        self.history_size = history if history else {
+            'hour': 48,
+            'day': 62,
+            'period': 24
+        }
+
+        self.head = 0
+        self.count = 0
+        self.pending = array('i')
+        self.last_energy = None
+        self.rollups = {kind: Rollup() for kind in self.history_size}
+        self.history = {kind: [] for kind in self.history_size}
+        self.load()
+
+    # ファイル
+
+    def load(self):
+        """
+        ヘッダと集計値の読み込み（容量が異なる場合は作り直す）
+        """
+        header = array('i', bytes(HEADER * 4))
+        try:
+            with open(self.path, 'rb') as f:
+                f.readinto(header)
+            if header[0] == MAGIC and header[1] == self.capacity:
+                (self.head, self.count) = (header[2], header[3])
+            else:
+                self.create()
+        except OSError:
+            self.create()
+
+        try:
+            with open(self.path + '.json') as f:
+                state = json.load(f)
+            self.last_energy = state['last_energy']
+            for kind in self.rollups:
+                self.rollups[kind] = Rollup.load(state['rollups'][kind])
+                self.history[kind] = [
+                    Rollup.load(values) for values in state['history'][kind]
+                ]
+        except (OSError, ValueError, KeyError):
+            pass
+
+    def create(self):
+        """
+        空のレコードファイルを作成
+        """
+        (self.head, self.count) = (0, 0)
+        with open(self.path, 'wb') as f:
+            self.write_header(f)
+
+    def write_header(self, f):
+        f.seek(0)
+        f.write(array('i', (MAGIC, self.capacity, self.head, self.count)))
+
+    def flush(self):
+        """
+        保留中のレコードと集計値を書き込む
+        """
+        if not self.pending:
+            return
+        with open(self.path, 'r+b') as f:
+            records = len(self.pending) // FIELDS
+            done = 0
+            while done < records:
+                # リングの末尾で折り返す
+                n = min(records - done, self.capacity - self.head)
+                f.seek((HEADER + self.head * FIELDS) * 4)
+                f.write(self.pending[done * FIELDS:(done + n) * FIELDS])
+                self.head = (self.head + n) % self.capacity
+                done += n
+            self.count = min(self.count + records, self.capacity)
+            self.write_header(f)
+        self.pending = array('i')
+
+        with open(self.path + '.json', 'w') as f:
+            json.dump(
+                {
+                    'last_energy': self.last_energy,
+                    'rollups': {
+                        kind: rollup.dump()
+                        for (kind, rollup) in self.rollups.items()
+                    },
+                    'history': {
+                        kind: [rollup.dump() for rollup in history]
+                        for (kind, history) in self.history.items()
+                    },
+                }, f)
+
+    # 追加と集計
+
+    def keys(self, t):
+        """
+        時刻tが属する集計期間のキー
+        """
+        t += self.offset
+        (year, month, mday) = gmtime(t)[:3]
+        if mday < self.collect_date:
+            (year, month) = (year - 1, 12) if month == 1 else (year,
+                                                                 month - 1)
+        return {
+            'hour': t // 3600 * 3600 - self.offset,
+            'day': t // 86400 * 86400 - self.offset,
+            'period': '{:04d}-{:02d}-{:02d}'.format(year, month,
+                                                    self.collect_date),
+        }
+
+    def append(self, t, amperage, power, energy):
+        """
+        計測値の追加
+
+        Parameters
+        ----------
+        t : int
+            時刻（utime.time()）
+        amperage : float
+            瞬時電流(A)
+        power : int
+            瞬時電力(W)
+        energy : float
+            積算電力量(kWh)。検針日に0に戻る値（今月の電力量）でもよい。
+            None は不明（電力量を集計しない）
+        """
+        t = int(t)
+        keys = self.keys(t)
+        wh = UNKNOWN if energy is None else int(energy * 1000)
+        self.pending.extend((t, int(amperage * 10), int(power), wh))
+
+        # 前回からの増分（値が戻った場合は、検針期間が変わった時だけ
+        # リセットとみなし、それ以外は増えるまで集計しない）
+        delta = 0.0
+        if energy is not None:
+            if self.last_energy is None:
+                self.last_energy = energy
+            elif energy >= self.last_energy:
+                delta = energy - self.last_energy
+                self.last_energy = energy
+            elif keys['period'] != self.rollups['period'].key:
+                delta = energy
+                self.last_energy = energy
+
+        for (kind, key) in keys.items():
+            rollup = self.rollups[kind]
+            if rollup.key != key:
+                if rollup.key is not None:
+                    history = self.history[kind]
+                    history.append(rollup)
+                    if len(history) > self.history_size[kind]:
+                        history.pop(0)
+                rollup = self.rollups[kind] = Rollup(key)
+            rollup.update(amperage, power, delta)
+
+        if len(self.pending) >= self.batch * FIELDS:
+            self.flush()
+
+    def rollup(self, kind):
+        """
+        現在の集計値（kind: 'hour', 'day', 'period'）
+        """
+        return self.rollups[kind]
+
+    def period_energy(self):
+        """
+        今月（検針期間）の電力量(kWh)
+        """
+        return self.rollups['period'].energy
+
+    def today_peak(self):
+        """
+        今日の最大電力(W)
+        """
+        return self.rollups['day'].peak_power
+
+    # 読み出し
+
+    def records(self, chunk=64):
+        """
+        保存済みのレコードを古い順に返す
+
+        Yields
+        ------
+        (t, amperage, power, energy): tuple
+            （energy は不明なら None）
+        """
+        buf = array('i', bytes(chunk * RECORD_SIZE))
+        start = (self.head - self.count) % self.capacity
+        with open(self.path, 'rb') as f:
+            remaining = self.count
+            index = start
+            while remaining:
+                n = min(remaining, chunk, self.capacity - index)
+                f.seek((HEADER + index * FIELDS) * 4)
+                f.readinto(memoryview(buf)[:n * FIELDS])
+                for i in range(0, n * FIELDS, FIELDS):
+                    yield (buf[i], buf[i + 1] / 10, buf[i + 2],
+                           energy_kwh(buf[i + 3]))
+                remaining -= n
+                index = (index + n) % self.capacity
+        for i in range(0, len(self.pending), FIELDS):
+            p = self.pending
+            yield (p[i], p[i + 1] / 10, p[i + 2], energy_kwh(p[i + 3]))
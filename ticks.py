@@ -0,0 +1,22 @@
+"""
+ミリ秒単位の時刻(ticks_ms)と待ち
+
+MicroPython では utime の関数をそのまま使い、CPython では
+time.monotonic() で代替します（ホストでの実行、エミュレータ、ベンチマーク用）。
+"""
+try:
+    from utime import ticks_ms, ticks_add, ticks_diff, sleep_ms
+except ImportError:
+    import time
+
+    def ticks_ms():
+        return int(time.monotonic() * 1000)
+
+    def ticks_add(ticks, delta):
+        return ticks + delta
+
+    def ticks_diff(end, start):
+        return end - start
+
+    def sleep_ms(ms):
+        time.sleep(ms / 1000)
@@ -0,0 +1,365 @@
+"""
+BP35A1 との通信路(UART)
+
+BP35A1 は machine.UART と同じインターフェース(any/readline/read/readinto/
+write)を持つオブジェクトで通信します。ここではその実装として、
+MicroPython の UART、pyserial、pty、メモリ上のスタブを用意しています。
+デバイス固有のモジュール(machine, serial)は使う時に読み込むので、
+このモジュールの import は軽量です。
+
+各実装(Transport)は受信データを固定長のバッファに非ブロッキングの
+readinto で読み込み、行単位で切り出します。readline() はタイムアウト
+（ミリ秒）まで行の終わりを待ち、readline_into() は受信済みの1行を
+呼び出し側のバッファにコピーします（ヒープを使わない）。
+"""
+import os
+from ticks import ticks_ms, ticks_add, ticks_diff, sleep_ms
+
+
+class Transport:
+    """
+    バッファ付きの通信路（各実装の基底クラス）
+
+    派生クラスは fill_into()（非ブロッキングの読み込み）と write() を
+    実装します。
+
+    Parameters
+    ----------
+    size : int
+        受信バッファの大きさ（1行の最大長）
+    timeout : int
+        readline() で行の終わりを待つ時間（ミリ秒）
+    """
+    def __init__(self, *, size=1024, timeout=2000):
+        self.buf = bytearray(size)
+        self.view = memoryview(self.buf)
+        self.start = 0
+        self.end = 0
+        self.scan = 0  # 改行を探し終えた位置
+        self.timeout = timeout
+
+        # 統計
+        self.bytes_in = 0
+        self.bytes_out = 0
+
+    def init(self, *args, **kwds):
+        pass
+
+    def fileno(self):
+        """
+        select/poll で待つためのファイル記述子（ない場合は None）
+        """
+        return None
+
+    def fill_into(self, view):
+        """
+        受信済みのデータを view に読み込む（非ブロッキング、読んだバイト数）
+        """
+        raise NotImplementedError
+
+    def write(self, data):
+        raise NotImplementedError
+
+    def fill(self):
+        """
+        受信データをバッファに追加（バッファの先頭を詰めてから読む）
+        """
+        if self.start == self.end:
+            self.start = self.end = self.scan = 0
+        elif self.end == len(self.buf) and self.start:
+            n = self.end - self.start
+            self.buf[:n] = self.view[self.start:self.end]
+            self.scan -= self.start
+            (self.start, self.end) = (0, n)
+        if self.end < len(self.buf):
+            n = self.fill_into(self.view[self.end:])
+            if n:
+                self.end += n
+                self.bytes_in += n
+                return n
+        return 0
+
+    def wait(self, timeout):
+        """
+        受信を待つ（ファイル記述子があれば select、なければ 1ms 毎に確認）
+        """
+        fd = self.fileno()
+        if fd is None:
+            sleep_ms(min(timeout, 1))
+            return
+        import select
+        select.select([fd], [], [], timeout / 1000)
+
+    def any(self):
+        self.fill()
+        return self.end - self.start
+
+    def readinto(self, buf, nbytes=None):
+        """
+        受信済みのデータを buf にコピー（非ブロッキング、データがなければ None）
+        """
+        self.fill()
+        n = min(self.end - self.start,
+                len(buf) if nbytes is None else nbytes)
+        if not n:
+            return None
+        buf[:n] = self.view[self.start:self.start + n]
+        self.consume(self.start + n)
+        return n
+
+    def read(self, nbytes=None):
+        self.fill()
+        n = self.end - self.start
+        if nbytes is not None:
+            n = min(n, nbytes)
+        if not n:
+            return None
+        data = bytes(self.view[self.start:self.start + n])
+        self.consume(self.start + n)
+        return data
+
+    def consume(self, end):
+        self.start = end
+        self.scan = max(self.scan, end)
+
+    def find_line(self):
+        """
+        バッファ内の最初の行の終わり（改行の次の位置、なければ 0）
+
+        前回探し終えた位置から探すので、受信したデータは1回だけ走査する。
+        """
+        (buf, i, end) = (self.buf, max(self.scan, self.start), self.end)
+        while i < end:
+            if buf[i] == 0x0A:
+                self.scan = i + 1
+                return i + 1
+            i += 1
+        self.scan = i
+        return 0
+
+    def line_end(self):
+        """
+        1行分の終わり（行が長すぎてバッファが一杯なら、その終わり）
+        """
+        end = self.find_line()
+        if not end and self.end - self.start == len(self.buf):
+            end = self.end
+        return end
+
+    def readline_into(self, buf):
+        """
+        1行を buf に読み込む（非ブロッキング、バイト数、行がなければ 0）
+        """
+        self.fill()
+        end = self.line_end()
+        if not end:
+            return 0
+        n = min(end - self.start, len(buf))
+        buf[:n] = self.view[self.start:self.start + n]
+        self.consume(end)
+        return n
+
+    def readline(self):
+        """
+        1行受信（timeout まで行の終わりを待ち、来なければ受信済みの分を返す）
+        """
+        deadline = ticks_add(ticks_ms(), self.timeout)
+        self.fill()
+        end = self.line_end()
+        while not end:
+            remaining = ticks_diff(deadline, ticks_ms())
+            if remaining <= 0:
+                end = self.end
+                break
+            self.wait(remaining)
+            if self.fill():
+                end = self.line_end()
+        if end == self.start:
+            return None
+        line = bytes(self.view[self.start:end])
+        self.consume(end)
+        return line
+
+
+class MicroPythonUART(Transport):
+    """
+    MicroPython の machine.UART（既定は M5StickC の Grove ポート）
+
+    UART ドライバに溜まったデータを readinto でバッファに移し、
+    uselect.poll で受信を待ちます。raw は uasyncio の StreamReader に
+    渡すための machine.UART です。
+    """
+    def __init__(self, id=1, *, tx=0, rx=36, baudrate=115200, **kwds):
+        super().__init__(**kwds)
+        import machine
+        self.raw = machine.UART(id, tx=tx, rx=rx)
+        self.raw.init(baudrate, bits=8, parity=None, stop=1, timeout=0)
+        self.poller = None
+
+    def fill_into(self, view):
+        if not self.raw.any():
+            return 0
+        return self.raw.readinto(view) or 0
+
+    def wait(self, timeout):
+        if self.poller is None:
+            import uselect
+            self.poller = uselect.poll()
+            self.poller.register(self.raw, uselect.POLLIN)
+        self.poller.poll(timeout)
+
+    def write(self, data):
+        n = len(data)
+        self.bytes_out += n
+        return self.raw.write(data)
+
+
+class SerialTransport(Transport):
+    """
+    pyserial のシリアルポート（USB 接続の Wi-SUN ドングルなど）
+
+    Parameters
+    ----------
+    port : str
+        ポート名（例: '/dev/ttyUSB0'）
+    baudrate : int
+        ボーレート
+    """
+    def __init__(self, port, baudrate=115200, **kwds):
+        super().__init__(**kwds)
+        import serial
+        self.serial = serial.Serial(port, baudrate, timeout=0)
+
+    def fileno(self):
+        try:
+            return self.serial.fileno()
+        except Exception:
+            return None
+
+    def fill_into(self, view):
+        n = self.serial.in_waiting
+        if not n:
+            return 0
+        return self.serial.readinto(view[:n]) or 0
+
+    def write(self, data):
+        if isinstance(data, str):
+            data = data.encode()
+        self.bytes_out += len(data)
+        return self.serial.write(data)
+
+    def close(self):
+        self.serial.close()
+
+
+class PtyTransport(Transport):
+    """
+    擬似端末（pty）
+
+    Parameters
+    ----------
+    path : str
+        擬似端末のパス（例: '/dev/pts/3'）。
+        fd を指定した場合は開いているファイル記述子を使う
+    """
+    def __init__(self, path=None, *, fd=None, **kwds):
+        super().__init__(**kwds)
+        if fd is None:
+            fd = os.open(path, os.O_RDWR | os.O_NOCTTY)
+        import tty
+        tty.setraw(fd)
+        os.set_blocking(fd, False)
+        self.fd = fd
+
+    @classmethod
+    def pair(cls, **kwds):
+        """
+        新しい擬似端末を作成（(マスター側の Transport, スレーブ側のパス)）
+        """
+        (master, slave) = os.openpty()
+        name = os.ttyname(slave)
+        import tty
+        tty.setraw(slave)
+        os.close(slave)
+        return cls(fd=master, **kwds), name
+
+    def fileno(self):
+        return self.fd
+
+    def fill_into(self, view):
+        try:
+            return os.readv(self.fd, [view])
+        except (BlockingIOError, InterruptedError):
+            return 0
+        except OSError:
+            # スレーブ側が閉じられた
+            return 0
+
+    def write(self, data):
+        if isinstance(data, str):
+            data = data.encode()
+        view = memoryview(data)
+        while view:
+            try:
+                n = os.write(self.fd, view)
+            except BlockingIOError:
+                self.wait_writable()
+                continue
+            view = view[n:]
+        self.bytes_out += len(data)
+        return len(data)
+
+    def wait_writable(self):
+        import select
+        select.select([], [self.fd], [], self.timeout / 1000)
+
+    def close(self):
+        os.close(self.fd)
+
+
+class MemoryTransport(Transport):
+    """
+    メモリ上のスタブ（受信データは feed() で与え、送信データは sent に溜まる）
+    """
+    def __init__(self, data=b'', **kwds):
+        super().__init__(**kwds)
+        self.incoming = bytearray(data)
+        self.sent = bytearray()
+
+    def feed(self, data):
+        if isinstance(data, str):
+            data = data.encode()
+        self.incoming += data
+
+    def fill_into(self, view):
+        n = min(len(view), len(self.incoming))
+        if n:
+            view[:n] = self.incoming[:n]
+            del self.incoming[:n]
+        return n
+
+    def write(self, data):
+        if isinstance(data, str):
+            data = data.encode()
+        self.sent += data
+        self.bytes_out += len(data)
+        return len(data)
+
+
+def create(spec):
+    """
+    文字列から通信路を作成
+
+    'uart:1'（MicroPython の UART 番号）、'serial:/dev/ttyUSB0'、
+    'pty:/dev/pts/3'、'memory:'、またはポート名（pyserial）
+    """
+    (kind, _, arg) = spec.partition(':')
+    if kind == 'uart':
+        return MicroPythonUART(int(arg) if arg else 1)
+    if kind == 'serial':
+        return SerialTransport(arg)
+    if kind == 'pty':
+        return PtyTransport(arg)
+    if kind == 'memory':
+        return MemoryTransport(arg.encode())
+    return SerialTransport(spec)
@@ -0,0 +1,153 @@
+"""
+Ambient へのバックグラウンド送信
+
+計測値をメモリ上の有限長キューに積み、別スレッドでまとめて送信します。
+送信に失敗した場合は指数バックオフで再送し、キューが溢れた場合は古い
+計測値から破棄します。サーバが拒否した(4xx)計測値は再送しても通らないので
+破棄し、後続の計測値を止めません。メインループはネットワークを待ちません。
+"""
+import logging
+import _thread
+try:
+    import utime
+except ImportError:
+    import time as utime
+
+
+class Uploader:
+    """
+    Ambient へのバッチ送信
+
+    Parameters
+    ----------
+    client : ambient.Ambient
+        Ambient のクライアント
+    maxlen : int
+        キューに保持する計測値の最大数
+    batch : int
+        1回のリクエストで送信する計測値の最大数
+    interval : int
+        送信間隔（秒）
+    backoff : int
+        送信失敗時の再送間隔の上限（秒）
+    """
+    def __init__(self,
+                 client,
+                 *,
+                 maxlen=120,
+                 batch=20,
+                 interval=60,
+                 backoff=960,
+                 logger_name=__name__):
+        self.client = client
+        self.maxlen = maxlen
+        self.batch = batch
+        self.interval = interval
+        self.backoff = backoff
+        self.logger = logging.getLogger(logger_name)
+
+        self.queue = []
+        self.lock = _thread.allocate_lock()
+        self.running = False
+
+        # 統計
+        self.queued = 0
+        self.sent = 0
+        self.dropped = 0
+        self.failed = 0
+
+    def put(self, sample):
+        """
+        計測値をキューに追加（満杯の場合は最も古い計測値を破棄）
+
+        Parameters
+        ----------
+        sample : dict
+            Ambient に送信するデータ（例: {'created': ..., 'd1': ...}）
+        """
+        self.lock.acquire()
+        if len(self.queue) >= self.maxlen:
+            self.queue.pop(0)
+            self.dropped += 1
+        self.queue.append(sample)
+        self.queued += 1
+        self.lock.release()
+
+    def start(self):
+        """
+        送信スレッドの開始
+        """
+        self.running = True
+        _thread.start_new_thread(self.run, ())
+
+    def stop(self):
+        self.running = False
+
+    def run(self):
+        wait = self.interval
+        while self.running:
+            utime.sleep(wait)
+            try:
+                wait = self.interval if self.send() else min(
+                    wait * 2, self.backoff)
+            except Exception as e:
+                self.logger.error('Uploader: %s', e)
+                self.failed += 1
+                wait = min(wait * 2, self.backoff)
+
+    def send(self):
+        """
+        キューの先頭から batch 件を送信
+
+        成功した場合と、サーバに拒否された(4xx)場合はキューから削除する。
+        それ以外(5xx)は False を返し、呼び出し側で間隔を延ばして再送する。
+        """
+        self.lock.acquire()
+        samples = self.queue[:self.batch]
+        dropped = self.dropped
+        self.lock.release()
+        if not samples:
+            return True
+
+        result = self.client.send(samples)
+        status = result.status_code
+        result.close()
+        if status != 200:
+            self.failed += 1
+            self.logger.error('Uploader: ambient.send() failed. status: %s',
+                              status)
+            if not 400 <= status < 500:
+                return False
+            # 拒否された計測値は破棄する
+            self.remove(samples, dropped, rejected=True)
+            return True
+
+        self.remove(samples, dropped)
+        self.sent += len(samples)
+        self.logger.debug('Uploader: sent %d samples', len(samples))
+        return True
+
+    def remove(self, samples, dropped, rejected=False):
+        """
+        送信した（rejected なら拒否された）計測値をキューの先頭から削除
+
+        送信中にキューが溢れて破棄された分（dropped からの増分）は差し引く。
+        """
+        self.lock.acquire()
+        n = max(0, len(samples) - (self.dropped - dropped))
+        del self.queue[:n]
+        if rejected:
+            self.dropped += n
+        self.lock.release()
+
+    def stats(self):
+        """
+        送信状況（キュー投入数、送信数、破棄数、失敗数、未送信数）
+        """
+        return {
+            'queued': self.queued,
+            'sent': self.sent,
+            'dropped': self.dropped,
+            'failed': self.failed,
+            'pending': len(self.queue),
+        }